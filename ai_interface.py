@@ -1,5 +1,18 @@
+import asyncio
 import logging
-from openai import OpenAI  # Импортируем OpenAI клиент
+import threading
+import time
+from typing import AsyncIterator, Iterator
+
+import openai
+
+from conversation_store import conversation_store, conversation_digest, estimate_tokens
+from generation_tracker import CancelEvent
+from llm_router import LLMRouter, NoAvailableEndpointError, served_endpoint
+from metrics import LLM_REQUEST_SECONDS, LLM_TIME_TO_FIRST_TOKEN_SECONDS, LLM_TOKENS_PER_SECOND, LLM_TOKENS
+from quota import quota_engine
+from response_cache import ResponseCache
+from log_pipeline import event
 
 # Импортируем настройки из config.py
 try:
@@ -10,79 +23,443 @@ except ImportError:
     NEURO_MODEL_NAME = None
     NEURO_API_KEY = "NA"  # Ставим значение по умолчанию, если ключ не нужен
 
+try:
+    from config import (RESPONSE_CACHE_SIZE, RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_TTL,
+                        RESPONSE_CACHE_MAX_TEMPERATURE, RESPONSE_CACHE_DB)
+except ImportError:
+    RESPONSE_CACHE_SIZE = 1000  # Записей в памяти (0 - кэш ответов выключен)
+    RESPONSE_CACHE_MAX_BYTES = 8 * 1024 * 1024  # Суммарный размер ответов в памяти
+    RESPONSE_CACHE_TTL = 3600.0  # Срок жизни ответа в кэше, секунды
+    RESPONSE_CACHE_MAX_TEMPERATURE = 0.8  # При temperature выше ответы не кэшируются
+    RESPONSE_CACHE_DB = None  # Файл SQLite для дискового уровня кэша (None - только память)
+
+try:
+    from config import RESPONSE_CACHE_MAX_CONTEXT_TOKENS
+except ImportError:
+    # История диалога (без системного промпта) длиннее - ответ не кэшируется: такой контекст не повторится.
+    # 0 - кэшировать только первое сообщение диалога
+    RESPONSE_CACHE_MAX_CONTEXT_TOKENS = 200
+
+try:
+    from config import NEURO_ENDPOINTS
+except ImportError:
+    # Список OpenAI-совместимых серверов: [{"name", "base_url", "model", "api_key", "weight", "fallback", "timeout"}].
+    # По умолчанию - один сервер из NEURO_API_BASE_URL / NEURO_MODEL_NAME / NEURO_API_KEY.
+    NEURO_ENDPOINTS = None
+
+try:
+    from config import NEURO_STREAM_USAGE
+except ImportError:
+    # Просить сервер прислать usage последним чанком потока (stream_options). Если сервер отвечает на этот
+    # параметр 400, роутер повторяет запрос без него и больше не передает его этому серверу - расход
+    # токенов для квот тогда оценивается по длине текста. False - не передавать никому
+    NEURO_STREAM_USAGE = True
+
 # Настройка логирования для этого модуля
 logger = logging.getLogger(__name__)
 
-# Инициализируем OpenAI клиент
-# Он будет использоваться для всех запросов к вашему локальному серверу
-if NEURO_API_BASE_URL and NEURO_MODEL_NAME:
+
+def _endpoints_from_config() -> list[dict]:
+    if NEURO_ENDPOINTS:
+        return NEURO_ENDPOINTS
+    if not (NEURO_API_BASE_URL and NEURO_MODEL_NAME):
+        return []
+    # Если ваш сервер не требует API ключа, можно передать фиктивный ключ,
+    # например, "NA", "None", или любой другой непустой, если библиотека этого требует.
+    # Некоторые серверы (как Ollama по умолчанию) игнорируют ключ.
+    # OpenAI v1.x клиент требует чтобы api_key был не None, если передается.
+    # Если ключ реально нужен, он должен быть правильным.
+    _api_key = NEURO_API_KEY if NEURO_API_KEY and NEURO_API_KEY.strip() and NEURO_API_KEY.lower() != "na" else "sk-dummy-key-for-local"
+    return [{"name": "default", "base_url": NEURO_API_BASE_URL, "model": NEURO_MODEL_NAME, "api_key": _api_key}]
+
+
+# Инициализируем роутер запросов к нейросети.
+# У каждого сервера свои синхронный и асинхронный клиенты OpenAI с собственными пулами соединений,
+# роутер выбирает сервер, повторяет запрос на другом при ошибке и следит за их здоровьем.
+_endpoints = _endpoints_from_config()
+if _endpoints:
     try:
-        # Если ваш сервер не требует API ключа, можно передать фиктивный ключ,
-        # например, "NA", "None", или любой другой непустой, если библиотека этого требует.
-        # Некоторые серверы (как Ollama по умолчанию) игнорируют ключ.
-        # OpenAI v1.x клиент требует чтобы api_key был не None, если передается.
-        # Если ключ реально нужен, он должен быть правильным.
-        client = OpenAI(
-            base_url=NEURO_API_BASE_URL,
-            api_key=NEURO_API_KEY if NEURO_API_KEY and NEURO_API_KEY.strip() and NEURO_API_KEY.lower() != "na" else "sk-dummy-key-for-local"
-        )
-        logger.info(f"OpenAI клиент успешно сконфигурирован для URL: {NEURO_API_BASE_URL} и модели: {NEURO_MODEL_NAME}")
+        llm_router = LLMRouter.from_config(_endpoints)
+        llm_router.start_health_checks()
+        logger.info("Роутер нейросети сконфигурирован: " + ", ".join(
+            f"{ep.name} ({ep.base_url}, модель {ep.model}{', резервный' if ep.fallback else ''})"
+            for ep in llm_router.endpoints))
     except Exception as e:
         logger.error(f"Ошибка при конфигурации OpenAI клиента: {e}")
-        client = None  # Устанавливаем в None, чтобы функция ниже корректно обработала ошибку
+        llm_router = None  # Устанавливаем в None, чтобы функции ниже корректно обработали ошибку
 else:
     logger.warning("NEURO_API_BASE_URL или NEURO_MODEL_NAME не предоставлены. Функционал нейросети будет недоступен.")
-    client = None
+    llm_router = None
+
+CLIENT_NOT_CONFIGURED_MESSAGE = "Клиент для работы с нейросетью не инициализирован. Проверьте конфигурацию."
+EMPTY_RESPONSE_MESSAGE = "Нейросеть вернула пустой ответ. Попробуйте переформулировать запрос."
 
+_STREAM_OPTIONS = {"stream_options": {"include_usage": True}} if NEURO_STREAM_USAGE else {}
 
-def get_custom_ai_response(user_prompt: str, temperature: float = 0.7, max_tokens: int = 1024) -> str | None:
+# Кэш ответов на одинаковые (после нормализации) промпты
+response_cache = ResponseCache(max_entries=RESPONSE_CACHE_SIZE, max_bytes=RESPONSE_CACHE_MAX_BYTES,
+                               default_ttl=RESPONSE_CACHE_TTL, max_temperature=RESPONSE_CACHE_MAX_TEMPERATURE,
+                               max_context_tokens=RESPONSE_CACHE_MAX_CONTEXT_TOKENS, db_path=RESPONSE_CACHE_DB)
+
+
+def _cache_key(user_prompt: str, messages: list[dict], temperature: float, max_tokens: int) -> str | None:
+    """
+    Ключ кэша ответов или None, если для этих параметров кэш не используется.
+    В ключ входит отпечаток контекста: тот же вопрос в другом диалоге - другой ответ. Поэтому
+    при памяти диалогов кэш срабатывает только в начале разговора: пока история короче
+    RESPONSE_CACHE_MAX_CONTEXT_TOKENS, дальше запросы идут мимо кэша.
+    """
+    context = messages[:-1]
+    history_tokens = sum(estimate_tokens(message["content"]) for message in context if message["role"] != "system")
+    if not response_cache.enabled_for(temperature, history_tokens):
+        return None
+    return response_cache.make_key(llm_router.model_id, user_prompt, temperature, max_tokens,
+                                   context=conversation_digest(context))
+
+
+def _cache_hit(cached: str | None, user_id: int | None = None) -> bool:
+    if cached is None:
+        return False
+    logger.info("Ответ модели %s взят из кэша.", llm_router.model_id, extra=event("llm_response", user_id))
+    return True
+
+
+def _served_by() -> str:
+    """Сервер и модель, ответившие на последний запрос роутера в этом потоке (задаче asyncio)."""
+    endpoint = served_endpoint.get()
+    return f"{endpoint.model} ({endpoint.name})" if endpoint is not None else llm_router.model_id
+
+
+async def _cache_get_async(cache_key: str) -> str | None:
+    # Дисковый уровень кэша - это SQLite, поэтому в режиме asyncio читаем его вне event loop
+    if response_cache.persistent:
+        return await asyncio.to_thread(response_cache.get, cache_key)
+    return response_cache.get(cache_key)
+
+
+async def _cache_put_async(cache_key: str, response_text: str):
+    if response_cache.persistent:
+        await asyncio.to_thread(response_cache.put, cache_key, response_text)
+    else:
+        response_cache.put(cache_key, response_text)
+
+
+async def _build_messages_async(user_id: int | None, user_prompt: str) -> list[dict]:
+    # При промахе история диалога загружается из SQLite - вне event loop
+    if user_id is None:
+        return conversation_store.build_messages(None, user_prompt)
+    return await asyncio.to_thread(conversation_store.build_messages, user_id, user_prompt)
+
+
+async def _record_turn_async(user_id: int | None, user_prompt: str, response_text: str):
+    if user_id is not None:
+        await asyncio.to_thread(conversation_store.record_turn, user_id, user_prompt, response_text)
+
+
+def _record_usage(user_id: int | None, messages: list[dict], response_text: str, usage=None) -> int:
+    """
+    Учитывает запрос в метриках и квоте пользователя (quota.py): токены из usage ответа модели,
+    а если сервер его не прислал (или поток прерван) - оценка по длине текста.
+    Возвращает число токенов ответа.
+    """
+    if usage is not None:
+        prompt_tokens, completion_tokens = usage.prompt_tokens or 0, usage.completion_tokens or 0
+    else:
+        prompt_tokens = sum(estimate_tokens(message["content"]) for message in messages)
+        completion_tokens = estimate_tokens(response_text)
+    if prompt_tokens or completion_tokens:
+        LLM_TOKENS.inc(prompt_tokens, kind="prompt")
+        LLM_TOKENS.inc(completion_tokens, kind="completion")
+    if user_id is not None:
+        quota_engine.record(user_id, prompt_tokens, completion_tokens)
+    return completion_tokens
+
+
+def _observe_stream(mode: str, started: float, first_token_at: float | None, completion_tokens: int):
+    """Метрики потокового ответа: общее время и скорость генерации (от первого текста до конца)."""
+    finished = time.perf_counter()
+    LLM_REQUEST_SECONDS.observe(finished - started, mode=mode)
+    if first_token_at is not None and finished > first_token_at and completion_tokens:
+        LLM_TOKENS_PER_SECOND.observe(completion_tokens / (finished - first_token_at), mode=mode)
+
+
+def reset_conversation(user_id: int) -> bool:
+    """Очищает историю диалога пользователя с нейросетью (/reset)."""
+    return conversation_store.reset(user_id)
+
+
+def close_ai_interface():
+    """Освобождает ресурсы модуля при остановке бота."""
+    logger.info(f"Статистика кэша ответов: {response_cache.stats()}")
+    logger.info(f"Статистика истории диалогов: {conversation_store.stats()}")
+    response_cache.close()
+    if llm_router:
+        logger.info(f"Статистика роутера нейросети: {llm_router.stats()}")
+        llm_router.close()
+
+
+def _extract_response_text(completion, user_prompt: str, user_id: int | None = None) -> str:
+    """Достает текст ответа из completion (общая часть для синхронного и асинхронного вызова)."""
+    response_text = completion.choices[0].message.content
+
+    if response_text:
+        logger.info("Получен ответ от модели %s.", _served_by(), extra=event("llm_response", user_id))
+        return response_text.strip()
+    else:
+        logger.warning("Модель %s вернула пустой ответ на промпт '%.70s...'.", _served_by(), user_prompt,
+                       extra=event("llm_response", user_id))
+        return EMPTY_RESPONSE_MESSAGE
+
+
+def finalize_streamed_text(text: str) -> str:
+    """
+    Итоговый текст потокового ответа - тот же, что вернул бы get_custom_ai_response
+    для того же содержимого ответа модели.
+    """
+    return text.strip() or EMPTY_RESPONSE_MESSAGE
+
+
+def _stream_delta_text(chunk) -> str | None:
+    # Последний чанк (с usage) может прийти без choices
+    if not chunk.choices:
+        return None
+    return chunk.choices[0].delta.content
+
+
+def _error_response_text(e: Exception) -> str:
+    """Логирует ошибку обращения к API и возвращает текст для пользователя."""
+    logger.error(
+        f"Произошла ошибка при взаимодействии с API нейросети ({llm_router.model_id}): {type(e).__name__} - {e}",
+        exc_info=True)
+    if isinstance(e, (openai.APIConnectionError, NoAvailableEndpointError)):
+        return "Не удалось подключиться к серверу нейросети. Убедитесь, что он запущен и URL указан верно."
+    return "Произошла ошибка при обращении к нейросети. Пожалуйста, попробуйте позже."
+
+
+def get_custom_ai_response(user_prompt: str, temperature: float = 0.7, max_tokens: int = 1024,
+                           user_id: int | None = None, cancel: threading.Event | None = None) -> str | None:
     """
     Отправляет запрос к вашему локальному/self-hosted OpenAI-совместимому API
     и возвращает текстовый ответ.
+    С user_id в запрос попадает история диалога пользователя, а ответ дописывается в нее.
+    Если к моменту ответа установлен cancel (генерацию вытеснило новое сообщение), ответ в историю не попадает.
     Возвращает None или сообщение об ошибке в случае неудачи.
     """
-    if not client:
-        error_message = "Клиент для работы с нейросетью не инициализирован. Проверьте конфигурацию."
-        logger.error(error_message)
-        return error_message
+    if not llm_router:
+        logger.error(CLIENT_NOT_CONFIGURED_MESSAGE)
+        return CLIENT_NOT_CONFIGURED_MESSAGE
+
+    messages = conversation_store.build_messages(user_id, user_prompt)
+    cache_key = _cache_key(user_prompt, messages, temperature, max_tokens)
+    if cache_key and _cache_hit(cached := response_cache.get(cache_key), user_id):
+        conversation_store.record_turn(user_id, user_prompt, cached)
+        _record_usage(user_id, [], "")  # Ответ из кэша: запрос учитывается, токены нейросети не тратились
+        return cached
+
+    try:
+        logger.info("Отправка запроса к модели %s с промптом: '%.70s...'", llm_router.model_id, user_prompt,
+                    extra=event("llm_request", user_id))
+
+        with LLM_REQUEST_SECONDS.time(mode="sync"):
+            completion = llm_router.create(
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+            )
+        response_text = _extract_response_text(completion, user_prompt, user_id)
+        _record_usage(user_id, messages, response_text, completion.usage)
+        if completion.choices[0].message.content:
+            if cache_key:
+                response_cache.put(cache_key, response_text)
+            if cancel is None or not cancel.is_set():
+                conversation_store.record_turn(user_id, user_prompt, response_text)
+        return response_text
+
+    except Exception as e:  # Ловим более общие ошибки openai.APIError или requests.exceptions.ConnectionError
+        return _error_response_text(e)
+
+
+async def get_custom_ai_response_async(user_prompt: str, temperature: float = 0.7, max_tokens: int = 1024,
+                                       user_id: int | None = None) -> str | None:
+    """
+    Асинхронный вариант get_custom_ai_response для режима asyncio.
+    Пока ждем ответа модели, event loop обслуживает остальных пользователей.
+    """
+    if not llm_router:
+        logger.error(CLIENT_NOT_CONFIGURED_MESSAGE)
+        return CLIENT_NOT_CONFIGURED_MESSAGE
+
+    messages = await _build_messages_async(user_id, user_prompt)
+    cache_key = _cache_key(user_prompt, messages, temperature, max_tokens)
+    if cache_key and _cache_hit(cached := await _cache_get_async(cache_key), user_id):
+        await _record_turn_async(user_id, user_prompt, cached)
+        _record_usage(user_id, [], "")
+        return cached
+
+    try:
+        logger.info("Отправка асинхронного запроса к модели %s с промптом: '%.70s...'", llm_router.model_id, user_prompt,
+                    extra=event("llm_request", user_id))
+
+        with LLM_REQUEST_SECONDS.time(mode="async"):
+            completion = await llm_router.acreate(
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+            )
+        response_text = _extract_response_text(completion, user_prompt, user_id)
+        _record_usage(user_id, messages, response_text, completion.usage)
+        if completion.choices[0].message.content:
+            if cache_key:
+                await _cache_put_async(cache_key, response_text)
+            await _record_turn_async(user_id, user_prompt, response_text)
+        return response_text
+
+    except Exception as e:
+        return _error_response_text(e)
+
+
+def stream_custom_ai_response(user_prompt: str, temperature: float = 0.7, max_tokens: int = 1024,
+                              user_id: int | None = None, cancel: CancelEvent | None = None) -> Iterator[str]:
+    """
+    Потоковый вариант get_custom_ai_response: генератор, отдающий куски текста по мере генерации.
+    Ошибка до первого куска отдается как текст ошибки, ошибка посреди ответа - дописывается в конец.
+    Итоговый текст получается через finalize_streamed_text(''.join(куски)).
+    При закрытии генератора или установке cancel закрывается и HTTP-поток к модели
+    (cancel проверяется на каждом чанке, включая чанки без текста; пока ждем первого чанка,
+    поток закрывается сразу при отмене).
+    """
+    if not llm_router:
+        logger.error(CLIENT_NOT_CONFIGURED_MESSAGE)
+        yield CLIENT_NOT_CONFIGURED_MESSAGE
+        return
+
+    messages = conversation_store.build_messages(user_id, user_prompt)
+    cache_key = _cache_key(user_prompt, messages, temperature, max_tokens)
+    if cache_key and _cache_hit(cached := response_cache.get(cache_key), user_id):
+        conversation_store.record_turn(user_id, user_prompt, cached)
+        _record_usage(user_id, [], "")  # Ответ из кэша: запрос учитывается, токены нейросети не тратились
+        yield cached
+        return
 
+    received = False
+    parts = []
+    stream = None
+    usage = None
+    started = time.perf_counter()
+    first_token_at = None
     try:
-        logger.info(f"Отправка запроса к модели {NEURO_MODEL_NAME} с промптом: '{user_prompt[:70]}...'")
-
-        completion = client.chat.completions.create(
-            model=NEURO_MODEL_NAME,
-            messages=[
-                {"role": "user", "content": user_prompt}
-                # Можно добавить системный промпт:
-                # {"role": "system", "content": "Ты полезный ассистент."}
-            ],
+        logger.info("Отправка потокового запроса к модели %s с промптом: '%.70s...'", llm_router.model_id, user_prompt,
+                    extra=event("llm_request", user_id))
+
+        stream = llm_router.stream(
+            cancel=cancel,
+            messages=messages,
             temperature=temperature,
             max_tokens=max_tokens,
-            # stream=False # Для простоты пока без стриминга
+            **_STREAM_OPTIONS,
         )
+        for chunk in stream:
+            if cancel is not None and cancel.is_set():
+                break
+            usage = getattr(chunk, "usage", None) or usage
+            delta = _stream_delta_text(chunk)
+            if delta:
+                if not received:
+                    first_token_at = time.perf_counter()
+                    LLM_TIME_TO_FIRST_TOKEN_SECONDS.observe(first_token_at - started, mode="stream")
+                received = True
+                parts.append(delta)
+                yield delta
+
+        if cancel is not None and cancel.is_set():
+            logger.info("Потоковый запрос к модели %s отменен.", llm_router.model_id, extra=event("llm_response", user_id))
+        elif received:
+            logger.info("Получен потоковый ответ от модели %s.", _served_by(), extra=event("llm_response", user_id))
+            if response_text := ''.join(parts).strip():
+                if cache_key:
+                    response_cache.put(cache_key, response_text)
+                conversation_store.record_turn(user_id, user_prompt, response_text)
+        else:
+            logger.warning("Модель %s вернула пустой ответ на промпт '%.70s...'.", _served_by(), user_prompt,
+                           extra=event("llm_response", user_id))
 
-        response_text = completion.choices[0].message.content
+    except Exception as e:
+        error_text = _error_response_text(e)
+        yield "\n\n" + error_text if received else error_text
+    finally:
+        if stream is not None:
+            stream.close()
+        if received or usage is not None:
+            _observe_stream("stream", started, first_token_at, _record_usage(user_id, messages, ''.join(parts), usage))
+
+
+async def stream_custom_ai_response_async(user_prompt: str, temperature: float = 0.7, max_tokens: int = 1024,
+                                          user_id: int | None = None) -> AsyncIterator[str]:
+    """Асинхронный вариант stream_custom_ai_response для режима asyncio."""
+    if not llm_router:
+        logger.error(CLIENT_NOT_CONFIGURED_MESSAGE)
+        yield CLIENT_NOT_CONFIGURED_MESSAGE
+        return
+
+    messages = await _build_messages_async(user_id, user_prompt)
+    cache_key = _cache_key(user_prompt, messages, temperature, max_tokens)
+    if cache_key and _cache_hit(cached := await _cache_get_async(cache_key), user_id):
+        await _record_turn_async(user_id, user_prompt, cached)
+        _record_usage(user_id, [], "")
+        yield cached
+        return
+
+    received = False
+    parts = []
+    stream = None
+    usage = None
+    started = time.perf_counter()
+    first_token_at = None
+    try:
+        logger.info("Отправка асинхронного потокового запроса к модели %s с промптом: '%.70s...'", llm_router.model_id, user_prompt,
+                    extra=event("llm_request", user_id))
 
-        if response_text:
-            logger.info(f"Получен ответ от модели {NEURO_MODEL_NAME}.")
-            return response_text.strip()
+        stream = llm_router.astream(
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            **_STREAM_OPTIONS,
+        )
+        async for chunk in stream:
+            usage = getattr(chunk, "usage", None) or usage
+            delta = _stream_delta_text(chunk)
+            if delta:
+                if not received:
+                    first_token_at = time.perf_counter()
+                    LLM_TIME_TO_FIRST_TOKEN_SECONDS.observe(first_token_at - started, mode="astream")
+                received = True
+                parts.append(delta)
+                yield delta
+
+        if received:
+            logger.info("Получен потоковый ответ от модели %s.", _served_by(), extra=event("llm_response", user_id))
+            if response_text := ''.join(parts).strip():
+                if cache_key:
+                    await _cache_put_async(cache_key, response_text)
+                await _record_turn_async(user_id, user_prompt, response_text)
         else:
-            logger.warning(f"Модель {NEURO_MODEL_NAME} вернула пустой ответ на промпт '{user_prompt[:70]}...'.")
-            return "Нейросеть вернула пустой ответ. Попробуйте переформулировать запрос."
+            logger.warning("Модель %s вернула пустой ответ на промпт '%.70s...'.", _served_by(), user_prompt,
+                           extra=event("llm_response", user_id))
 
-    except Exception as e:  # Ловим более общие ошибки openai.APIError или requests.exceptions.ConnectionError
-        logger.error(
-            f"Произошла ошибка при взаимодействии с API нейросети ({NEURO_MODEL_NAME}): {type(e).__name__} - {e}",
-            exc_info=True)
-        if "Connection refused" in str(e) or "Failed to resolve" in str(e):
-            return "Не удалось подключиться к серверу нейросети. Убедитесь, что он запущен и URL указан верно."
-        return "Произошла ошибка при обращении к нейросети. Пожалуйста, попробуйте позже."
+    except Exception as e:
+        error_text = _error_response_text(e)
+        yield "\n\n" + error_text if received else error_text
+    finally:
+        if stream is not None:
+            await stream.aclose()
+        if received or usage is not None:
+            _observe_stream("astream", started, first_token_at, _record_usage(user_id, messages, ''.join(parts), usage))
 
 
 # --- Тестовый запуск функции (можно раскомментировать для проверки) ---
 if __name__ == '__main__':
-    if not NEURO_API_BASE_URL or not NEURO_MODEL_NAME:
-        print("Для тестового запуска установите NEURO_API_BASE_URL и NEURO_MODEL_NAME в config.py")
+    if not llm_router:
+        print("Для тестового запуска установите NEURO_API_BASE_URL и NEURO_MODEL_NAME (или NEURO_ENDPOINTS) в config.py")
     else:
         logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
@@ -0,0 +1,208 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from telebot import types, asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
+
+try:
+    from config import BOT_TOKEN
+except ImportError:
+    print("Токен BOT_TOKEN не найден в config.py!")
+    exit()
+
+try:
+    from config import AI_STREAMING
+except ImportError:
+    AI_STREAMING = True  # Показывать ответ нейросети по мере генерации (правками сообщения)
+
+try:
+    from config import TELEGRAM_API_URL
+except ImportError:
+    TELEGRAM_API_URL = None  # Свой адрес Bot API, например "http://127.0.0.1:8081/bot{0}/{1}"
+
+import ai_interface
+from ai_interface import get_custom_ai_response_async, stream_custom_ai_response_async, close_ai_interface
+from streaming import AsyncStreamingReply
+from database import initialize_database, close_database, DB_POOL_SIZE
+from llm_scheduler import llm_scheduler, QueueFullError
+from metrics import timed, HANDLER_SECONDS, start_metrics_server
+from subscription_sweeper import SubscriptionSweeper, SUBSCRIPTION_SWEEPER
+from outbox import AsyncOutbox
+from generation_tracker import generation_tracker, Generation, INTERRUPTED_NOTE
+from conversation_store import estimate_tokens
+from quota import quota_engine
+from log_pipeline import setup_logging, logging_stats, event
+import bot_logic
+
+logger = logging.getLogger(__name__)
+
+# Асинхронный бот: апдейты обрабатываются конкурентно в одном event loop,
+# поэтому долгий ответ нейросети одному пользователю не задерживает остальных.
+if TELEGRAM_API_URL:
+    asyncio_helper.API_URL = TELEGRAM_API_URL
+
+bot = AsyncTeleBot(BOT_TOKEN, parse_mode="HTML")
+outbox = AsyncOutbox(bot)
+
+# SQLite - блокирующая библиотека, поэтому все обращения к БД уходят в отдельный пул потоков.
+# Размер совпадает с пулом соединений, чтобы потоки не ждали свободного соединения.
+_db_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="db")
+
+
+async def run_db(func, *args, **kwargs):
+    """Выполняет синхронную функцию из database.py в пуле потоков БД, не блокируя event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, partial(func, *args, **kwargs))
+
+
+# Тексты ответов и решения по командам - в bot_logic.py (общие с dcorpbot.py), здесь только отправка
+
+@bot.message_handler(commands=['start'])
+@timed(HANDLER_SECONDS)
+async def send_welcome(message: types.Message):
+    # Запись отложенная (database.user_writes) - диска не ждем, пул потоков БД не нужен
+    outbox.reply_to(message, bot_logic.start_reply(message.from_user))
+
+
+@bot.message_handler(commands=['get_trial'])
+@timed(HANDLER_SECONDS)
+async def get_trial_subscription(message: types.Message):
+    outbox.reply_to(message, await run_db(bot_logic.trial_reply, message.from_user.id))
+
+
+@bot.message_handler(commands=['status'])
+@timed(HANDLER_SECONDS)
+async def check_subscription_status(message: types.Message):
+    outbox.reply_to(message, await run_db(bot_logic.status_reply, message.from_user.id))
+
+
+@bot.message_handler(commands=['help'])
+@timed(HANDLER_SECONDS)
+async def send_help(message: types.Message):
+    outbox.reply_to(message, bot_logic.HELP_MESSAGE)
+
+
+@bot.message_handler(commands=['reset'])
+@timed(HANDLER_SECONDS)
+async def reset_ai_conversation(message: types.Message):
+    outbox.reply_to(message, await run_db(bot_logic.reset_reply, message.from_user.id))
+
+
+@bot.message_handler(commands=['subscribe'])
+@timed(HANDLER_SECONDS)
+async def send_subscribe_info(message: types.Message):
+    outbox.reply_to(message, bot_logic.SUBSCRIBE_MESSAGE)
+
+
+async def reply_with_ai(message: types.Message, generation: Generation, parts: list[str]):
+    """
+    Запрашивает ответ нейросети на текст сообщения (generation.prompt - вместе с объединенными
+    предыдущими сообщениями) и отправляет его пользователю. Полученный текст складывается в parts.
+    Выполняется отдельной задачей, которую отменяет новое сообщение пользователя.
+    """
+    user = message.from_user
+    user_input = generation.prompt
+    outbox.send_chat_action(message.chat.id, 'typing')
+
+    if AI_STREAMING:
+        reply = AsyncStreamingReply(outbox, message)
+        try:
+            await reply.start()
+            async for delta in stream_custom_ai_response_async(user_input, user_id=user.id):
+                parts.append(delta)
+                await reply.feed(bot_logic.format_ai_text(delta))
+        except asyncio.CancelledError:
+            if not generation.cancelled or not reply.messages:
+                raise
+            # Поток к нейросети уже закрыт отменой - дописываем пометку к показанной части ответа
+            await reply.feed(INTERRUPTED_NOTE)
+            logger.info("Потоковый ответ AI пользователю %s прерван новым сообщением.", user.id,
+                        extra=event("ai_reply", user.id))
+        await reply.finish()
+        logger.info("Отправлен потоковый ответ AI пользователю %s.", user.id, extra=event("ai_reply", user.id))
+        return
+
+    ai_response = await get_custom_ai_response_async(user_input, user_id=user.id)
+    if ai_response:
+        parts.append(ai_response)
+    outbox.reply_to(message, bot_logic.ai_reply(user.id, user_input, ai_response))
+
+
+@bot.message_handler(func=lambda message: True, content_types=['text'])
+@timed(HANDLER_SECONDS)
+async def handle_text_message_for_ai(message: types.Message):
+    user = message.from_user
+    if not bot_logic.is_ai_text(message):
+        return
+
+    # Подписка и квота - одним заходом в пул потоков БД
+    plan_name, refusal = await run_db(bot_logic.admit_ai_request, user.id)
+    if refusal is not None:
+        outbox.reply_to(message, refusal)
+        return
+    # Незаконченный ответ на предыдущее сообщение отменяется, недавнее сообщение объединяется с этим
+    generation = generation_tracker.begin(user.id, message.text)
+    parts: list[str] = []
+    try:
+        # Новое сообщение пользователя прерывает и ожидание в очереди
+        async with llm_scheduler.async_slot(user.id, plan_name, generation.cancel_event) as granted:
+            if granted and generation_tracker.start(generation):
+                task = asyncio.create_task(reply_with_ai(message, generation, parts))
+                generation.attach_task(task)
+                await asyncio.wait([task])
+                if not task.cancelled():
+                    task.result()  # Пробрасываем ошибку обработчика, если она была
+    except QueueFullError:
+        outbox.reply_to(message, bot_logic.queue_full_reply(user.id))
+    finally:
+        generation_tracker.finish(generation, estimate_tokens(''.join(parts)))
+
+
+async def main():
+    logger.info("Инициализация базы данных...")
+    await run_db(initialize_database)
+    logger.info("База данных готова к работе.")
+
+    logger.info("Бот запускается в режиме asyncio...")
+    start_metrics_server()
+    # Обслуживание подписок работает в своем потоке; предупреждения передаются в outbox через event loop
+    loop = asyncio.get_running_loop()
+    subscription_sweeper = SubscriptionSweeper(
+        notify=lambda telegram_id, text: loop.call_soon_threadsafe(outbox.send_message, telegram_id, text))
+    if SUBSCRIPTION_SWEEPER:
+        subscription_sweeper.start()
+    try:
+        await bot.polling(non_stop=True, interval=0)
+    finally:
+        await asyncio.to_thread(subscription_sweeper.stop)
+        await outbox.aclose()
+        await bot.close_session()
+        if ai_interface.llm_router:
+            await ai_interface.llm_router.aclose()
+        close_ai_interface()
+        logger.info(f"Статистика очереди запросов к нейросети: {llm_scheduler.stats()}")
+        logger.info(f"Статистика отмены генераций: {generation_tracker.stats()}")
+        await run_db(quota_engine.close)
+        logger.info(f"Статистика квот: {quota_engine.stats()}")
+        await run_db(close_database)
+        _db_executor.shutdown(wait=True)
+        logger.info(f"Статистика логирования: {logging_stats()}")
+
+
+def run():
+    """Точка входа режима asyncio (BOT_RUNTIME = "async" в config.py)."""
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        logger.error(f"Ошибка при запуске или работе бота: {e}", exc_info=True)
+    finally:
+        logger.info("Бот остановлен.")
+
+
+if __name__ == '__main__':
+    setup_logging()
+    run()
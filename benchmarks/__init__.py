@@ -0,0 +1,2 @@
+# Бенчмарки и нагрузочные сценарии. Запуск из корня репозитория:
+#   python -m benchmarks.<имя_модуля>
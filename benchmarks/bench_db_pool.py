@@ -0,0 +1,169 @@
+"""
+Микробенчмарк слоя работы с БД: вызовы/сек "до" (sqlite3.connect на каждый вызов)
+и "после" (пул долгоживущих соединений с WAL).
+
+    python -m benchmarks.bench_db_pool [--calls 5000] [--threads 4]
+
+Запись пользователя "после" - database._upsert_users по одной строке: как и "до", каждый вызов
+доходит до диска своей транзакцией. add_or_update_user пишет через отложенный буфер,
+его сравнение с записью на каждый вызов - в bench_user_writes.
+"""
+import argparse
+import datetime
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import database
+
+# Схема БД до миграций (даты текстом, без индексов) - так работала старая реализация
+LEGACY_SCHEMA = (
+    '''
+    CREATE TABLE users (
+        telegram_id INTEGER PRIMARY KEY,
+        username TEXT,
+        first_name TEXT,
+        last_name TEXT,
+        registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE subscriptions (
+        subscription_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        telegram_id INTEGER NOT NULL,
+        start_date TIMESTAMP,
+        end_date TIMESTAMP,
+        is_active BOOLEAN DEFAULT 0,
+        plan_name TEXT,
+        payment_id TEXT,
+        FOREIGN KEY (telegram_id) REFERENCES users (telegram_id)
+    )
+    ''',
+)
+
+
+def create_legacy_database(db_name: str) -> sqlite3.Connection:
+    """Создает БД со старой схемой в журнальном режиме по умолчанию (DELETE), без WAL."""
+    conn = sqlite3.connect(db_name)
+    for statement in LEGACY_SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+    return conn
+
+
+def legacy_check_user_subscription(db_name: str, telegram_id: int) -> bool:
+    # Старая реализация: новое соединение на каждый вызов
+    conn = sqlite3.connect(db_name)
+    try:
+        cursor = conn.cursor()
+        cursor.execute('''
+                       SELECT 1
+                       FROM subscriptions
+                       WHERE telegram_id = ?
+                         AND is_active = 1
+                         AND end_date > ? LIMIT 1
+                       ''', (telegram_id, datetime.datetime.now()))
+        return cursor.fetchone() is not None
+    finally:
+        conn.close()
+
+
+# Старый код ловил sqlite3.Error и только логировал - здесь просто считаем такие ошибки
+legacy_errors = 0
+
+
+def legacy_add_or_update_user(db_name: str, telegram_id: int, username, first_name, last_name):
+    global legacy_errors
+    conn = sqlite3.connect(db_name)
+    try:
+        conn.execute('''
+                     INSERT INTO users (telegram_id, username, first_name, last_name)
+                     VALUES (?, ?, ?, ?) ON CONFLICT(telegram_id) DO
+                     UPDATE SET
+                         username = excluded.username,
+                         first_name = excluded.first_name,
+                         last_name = excluded.last_name
+                     ''', (telegram_id, username, first_name, last_name))
+        conn.commit()
+    except sqlite3.OperationalError:
+        legacy_errors += 1
+    finally:
+        conn.close()
+
+
+def run(func, calls: int, threads: int) -> float:
+    """Выполняет func(i) calls раз в threads потоках, возвращает вызовы/сек."""
+    per_thread = calls // threads
+
+    def worker(offset: int):
+        for i in range(per_thread):
+            func(offset + i)
+
+    pool = [threading.Thread(target=worker, args=(t * per_thread,)) for t in range(threads)]
+    started = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return per_thread * threads / (time.perf_counter() - started)
+
+
+def populate_legacy(db_name: str, users: int):
+    conn = create_legacy_database(db_name)
+    now = datetime.datetime.now()
+    conn.executemany("INSERT INTO users (telegram_id, username, first_name) VALUES (?, ?, 'Имя')",
+                     [(uid, f"user{uid}") for uid in range(users)])
+    conn.executemany('''
+                     INSERT INTO subscriptions (telegram_id, start_date, end_date, is_active, plan_name)
+                     VALUES (?, ?, ?, 1, 'Пробный доступ')
+                     ''', [(uid, now, now + datetime.timedelta(days=1)) for uid in range(0, users, 2)])
+    conn.commit()
+    conn.close()
+
+
+def populate(db_name: str, users: int):
+    database.use_database(db_name)
+    database.initialize_database()
+    database.add_or_update_users_batch([(uid, f"user{uid}", "Имя", None) for uid in range(users)])
+    for uid in range(0, users, 2):
+        database.add_user_subscription(uid, duration_days=1, plan_name="Пробный доступ")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--users", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_db = os.path.join(tmp, "legacy.db")
+        pooled_db = os.path.join(tmp, "pooled.db")
+        populate_legacy(legacy_db, args.users)
+        populate(pooled_db, args.users)
+
+        users = args.users
+        scenarios = [
+            ("check_user_subscription",
+             lambda i: legacy_check_user_subscription(legacy_db, i % users),
+             lambda i: database.check_user_subscription(i % users)),
+            ("upsert пользователя",
+             lambda i: legacy_add_or_update_user(legacy_db, i % users, f"user{i}", "Имя", None),
+             lambda i: database._upsert_users([(i % users, f"user{i}", "Имя", None)])),
+        ]
+
+        print(f"{'функция':<26}{'до, выз/с':>14}{'после, выз/с':>16}{'ускорение':>12}")
+        for name, before, after in scenarios:
+            before_rate = run(before, args.calls, args.threads)
+            after_rate = run(after, args.calls, args.threads)
+            print(f"{name:<26}{before_rate:>14.0f}{after_rate:>16.0f}{after_rate / before_rate:>11.1f}x")
+        print(f"Ошибок 'database is locked' в старой реализации: {legacy_errors}")
+        print(f"Кэш подписок: {database.subscription_cache.stats()}")
+
+        database.close_database()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,399 @@
+"""
+Сквозной нагрузочный тест: dcorpbot.py целиком, с фейковыми Telegram Bot API и нейросетью.
+
+Бот запускается отдельным процессом (python -m dcorpbot) во временном каталоге со своим config.py
+и пустой БД. В режимах "sync" и "async" он забирает апдейты через getUpdates у фейкового Telegram,
+в режиме "webhook" тест сам доставляет их на вебхук. Виртуальные пользователи работают в замкнутом
+цикле: следующее сообщение - после ответа бота на предыдущее и паузы --think-time.
+
+    python -m benchmarks.bench_load [--runtime sync] [--scenarios new_user_burst mixed brownout]
+                                    [--users 200] [--duration 20] [--output result.json] [--compare old.json]
+
+Сценарии:
+  new_user_burst - все пользователи одновременно присылают /start и /get_trial (наплыв после рассылки);
+  mixed          - половина пользователей с подпиской общается с нейросетью, остальные получают отказ;
+  brownout       - пользователи с подпиской, на средней трети времени нейросеть отвечает в 20 раз
+                   медленнее и с 20% ошибок.
+
+Замеряется: апдейтов в секунду, время ответа (p50/p95/p99, до первого sendMessage в чат),
+вызовов database.py в секунду (по /metrics бота), пиковая память процессов бота.
+Результат - JSON (--output): его можно сравнить с предыдущим прогоном через --compare.
+"""
+import argparse
+import heapq
+import itertools
+import json
+import os
+import platform
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.bench_webhook import REPO_ROOT, free_port, wait_for_port, post_update, write_config
+from benchmarks.fake_openai import FakeOpenAIServer
+from benchmarks.fake_telegram import FakeTelegramServer, make_update
+
+SCENARIOS = ("new_user_burst", "mixed", "brownout")
+# Метрики, по которым --compare показывает изменение; True - больше значит лучше
+_COMPARED = {"updates_per_sec": True, "latency_p50_ms": False, "latency_p95_ms": False, "latency_p99_ms": False,
+             "db_ops_per_sec": True, "rss_peak_mb": False}
+_USER_ID_BASE = 7_000_000
+_REPLY_TIMEOUT = 120.0  # Сколько ждать ответов на последние сообщения после окончания сценария
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class VirtualUsers:
+    """
+    Виртуальные пользователи в замкнутом цикле. Каждый идет по своему сценарию (итератору текстов):
+    отправил сообщение - ждет ответа бота в свой чат - пауза think_time - следующее.
+    Ответом считается первый sendMessage в чат после отправки сообщения.
+    """
+
+    def __init__(self, deliver, think_time: float, deadline: float, seed: int = 1):
+        self.deliver = deliver  # deliver(update) - передает апдейт боту
+        self.think_time = think_time
+        self.deadline = deadline  # После этого момента (perf_counter) новые сообщения не отправляются
+        self._random = random.Random(seed)
+        self._scripts: dict[int, object] = {}
+        self._pending: dict[int, float] = {}  # Пользователь -> время отправки сообщения без ответа
+        self._due: list[tuple[float, int]] = []  # Куча (когда отправить, пользователь)
+        self._update_ids = itertools.count(1)
+        self._cond = threading.Condition()
+        self.samples: list[tuple[float, float]] = []  # (время отправки, время ответа)
+        self.sent = 0
+        self.unexpected = 0
+
+    def add_user(self, user_id: int, script, start_at: float):
+        with self._cond:
+            self._scripts[user_id] = iter(script)
+            heapq.heappush(self._due, (start_at, user_id))
+            self._cond.notify()
+
+    def on_message(self, chat_id: int):
+        now = time.perf_counter()
+        with self._cond:
+            sent_at = self._pending.pop(chat_id, None)
+            if sent_at is None:
+                self.unexpected += 1
+                return
+            self.samples.append((sent_at, now - sent_at))
+            # Пауза "на чтение ответа" - экспоненциальная, чтобы пользователи не шли в ногу
+            pause = self._random.expovariate(1 / self.think_time) if self.think_time > 0 else 0.0
+            heapq.heappush(self._due, (now + pause, chat_id))
+            self._cond.notify()
+
+    def run(self):
+        """Отправляет сообщения до deadline, затем ждет ответов на уже отправленные."""
+        while True:
+            with self._cond:
+                now = time.perf_counter()
+                if now >= self.deadline or (not self._due and not self._pending):
+                    break
+                if not self._due or self._due[0][0] > now:
+                    wait = self._due[0][0] - now if self._due else None
+                    self._cond.wait(min(wait, self.deadline - now) if wait is not None else self.deadline - now)
+                    continue
+                _, user_id = heapq.heappop(self._due)
+                text = next(self._scripts[user_id], None)
+                if text is None:
+                    continue
+                update = make_update(next(self._update_ids), user_id, text)
+                self._pending[user_id] = time.perf_counter()
+                self.sent += 1
+            self.deliver(update)
+
+        reply_deadline = time.perf_counter() + _REPLY_TIMEOUT
+        with self._cond:
+            while self._pending and time.perf_counter() < reply_deadline:
+                self._cond.wait(0.1)
+
+    @property
+    def lost(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+
+def _text_messages(prefix: str):
+    for i in itertools.count(1):
+        yield f"{prefix}: вопрос №{i} к нейросети"
+
+
+def build_users(scenario: str, users: int, ramp: float) -> list[tuple[int, object, float]]:
+    """(user_id, сценарий пользователя, задержка старта) для сценария."""
+    result = []
+    for index in range(users):
+        user_id = _USER_ID_BASE + index
+        if scenario == "new_user_burst":
+            # Все одновременно: нагрузка на запись users и subscriptions
+            result.append((user_id, ["/start", "/get_trial"], 0.0))
+            continue
+        subscribed = scenario == "brownout" or index % 2 == 0
+        start = ["/start", "/get_trial"] if subscribed else ["/start"]
+        result.append((user_id, itertools.chain(start, _text_messages(f"user{user_id}")), ramp * index / users))
+    return result
+
+
+def scrape_db_ops(ports: list[int]) -> int | None:
+    """Сумма db_call_seconds_count по эндпоинтам метрик процессов бота."""
+    total = 0
+    for port in ports:
+        try:
+            body = urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5).read().decode("utf-8")
+        except OSError:
+            return None
+        for line in body.splitlines():
+            if line.startswith("db_call_seconds_count"):
+                total += int(float(line.rsplit(" ", 1)[1]))
+    return total
+
+
+def _children(pid: int) -> list[int]:
+    result = []
+    try:
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/children") as f:
+                result.extend(int(child) for child in f.read().split())
+    except OSError:
+        pass
+    return result
+
+
+def process_tree_rss(pid: int) -> int | None:
+    """Суммарная RSS процесса и его потомков, байт (Linux, /proc); None - не удалось прочитать."""
+    total = 0
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        try:
+            with open(f"/proc/{current}/statm") as f:
+                total += int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError):
+            if current == pid:
+                return None
+            continue
+        stack.extend(_children(current))
+    return total
+
+
+class _MemorySampler(threading.Thread):
+    def __init__(self, pid: int, interval: float = 0.2):
+        super().__init__(name="rss-sampler", daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak: int | None = None
+        self._finished = threading.Event()
+
+    def run(self):
+        while not self._finished.wait(self.interval):
+            rss = process_tree_rss(self.pid)
+            if rss is not None:
+                self.peak = max(self.peak or 0, rss)
+
+    def stop(self):
+        self._finished.set()
+        self.join()
+
+
+def _brownout(openai_server: FakeOpenAIServer, started: float, duration: float, stop: threading.Event):
+    latency, error_rate = openai_server.latency, openai_server.error_rate
+    if stop.wait(max(started + duration / 3 - time.perf_counter(), 0)):
+        return
+    openai_server.latency, openai_server.error_rate = max(latency, 0.05) * 20, 0.2
+    stop.wait(max(started + duration * 2 / 3 - time.perf_counter(), 0))
+    openai_server.latency, openai_server.error_rate = latency, error_rate
+
+
+def _latency_stats(latencies: list[float]) -> dict:
+    return {
+        "replies": len(latencies),
+        "latency_p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "latency_p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "latency_p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "latency_max_ms": round(max(latencies, default=0.0) * 1000, 1),
+    }
+
+
+def run_scenario(scenario: str, args) -> dict:
+    telegram = FakeTelegramServer().start()
+    openai_server = FakeOpenAIServer(latency=args.llm_latency, tokens_per_sec=args.llm_tokens_per_sec,
+                                     error_rate=args.llm_error_rate).start()
+    webhook_port = free_port()
+    metrics_port = free_port()
+    metrics_ports = ([metrics_port + i for i in range(args.workers)] if args.runtime == "webhook"
+                     else [metrics_port])
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            write_config(directory, telegram, openai_server, webhook_port, args.workers,
+                         BOT_RUNTIME=args.runtime, AI_STREAMING=args.streaming, METRICS_PORT=metrics_port)
+            env = {**os.environ, "PYTHONPATH": REPO_ROOT}
+            with open(os.path.join(directory, "bot.log"), "w") as log:
+                process = subprocess.Popen([sys.executable, "-m", "dcorpbot"], cwd=directory, env=env,
+                                           stdout=log, stderr=subprocess.STDOUT)
+                try:
+                    return _drive(scenario, args, process, telegram, openai_server, webhook_port, metrics_ports)
+                finally:
+                    # Webhook-режим останавливается по SIGTERM, polling - по Ctrl+C
+                    process.send_signal(signal.SIGTERM if args.runtime == "webhook" else signal.SIGINT)
+                    try:
+                        process.wait(timeout=60)
+                    except subprocess.TimeoutExpired:
+                        process.kill()
+    finally:
+        telegram.stop()
+        openai_server.stop()
+
+
+def _drive(scenario: str, args, process: subprocess.Popen, telegram: FakeTelegramServer,
+           openai_server: FakeOpenAIServer, webhook_port: int, metrics_ports: list[int]) -> dict:
+    for port in metrics_ports:
+        wait_for_port(port)
+    if args.runtime == "webhook":
+        wait_for_port(webhook_port)
+        delivery = ThreadPoolExecutor(max_workers=32, thread_name_prefix="webhook-delivery")
+        deliver = lambda update: delivery.submit(post_update, webhook_port, update)
+    else:
+        delivery = None
+        deliver = telegram.push_update
+
+    duration = 0.0 if scenario == "new_user_burst" else args.duration
+    started = time.perf_counter()
+    # Для burst deadline не ограничивает: каждый пользователь отправляет ровно два сообщения
+    deadline = started + (duration or _REPLY_TIMEOUT)
+    driver = VirtualUsers(deliver, args.think_time, deadline)
+    telegram.on_message = driver.on_message
+    for user_id, script, delay in build_users(scenario, args.users, args.ramp):
+        driver.add_user(user_id, script, started + delay)
+
+    db_ops_before = scrape_db_ops(metrics_ports)
+    memory = _MemorySampler(process.pid)
+    memory.start()
+    stop_brownout = threading.Event()
+    brownout = None
+    if scenario == "brownout":
+        brownout = threading.Thread(target=_brownout, args=(openai_server, started, duration, stop_brownout),
+                                    daemon=True)
+        brownout.start()
+    try:
+        driver.run()
+    finally:
+        stop_brownout.set()
+        if brownout is not None:
+            brownout.join()
+        if delivery is not None:
+            delivery.shutdown(wait=True)
+    elapsed = time.perf_counter() - started
+    memory.stop()
+    db_ops_after = scrape_db_ops(metrics_ports)
+
+    latencies = [latency for _, latency in driver.samples]
+    result = {
+        "updates": driver.sent,
+        "lost": driver.lost,
+        "unexpected_replies": driver.unexpected,
+        "elapsed_sec": round(elapsed, 3),
+        "updates_per_sec": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        **_latency_stats(latencies),
+        "db_ops": None,
+        "db_ops_per_sec": None,
+        "rss_peak_mb": round(memory.peak / 2 ** 20, 1) if memory.peak else None,
+        "llm_requests": openai_server.requests,
+        "telegram_calls": dict(telegram.calls),
+    }
+    if db_ops_before is not None and db_ops_after is not None:
+        result["db_ops"] = db_ops_after - db_ops_before
+        result["db_ops_per_sec"] = round(result["db_ops"] / elapsed, 1)
+    if scenario == "brownout":
+        third = duration / 3
+        result["phases"] = {
+            name: _latency_stats([latency for sent_at, latency in driver.samples
+                                  if low <= sent_at - started < high])
+            for name, low, high in (("before", 0, third), ("brownout", third, 2 * third),
+                                    ("after", 2 * third, float("inf")))
+        }
+    return result
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def print_results(results: dict, baseline: dict | None):
+    for scenario, result in results["scenarios"].items():
+        print(f"\n{scenario}: отправлено {result['updates']}, без ответа {result['lost']}, "
+              f"{result['elapsed_sec']} с")
+        old = (baseline or {}).get("scenarios", {}).get(scenario, {})
+        for key, higher_is_better in _COMPARED.items():
+            value = result.get(key)
+            line = f"  {key:<18}{'-' if value is None else value:>12}"
+            previous = old.get(key)
+            if value is not None and previous:
+                change = (value - previous) / previous * 100
+                better = (change > 0) == higher_is_better
+                line += f"   {change:+.1f}% {'лучше' if better else 'хуже'} (было {previous})"
+            print(line)
+        for phase, stats in result.get("phases", {}).items():
+            print(f"  {phase:<10} ответов {stats['replies']:>6}  p50 {stats['latency_p50_ms']} мс  "
+                  f"p95 {stats['latency_p95_ms']} мс  p99 {stats['latency_p99_ms']} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runtime", choices=["sync", "async", "webhook"], default="sync")
+    parser.add_argument("--workers", type=int, default=2, help="Процессов-обработчиков в режиме webhook")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=20.0, help="Длительность сценариев mixed и brownout, с")
+    parser.add_argument("--ramp", type=float, default=2.0, help="За сколько секунд подключаются все пользователи")
+    parser.add_argument("--think-time", type=float, default=0.5, help="Средняя пауза пользователя между сообщениями, с")
+    parser.add_argument("--streaming", action="store_true", help="Потоковые ответы (AI_STREAMING)")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Задержка фейковой нейросети, с")
+    parser.add_argument("--llm-tokens-per-sec", type=float, default=0.0)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--output", help="Записать результат в JSON")
+    parser.add_argument("--compare", help="JSON предыдущего прогона для сравнения")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "scenarios": {},
+    }
+    for scenario in args.scenarios:
+        print(f"Сценарий {scenario}...", flush=True)
+        results["scenarios"][scenario] = run_scenario(scenario, args)
+
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультат записан в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
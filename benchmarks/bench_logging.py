@@ -0,0 +1,108 @@
+"""
+Стоимость логирования на потоке хэндлера: записи одного сообщения пользователя
+(текст -> запрос к нейросети с превью промпта -> ответ -> отправка) в разных режимах log_pipeline.
+
+    python -m benchmarks.bench_logging [--messages 20000] [--users 2000] [--threads 4]
+
+Режимы: логирование выключено (уровень WARNING), синхронная запись как раньше (basicConfig),
+JSON, очередь с фоновым потоком, очередь с семплированием и она же без поиска места вызова
+(LOG_CALLER_INFO = False). "хэндлер" - процессорное время вызовов logger в потоках хэндлеров
+(thread_time: работа фонового потока сюда не входит, хотя и делит с ними GIL),
+"до записи" - общее время вместе с дописыванием очереди в файл.
+"""
+import argparse
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+
+import log_pipeline
+from log_pipeline import event
+
+PROMPT = "Расскажи подробно, как устроена квантовая запутанность и почему она не позволяет передавать информацию"
+
+bot_logger = logging.getLogger("dcorpbot")
+ai_logger = logging.getLogger("ai_interface")
+db_logger = logging.getLogger("database")
+
+MODES = [
+    # название, параметры setup_logging
+    ("выключено", dict(level="WARNING", use_queue=False, sampling=None)),
+    ("синхронно, текст", dict(log_format="text", use_queue=False, sampling=None)),
+    ("синхронно, JSON", dict(log_format="json", use_queue=False, sampling=None)),
+    ("очередь, текст", dict(log_format="text", use_queue=True, sampling=None)),
+    ("очередь, JSON", dict(log_format="json", use_queue=True, sampling=None)),
+    ("очередь, JSON, семпл.", dict(log_format="json", use_queue=True, sampling=log_pipeline.LOG_SAMPLING)),
+    ("то же, без места вызова", dict(log_format="json", use_queue=True, sampling=log_pipeline.LOG_SAMPLING,
+                                     caller_info=False)),
+]
+
+
+def handle_message(user_id: int, first_name: str, text: str):
+    """Те же вызовы logger, что и у одного сообщения с ответом нейросети."""
+    db_logger.debug("У пользователя ID %s найдена активная подписка.", user_id)
+    bot_logger.info("Пользователь %s (%s) отправил текст для AI: \"%.50s...\"", user_id, first_name, text,
+                    extra=event("user_text", user_id))
+    ai_logger.info("Отправка запроса к модели %s с промптом: '%.70s...'", "deepseek-r1", text,
+                   extra=event("llm_request", user_id))
+    ai_logger.info("Получен ответ от модели %s.", "deepseek-r1", extra=event("llm_response", user_id))
+    bot_logger.info("Отправлен ответ AI пользователю %s.", user_id, extra=event("ai_reply", user_id))
+
+
+def run(messages: list[tuple], threads: int) -> float:
+    """Выполняет handle_message для всех сообщений в threads потоках, возвращает процессорное время потоков."""
+    chunks = [messages[i::threads] for i in range(threads)]
+    cpu = []
+
+    def worker(chunk):
+        started = time.thread_time()
+        for message in chunk:
+            handle_message(*message)
+        cpu.append(time.thread_time() - started)
+
+    pool = [threading.Thread(target=worker, args=(chunk,)) for chunk in chunks]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return sum(cpu)
+
+
+def count_lines(path: str) -> int:
+    with open(path, encoding="utf-8") as f:
+        return sum(1 for _ in f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    messages = [(uid, f"Имя{uid}", PROMPT) for uid in (rng.randrange(args.users) for _ in range(args.messages))]
+    # Очередь вмещает весь прогон: сравниваем стоимость, а не отбрасывание при переполнении
+    queue_size = args.messages * 5
+
+    print(f"{'':<24}{'хэндлер, мкс/сообщ.':>22}{'до записи, мкс/сообщ.':>24}{'строк':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for i, (name, options) in enumerate(MODES):
+            path = os.path.join(tmp, f"{i}.log")
+            log_pipeline.setup_logging(log_file=path, queue_size=queue_size, **options)
+            started = time.perf_counter()
+            handler = run(messages, args.threads)
+            log_pipeline.stop_logging()
+            total = time.perf_counter() - started
+            for output in logging.getLogger().handlers:
+                output.flush()
+            print(f"{name:<24}{handler / args.messages * 1e6:>22.1f}{total / args.messages * 1e6:>24.1f}"
+                  f"{count_lines(path):>9}")
+        # Файлы закрываются до удаления временного каталога
+        log_pipeline.setup_logging(level="WARNING", use_queue=False, sampling=None)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Доля попаданий в кэш ответов при памяти диалогов (CONVERSATION_MEMORY=True).
+
+    python -m benchmarks.bench_response_cache [--users 2000] [--messages 6] [--popular 0.4] [--max-context-tokens 200]
+
+В ключ кэша входит контекст (системный промпт и история), поэтому одинаковый вопрос совпадает
+по ключу только у пользователей с одинаковой историей - на практике в начале разговора.
+Сравниваются четыре политики:
+  * "память диалогов выключена" - для сравнения: у всех пустая история;
+  * "без контекста" - ключ только по промпту: попаданий больше, но часть из них - ответ,
+    написанный для другого диалога;
+  * "контекст, без ограничения" - кэшируется все, записи с длинной историей никто не читает;
+  * "контекст, история <= N" - так работает бот: длинная история идет мимо кэша.
+Нейросеть заменена детерминированной функцией: одинаковый контекст и промпт - одинаковый ответ.
+"""
+import argparse
+import hashlib
+import random
+
+from conversation_store import conversation_digest, estimate_tokens
+from response_cache import ResponseCache
+
+SYSTEM = [{"role": "system", "content": "Ты полезный ассистент."}]
+GREETINGS = ["Привет", "Здравствуйте", "Добрый день"]
+POPULAR = [f"Популярный вопрос номер {i}" for i in range(30)]
+
+
+def make_sessions(users: int, messages: int, popular: float, seed: int = 1) -> list[list[str]]:
+    rng = random.Random(seed)
+    sessions = []
+    for uid in range(users):
+        prompts = [rng.choice(GREETINGS)] if rng.random() < 0.5 else []
+        while len(prompts) < messages:
+            if rng.random() < popular:
+                # Несколько вопросов задают намного чаще остальных
+                prompts.append(POPULAR[min(int(rng.expovariate(0.25)), len(POPULAR) - 1)])
+            else:
+                prompts.append(f"Вопрос пользователя {uid} номер {len(prompts)}")
+        sessions.append(prompts)
+    return sessions
+
+
+def fake_answer(context: list[dict], prompt: str) -> str:
+    """Короткий ответ на приветствие, на остальное - от 100 до 400 токенов."""
+    seed = hashlib.sha256((conversation_digest(context) + prompt).encode("utf-8")).digest()
+    if prompt in GREETINGS:
+        return "Привет! Чем могу помочь?"
+    return "Ответ. " * (60 + seed[0] * 2)
+
+
+def simulate(sessions: list[list[str]], max_context_tokens: int, with_context: bool, memory: bool = True) -> dict:
+    cache = ResponseCache(max_entries=100000, max_bytes=1 << 34, max_context_tokens=max_context_tokens)
+    contexts = {}  # ключ -> отпечаток контекста, для которого ответ был получен
+    foreign_hits = 0
+    for prompts in sessions:
+        messages = list(SYSTEM)
+        for prompt in prompts:
+            digest = conversation_digest(messages)
+            history_tokens = sum(estimate_tokens(m["content"]) for m in messages if m["role"] != "system")
+            answer = None
+            if cache.enabled_for(0.0, history_tokens):
+                key = cache.make_key("model", prompt, 0.0, 1000, context=digest if with_context else "")
+                answer = cache.get(key)
+                if answer is not None and contexts[key] != digest:
+                    foreign_hits += 1
+                if answer is None:
+                    answer = fake_answer(messages, prompt)
+                    cache.put(key, answer)
+                    contexts[key] = digest
+            else:
+                answer = fake_answer(messages, prompt)
+            if memory:
+                messages += [{"role": "user", "content": prompt}, {"role": "assistant", "content": answer}]
+    stats = cache.stats()
+    stats["foreign_hits"] = foreign_hits
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--messages", type=int, default=6, help="Сообщений в диалоге одного пользователя")
+    parser.add_argument("--popular", type=float, default=0.4, help="Доля популярных (повторяющихся) вопросов")
+    parser.add_argument("--max-context-tokens", type=int, default=200)
+    args = parser.parse_args()
+
+    sessions = make_sessions(args.users, args.messages, args.popular)
+    total = sum(len(prompts) for prompts in sessions)
+    policies = [
+        ("память диалогов выключена", simulate(sessions, 0, with_context=True, memory=False)),
+        ("без контекста", simulate(sessions, 1 << 30, with_context=False)),
+        ("контекст, без ограничения", simulate(sessions, 1 << 30, with_context=True)),
+        (f"контекст, история <= {args.max_context_tokens}",
+         simulate(sessions, args.max_context_tokens, with_context=True)),
+    ]
+    print(f"Запросов: {total}")
+    print(f"{'':<30}{'попаданий':>11}{'от всех':>9}{'записей':>9}{'чужой контекст':>16}")
+    for name, stats in policies:
+        hits = stats["hits"] + stats["disk_hits"]
+        print(f"{name:<30}{hits:>11}{hits / total:>9.1%}{stats['entries']:>9}{stats['foreign_hits']:>16}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Проверка роутера нейросети на локальных фейковых серверах:
+быстрый, медленный, нестабильный (часть ответов 500) и резервный.
+Сравнивается один сервер (как раньше) и роутер по всем серверам, затем быстрый сервер
+"падает" посреди нагрузки - предохранитель должен увести трафик на остальные.
+Последний прогон - потоки с stream_options на сервер, который отвечает на них 400.
+
+    python -m benchmarks.bench_router [--requests 200] [--concurrency 16]
+"""
+import argparse
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fake_openai import FakeOpenAIServer
+from llm_router import LLMRouter, Endpoint, CircuitBreaker
+
+MESSAGES = [{"role": "user", "content": "Привет! Кто ты?"}]
+
+
+def make_router(servers: dict[str, FakeOpenAIServer], fallback: tuple[str, ...] = (), hedge_delay: float | None = None,
+                breaker_failures: int = 3, **kwargs) -> LLMRouter:
+    endpoints = [Endpoint(name, server.base_url, "fake-model", fallback=name in fallback, timeout=10.0,
+                          breaker=CircuitBreaker(failure_threshold=breaker_failures, reset_timeout=2.0))
+                 for name, server in servers.items()]
+    return LLMRouter(endpoints, hedge_delay=hedge_delay, health_interval=0.5, **kwargs)
+
+
+def run_sync(router: LLMRouter, requests: int, concurrency: int, on_progress=None) -> dict:
+    latencies = []
+    errors = 0
+
+    def one(i):
+        nonlocal errors
+        if on_progress:
+            on_progress(i)
+        started = time.perf_counter()
+        try:
+            router.create(messages=MESSAGES, max_tokens=64)
+        except Exception:
+            errors += 1
+            return
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+async def run_async(router: LLMRouter, requests: int, concurrency: int, **kwargs) -> dict:
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                text = []
+                async for chunk in router.astream(messages=MESSAGES, max_tokens=64, **kwargs):
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        text.append(chunk.choices[0].delta.content)
+            except Exception:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    await router.aclose()
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+def summarize(latencies: list[float], errors: int, elapsed: float) -> dict:
+    latencies.sort()
+    return {
+        "ok": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50": latencies[len(latencies) // 2] if latencies else 0.0,
+        "p95": latencies[int(len(latencies) * 0.95)] if latencies else 0.0,
+    }
+
+
+def report(title: str, result: dict, router: LLMRouter):
+    print(f"\n{title}")
+    print(f"  успешно: {result['ok']}, ошибок: {result['errors']}, {result['rps']:.1f} запросов/с, "
+          f"p50 {result['p50'] * 1000:.0f} мс, p95 {result['p95'] * 1000:.0f} мс")
+    stats = router.stats()
+    print(f"  дублировано: {stats['hedged']} (пропущено сверх лимита: {stats['hedges_skipped']}), повторов: {stats['retries']}")
+    for name, ep in stats["endpoints"].items():
+        latency = f"{ep['latency'] * 1000:.0f} мс" if ep["latency"] is not None else "-"
+        print(f"    {name:10} запросов {ep['requests']:5}  ошибок {ep['errors']:4}  задержка {latency:>8}  "
+              f"предохранитель {ep['breaker']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк роутера нейросети на фейковых серверах")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    servers = {
+        "fast": FakeOpenAIServer(latency=0.05).start(),
+        "slow": FakeOpenAIServer(latency=0.4).start(),
+        "flaky": FakeOpenAIServer(latency=0.05, error_rate=0.3).start(),
+        "reserve": FakeOpenAIServer(latency=0.1).start(),
+    }
+    try:
+        # Как было до роутера: один клиент, без повторов и без предохранителя
+        single = make_router({"flaky": servers["flaky"]}, max_attempts=1, breaker_failures=10 ** 9)
+        report("Один сервер (нестабильный), без повторов:", run_sync(single, args.requests, args.concurrency), single)
+        single.close()
+
+        router = make_router(servers, fallback=("reserve",))
+        report("Роутер по всем серверам:", run_sync(router, args.requests, args.concurrency), router)
+        router.close()
+
+        router = make_router({"slow": servers["slow"], "reserve": servers["reserve"]}, hedge_delay=0.2)
+        report("Медленный и резервный серверы, дублирование через 200 мс:",
+               run_sync(router, args.requests, args.concurrency), router)
+        router.close()
+
+        router = make_router(servers, fallback=("reserve",))
+        router.start_health_checks()
+
+        def fail_fast_server(i):
+            if i == args.requests // 3:
+                servers["fast"].down = True
+
+        report("Роутер, быстрый сервер падает на трети нагрузки:",
+               run_sync(router, args.requests, args.concurrency, on_progress=fail_fast_server), router)
+        servers["fast"].down = False
+        time.sleep(2.5)
+        report("  ...и после его восстановления (проверка здоровья пропускает пробный запрос, он замыкает предохранитель):",
+               run_sync(router, args.requests, args.concurrency), router)
+        router.close()
+
+        router = make_router(servers, fallback=("reserve",))
+        report("Роутер, asyncio + потоковые ответы:",
+               asyncio.run(run_async(router, args.requests, args.concurrency * 4)), router)
+        router.close()
+
+        servers["fast"].stream_options = False
+        sent_before = servers["fast"].requests
+        router = make_router({"fast": servers["fast"]})
+        report("Потоковые ответы с stream_options, сервер отвечает на них 400:",
+               asyncio.run(run_async(router, args.requests, args.concurrency,
+                                     stream_options={"include_usage": True})), router)
+        print(f"  запросов к серверу: {servers['fast'].requests - sent_before}, "
+              f"stream_options: {router.stats()['endpoints']['fast']['stream_options']}")
+        router.close()
+    finally:
+        for server in servers.values():
+            server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Бенчмарк миграции схемы на синтетической таблице подписок (по умолчанию 1M строк):
+проверка подписки на старой схеме (полный просмотр таблицы, даты текстом),
+время миграции на месте и проверка подписки после нее (поиск по первичному ключу users).
+
+    python -m benchmarks.bench_schema [--rows 1000000] [--users 100000] [--lookups 200]
+"""
+import argparse
+import datetime
+import os
+import random
+import tempfile
+import time
+
+import database
+from subscription_cache import SubscriptionCache
+from benchmarks.bench_db_pool import create_legacy_database, legacy_check_user_subscription
+
+
+def populate_legacy(db_name: str, rows: int, users: int):
+    """Старая схема: rows подписок на users пользователей, у каждого ~10% истории активно."""
+    conn = create_legacy_database(db_name)
+    now = datetime.datetime.now()
+    rnd = random.Random(42)
+    conn.executemany("INSERT INTO users (telegram_id, username, first_name) VALUES (?, ?, 'Имя')",
+                     ((uid, f"user{uid}") for uid in range(users)))
+
+    def subscriptions():
+        for i in range(rows):
+            start = now - datetime.timedelta(days=rnd.randint(0, 365))
+            end = start + datetime.timedelta(days=rnd.choice((1, 30, 365)))
+            yield i % users, start, end, 1 if rnd.random() < 0.1 else 0, "Пробный доступ"
+
+    conn.executemany('''
+                     INSERT INTO subscriptions (telegram_id, start_date, end_date, is_active, plan_name)
+                     VALUES (?, ?, ?, ?, ?)
+                     ''', subscriptions())
+    conn.commit()
+    conn.close()
+
+
+def measure(func, user_ids) -> float:
+    """Среднее время одного вызова func(uid) в миллисекундах."""
+    started = time.perf_counter()
+    for uid in user_ids:
+        func(uid)
+    return (time.perf_counter() - started) * 1000 / len(user_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--lookups", type=int, default=200)
+    args = parser.parse_args()
+
+    user_ids = random.Random(7).sample(range(args.users), min(args.lookups, args.users))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, "bench_schema.db")
+
+        started = time.perf_counter()
+        populate_legacy(db_name, args.rows, args.users)
+        print(f"Заполнение старой схемы ({args.rows} подписок): {time.perf_counter() - started:.1f} с")
+
+        legacy_ms = measure(lambda uid: legacy_check_user_subscription(db_name, uid), user_ids)
+        print(f"Проверка подписки, старая схема:  {legacy_ms:.3f} мс/вызов")
+
+        database.use_database(db_name)
+        started = time.perf_counter()
+        database.initialize_database()
+        print(f"Миграция на месте: {time.perf_counter() - started:.1f} с")
+
+        # Кэш отключаем, чтобы мерить именно запрос к БД
+        database.subscription_cache = SubscriptionCache(max_size=0)
+        new_ms = measure(database.check_user_subscription, user_ids)
+        print(f"Проверка подписки, новая схема:   {new_ms:.3f} мс/вызов ({legacy_ms / new_ms:.0f}x)")
+
+        extend_ms = measure(lambda uid: database.add_user_subscription(uid, 1, "Пробный доступ"), user_ids)
+        print(f"add_user_subscription, новая схема: {extend_ms:.3f} мс/вызов")
+
+        database.close_database()
+
+
+if __name__ == '__main__':
+    main()
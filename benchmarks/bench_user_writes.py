@@ -0,0 +1,88 @@
+"""
+Всплеск /start: add_or_update_user "до" (отдельный upsert и commit на каждый вызов)
+и "после" (отложенная запись пачками через database.user_writes).
+
+    python -m benchmarks.bench_user_writes [--calls 10000] [--users 2000] [--threads 4] [--changed 0.05]
+
+Пользователи повторяются (calls > users), часть вызовов меняет username - как при реальном
+наплыве /start после рассылки. Время "после" включает финальный сброс буфера на диск.
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+import database
+
+
+def make_calls(calls: int, users: int, changed: float, seed: int = 1) -> list[tuple]:
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(calls):
+        uid = rng.randrange(users)
+        username = f"user{uid}_new" if rng.random() < changed else f"user{uid}"
+        rows.append((uid, username, "Имя", None))
+    return rows
+
+
+def run(func, rows: list[tuple], threads: int) -> float:
+    """Выполняет func(row) для всех строк в threads потоках, возвращает время в секундах."""
+    chunks = [rows[i::threads] for i in range(threads)]
+
+    def worker(chunk):
+        for row in chunk:
+            func(row)
+
+    pool = [threading.Thread(target=worker, args=(chunk,)) for chunk in chunks]
+    started = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return time.perf_counter() - started
+
+
+def count_users() -> int:
+    with database._pool.connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--changed", type=float, default=0.05, help="Доля вызовов с измененным профилем")
+    args = parser.parse_args()
+
+    rows = make_calls(args.calls, args.users, args.changed)
+    with tempfile.TemporaryDirectory() as tmp:
+        database.use_database(os.path.join(tmp, "before.db"))
+        database.initialize_database()
+        # Так работал add_or_update_user до буфера: одна строка - одна транзакция с fsync
+        before = run(lambda row: database._upsert_users([row]), rows, args.threads)
+        before_users = count_users()
+
+        database.use_database(os.path.join(tmp, "after.db"))
+        database.initialize_database()
+        started = time.perf_counter()
+        handler = run(lambda row: database.add_or_update_user(*row), rows, args.threads)
+        database.flush_user_writes()
+        after = time.perf_counter() - started
+        after_users = count_users()
+
+        print(f"{'':<28}{'время, с':>10}{'upsert/с':>12}")
+        print(f"{'до (commit на вызов)':<28}{before:>10.3f}{args.calls / before:>12.0f}")
+        print(f"{'после (с записью на диск)':<28}{after:>10.3f}{args.calls / after:>12.0f}"
+              f"   x{before / after:.1f}")
+        print(f"{'после (только хэндлер)':<28}{handler:>10.3f}{args.calls / handler:>12.0f}")
+        print(f"Пользователей в БД: до {before_users}, после {after_users}")
+        print(f"Буфер: {database.user_writes.stats()}")
+
+        database.close_database()
+
+
+if __name__ == '__main__':
+    main()
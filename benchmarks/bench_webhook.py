@@ -0,0 +1,183 @@
+"""
+Пропускная способность webhook-режима в зависимости от числа процессов-обработчиков.
+
+Бот (webhook_server.py) запускается отдельным процессом во временном каталоге со своим config.py:
+Telegram Bot API и нейросеть заменены локальными фейковыми серверами, БД - временная.
+Синтетические апдейты (/start, /get_trial, текст для нейросети) отправляются POST-запросами на вебхук,
+замеряется время до получения фейковым Telegram всех ответов бота.
+
+    python -m benchmarks.bench_webhook [--workers 1 2 4] [--users 200] [--messages 5]
+"""
+import argparse
+import http.client
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fake_openai import FakeOpenAIServer
+from benchmarks.fake_telegram import FakeTelegramServer, make_update
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WEBHOOK_PATH = "/telegram/webhook"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def write_config(directory: str, telegram: FakeTelegramServer, openai_server: FakeOpenAIServer, port: int,
+                 workers: int, **overrides):
+    """config.py бота для бенчмарка; overrides - дополнительные или измененные настройки."""
+    config = {
+        "BOT_TOKEN": "123456:BENCHMARK",
+        "TELEGRAM_API_URL": telegram.api_url,
+        "NEURO_API_BASE_URL": openai_server.base_url,
+        "NEURO_MODEL_NAME": "fake-model",
+        "NEURO_API_KEY": "NA",
+        "AI_STREAMING": False,
+        "RESPONSE_CACHE_SIZE": 0,
+        "LLM_HEALTH_CHECK_INTERVAL": 0,
+        "BOT_RUNTIME": "webhook",
+        "WEBHOOK_HOST": "127.0.0.1",
+        "WEBHOOK_PORT": port,
+        "WEBHOOK_PATH": WEBHOOK_PATH,
+        "WEBHOOK_URL": None,
+        "WEBHOOK_SECRET": None,
+        "WEBHOOK_WORKERS": workers,
+        "WEBHOOK_QUEUE_SIZE": 1000,
+        "WEBHOOK_DRAIN_TIMEOUT": 30.0,
+        # Фейковый Telegram не ограничивает частоту - меряем бота, а не лимиты Bot API
+        "OUTBOX_GLOBAL_RATE": 1_000_000.0,
+        "OUTBOX_CHAT_RATE": 1_000_000.0,
+        "OUTBOX_CHAT_BURST": 1_000_000,
+        "OUTBOX_MAX_RETRIES": 5,
+        "OUTBOX_QUEUE_SIZE": 10000,
+        "OUTBOX_WORKERS": 8,
+        # Сообщения пользователя идут подряд, не дожидаясь ответа: каждое должно получить свой ответ
+        "SUPERSEDE_GENERATIONS": False,
+        "FOLLOWUP_MERGE_WINDOW": 0.0,
+        # Квоты тарифов не ограничивают повторные прогоны
+        "PLAN_QUOTAS": {},
+        "DEFAULT_PLAN_QUOTA": {"requests": None, "tokens": None},
+        "QUOTA_WINDOW": 24 * 60 * 60,
+        "QUOTA_FLUSH_INTERVAL": 30.0,
+        "METRICS_HOST": "127.0.0.1",
+        "METRICS_PORT": None,
+        "METRICS_PROFILER": False,
+    }
+    config.update(overrides)
+    with open(os.path.join(directory, "config.py"), "w", encoding="utf-8") as f:
+        for name, value in config.items():
+            f.write(f"{name} = {value!r}\n")
+
+
+def wait_for_port(port: int, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"Вебхук на порту {port} не запустился за {timeout} с.")
+
+
+def synthetic_updates(users: int, messages: int) -> list[dict]:
+    """Для каждого пользователя: /start, /get_trial и messages текстовых сообщений, вперемешку между пользователями."""
+    updates = []
+    update_id = 1
+    scripts = [["/start", "/get_trial"] + [f"Вопрос №{i} к нейросети" for i in range(messages)] for _ in range(users)]
+    for step in range(messages + 2):
+        for user_index, script in enumerate(scripts):
+            updates.append(make_update(update_id, 5_000_000 + user_index, script[step]))
+            update_id += 1
+    return updates
+
+
+def post_update(port: int, update: dict):
+    """Доставляет апдейт на вебхук так, как это делает Telegram: при 503 - повторяет."""
+    body = json.dumps(update).encode("utf-8")
+    while True:
+        # Встроенный HTTP-сервер вебхука закрывает соединение после каждого ответа
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        conn.request("POST", WEBHOOK_PATH, body, {"Content-Type": "application/json"})
+        status = conn.getresponse().status
+        conn.close()
+        if status != 503:
+            return
+        time.sleep(0.05)  # Очередь обработчика переполнена
+
+
+def post_updates(port: int, updates: list[dict], concurrency: int = 8):
+    def post_batch(batch):
+        for update in batch:
+            post_update(port, update)
+
+    # Апдейты одного пользователя отправляет один поток - их порядок сохраняется
+    batches = [[] for _ in range(concurrency)]
+    for update in updates:
+        batches[update["message"]["from"]["id"] % concurrency].append(update)
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(post_batch, batches))
+
+
+def run_once(workers: int, users: int, messages: int, telegram: FakeTelegramServer,
+             openai_server: FakeOpenAIServer) -> float:
+    port = free_port()
+    with tempfile.TemporaryDirectory() as directory:
+        write_config(directory, telegram, openai_server, port, workers)
+        env = {**os.environ, "PYTHONPATH": REPO_ROOT}
+        log = open(os.path.join(directory, "bot.log"), "w")
+        process = subprocess.Popen([sys.executable, "-m", "webhook_server"], cwd=directory, env=env,
+                                   stdout=log, stderr=subprocess.STDOUT)
+        try:
+            wait_for_port(port)
+            time.sleep(1.0 * workers)  # Обработчики импортируют бота и открывают БД
+            updates = synthetic_updates(users, messages)
+            expected = telegram.count("sendMessage") + len(updates)
+
+            started = time.perf_counter()
+            post_updates(port, updates)
+            while telegram.count("sendMessage") < expected:
+                if time.perf_counter() - started > 300:
+                    raise TimeoutError("Бот не ответил на все апдейты за 300 с.")
+                time.sleep(0.01)
+            elapsed = time.perf_counter() - started
+        finally:
+            process.send_signal(signal.SIGTERM)
+            process.wait(timeout=60)
+            log.close()
+        return len(updates) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк webhook-режима")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=5, help="Текстовых сообщений на пользователя")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Задержка фейковой нейросети, с")
+    args = parser.parse_args()
+
+    telegram = FakeTelegramServer().start()
+    openai_server = FakeOpenAIServer(latency=args.llm_latency).start()
+    try:
+        baseline = None
+        for workers in args.workers:
+            rate = run_once(workers, args.users, args.messages, telegram, openai_server)
+            baseline = baseline or rate
+            print(f"Обработчиков: {workers:2}  {rate:8.1f} апдейтов/с  (x{rate / baseline:.2f})")
+    finally:
+        telegram.stop()
+        openai_server.stop()
+
+
+if __name__ == "__main__":
+    main()
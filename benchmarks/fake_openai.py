@@ -0,0 +1,176 @@
+"""
+Локальный фейковый OpenAI-совместимый сервер для проверки роутера и нагрузочных тестов.
+
+    python -m benchmarks.fake_openai --port 8001 --latency 0.5 --tokens-per-sec 50 --error-rate 0.1
+
+Поддерживает GET /v1/models и POST /v1/chat/completions (обычный ответ и stream=True).
+Задержку, скорость генерации, долю ошибок 500 и поддержку stream_options можно менять на лету
+через атрибуты сервера.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency: float = 0.0, tokens_per_sec: float = 0.0, reply_tokens: int = 20,
+                 error_rate: float = 0.0, host: str = "127.0.0.1"):
+        super().__init__((host, port), _Handler)
+        self.latency = latency  # Задержка до первого токена, секунды
+        self.tokens_per_sec = tokens_per_sec  # Скорость генерации (0 - мгновенно)
+        self.reply_tokens = reply_tokens  # Длина ответа в "токенах" (словах)
+        self.error_rate = error_rate  # Доля запросов, отвечающих 500
+        self.down = False  # True - сервер отвечает 503 на все запросы, включая /models
+        self.stream_options = True  # False - запрос с stream_options получает 400, как на части серверов
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "FakeOpenAIServer":
+        self._thread = threading.Thread(target=self.serve_forever, name=f"fake-openai-{self.server_address[1]}",
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def handle_error(self, request, client_address):
+        # Клиент закрыл соединение, не дождавшись ответа (проигравший дублированный запрос, отмена)
+        pass
+
+    def _enter(self):
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def _leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: FakeOpenAIServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.server.down:
+            self._send_json(503, {"error": {"message": "server is down"}})
+        elif self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "fake-model", "object": "model"}]})
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+
+        self.server._enter()
+        try:
+            if self.server.down or random.random() < self.server.error_rate:
+                self._send_json(500 if not self.server.down else 503, {"error": {"message": "fake failure"}})
+                return
+            if "stream_options" in request and not self.server.stream_options:
+                self._send_json(400, {"error": {"message": "Unrecognized request argument supplied: stream_options"}})
+                return
+            time.sleep(self.server.latency)
+            prompt = request.get("messages", [{}])[-1].get("content", "")
+            tokens = [f"слово{i} " for i in range(self.server.reply_tokens)]
+            tokens[0] = f"Ответ на «{prompt[:30]}»: "
+            if request.get("stream"):
+                self._stream(request, tokens)
+            else:
+                time.sleep(len(tokens) / self.server.tokens_per_sec if self.server.tokens_per_sec else 0)
+                self._send_json(200, {
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model"),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": "".join(tokens)}}],
+                    "usage": {"prompt_tokens": len(prompt.split()), "completion_tokens": len(tokens),
+                              "total_tokens": len(prompt.split()) + len(tokens)},
+                })
+        finally:
+            self.server._leave()
+
+    def _stream(self, request: dict, tokens: list[str]):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def chunk(payload: dict):
+            data = f"data: {json.dumps(payload)}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        base = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": request.get("model")}
+        pause = 1 / self.server.tokens_per_sec if self.server.tokens_per_sec else 0
+        try:
+            for token in tokens:
+                chunk({**base, "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]})
+                time.sleep(pause)
+            chunk({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+            if (request.get("stream_options") or {}).get("include_usage"):
+                prompt_tokens = len(request.get("messages", [{}])[-1].get("content", "").split())
+                chunk({**base, "choices": [], "usage": {"prompt_tokens": prompt_tokens,
+                                                        "completion_tokens": len(tokens),
+                                                        "total_tokens": prompt_tokens + len(tokens)}})
+            done = b"data: [DONE]\n\n"
+            self.wfile.write(f"{len(done):x}\r\n".encode() + done + b"\r\n0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # Клиент закрыл поток (отмена генерации)
+            self.close_connection = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Фейковый OpenAI-совместимый сервер")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.2, help="Задержка до первого токена, с")
+    parser.add_argument("--tokens-per-sec", type=float, default=50.0)
+    parser.add_argument("--reply-tokens", type=int, default=40)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(port=args.port, latency=args.latency, tokens_per_sec=args.tokens_per_sec,
+                              reply_tokens=args.reply_tokens, error_rate=args.error_rate)
+    print(f"Фейковый OpenAI сервер: {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
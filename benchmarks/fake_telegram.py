@@ -0,0 +1,185 @@
+"""
+Локальный фейковый Telegram Bot API для нагрузочных тестов.
+Бот направляется на него настройкой TELEGRAM_API_URL = "http://127.0.0.1:<порт>/bot{0}/{1}".
+
+    python -m benchmarks.fake_telegram --port 8081
+
+Отвечает успехом на любой метод, sendMessage/editMessageText возвращают объект сообщения.
+getUpdates (long polling) отдает апдейты, поставленные через push_update(); в webhook-режиме
+апдейты доставляет сам нагрузочный тест (benchmarks.bench_webhook.post_update).
+GET /stats - счетчики вызовов по методам (JSON).
+"""
+import argparse
+import itertools
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+BOT_USER = {"id": 100000, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+
+
+class FakeTelegramServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency: float = 0.0, host: str = "127.0.0.1",
+                 retry_after_every: int = 0):
+        super().__init__((host, port), _Handler)
+        self.latency = latency  # Задержка ответа на каждый вызов, секунды
+        self.retry_after_every = retry_after_every  # Каждый N-й sendMessage отвечает 429 (0 - никогда)
+        self.calls: dict[str, int] = {}
+        self.messages: list[dict] = []  # Отправленные и измененные сообщения (method, chat_id, text, время)
+        # Вызывается при каждом sendMessage: on_message(chat_id) - нагрузочный тест замеряет время ответа
+        self.on_message = None
+        self._message_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._updates: deque[dict] = deque()  # Апдейты для getUpdates, еще не подтвержденные ботом (offset)
+        self._updates_cond = threading.Condition(self._lock)
+
+    @property
+    def api_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/bot{{0}}/{{1}}"
+
+    def start(self) -> "FakeTelegramServer":
+        threading.Thread(target=self.serve_forever, name="fake-telegram", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def handle_error(self, request, client_address):
+        pass
+
+    def count(self, method: str) -> int:
+        with self._lock:
+            return self.calls.get(method, 0)
+
+    def record(self, method: str, params: dict) -> int:
+        with self._lock:
+            calls = self.calls[method] = self.calls.get(method, 0) + 1
+            if method in ("sendMessage", "editMessageText"):
+                self.messages.append({"method": method, "chat_id": params.get("chat_id"), "text": params.get("text"),
+                                      "time": time.time()})
+        if method == "sendMessage" and self.on_message is not None:
+            self.on_message(int(params.get("chat_id") or 0))
+        return calls
+
+    def push_update(self, update: dict):
+        """Ставит апдейт в очередь getUpdates."""
+        with self._updates_cond:
+            self._updates.append(update)
+            self._updates_cond.notify_all()
+
+    def get_updates(self, offset: int, timeout: float, limit: int = 100) -> list[dict]:
+        """getUpdates: апдейты с update_id >= offset; пока их нет - ждет до timeout секунд."""
+        deadline = time.monotonic() + timeout
+        with self._updates_cond:
+            # Апдейты до offset бот подтвердил - больше не отдаем
+            while self._updates and self._updates[0]["update_id"] < offset:
+                self._updates.popleft()
+            while not self._updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._updates_cond.wait(remaining)
+            return list(itertools.islice(self._updates, limit))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: FakeTelegramServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            with self.server._lock:
+                self._send_json(200, {"calls": dict(self.server.calls)})
+            return
+        self.do_POST()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode("utf-8") if length else ""
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            params = json.loads(body or "{}")
+        else:
+            params = dict(parse_qsl(body))
+        # telebot (requests) передает параметры в строке запроса
+        url = urlsplit(self.path)
+        params.update(parse_qsl(url.query))
+        method = url.path.rsplit("/", 1)[-1]
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        calls = self.server.record(method, params)
+
+        if method == "sendMessage" and self.server.retry_after_every and calls % self.server.retry_after_every == 0:
+            self._send_json(429, {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                                  "parameters": {"retry_after": 1}})
+            return
+
+        if method in ("sendMessage", "editMessageText"):
+            chat_id = int(params.get("chat_id") or 0)
+            result = {
+                "message_id": int(params.get("message_id") or next(self.server._message_ids)),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }
+        elif method == "getMe":
+            result = BOT_USER
+        elif method == "getUpdates":
+            result = self.server.get_updates(int(params.get("offset") or 0), float(params.get("timeout") or 0),
+                                             int(params.get("limit") or 100))
+        else:
+            result = True
+        self._send_json(200, {"ok": True, "result": result})
+
+
+def make_update(update_id: int, user_id: int, text: str) -> dict:
+    """Синтетический апдейт с текстовым сообщением от пользователя user_id."""
+    user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private", "first_name": user["first_name"]},
+        "from": user,
+        "text": text,
+    }
+    if text.startswith("/"):
+        command = text.split()[0]
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+    return {"update_id": update_id, "message": message}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Фейковый Telegram Bot API")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = FakeTelegramServer(port=args.port, latency=args.latency)
+    print(f"Фейковый Telegram Bot API: {server.api_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import html
+import logging
+
+from quota import quota_engine, QuotaExceededError, describe_quota
+from log_pipeline import event
+
+try:
+    from database import add_or_update_user, add_user_subscription, check_user_subscription, get_active_plan
+except ImportError:
+    print("Проблемы с импортом из database.py!")
+    # Заглушки
+    def add_or_update_user(tid, uname, fname, lname): logger.error("add_or_update_user не импортирована.")
+    def add_user_subscription(tid, duration_days, plan_name): logger.error("add_user_subscription не импортирована."); return False
+    def check_user_subscription(tid): logger.error("check_user_subscription не импортирована."); return False # Для тестов без БД вернем False
+    def get_active_plan(tid): return None
+
+try:
+    from ai_interface import reset_conversation
+except ImportError:
+    def reset_conversation(user_id: int) -> bool: return False
+
+# Тексты и решения по командам - общие для синхронного (dcorpbot.py) и асинхронного (async_bot.py) бота.
+# Функции здесь блокирующие (БД): async_bot.py вызывает их через run_db. Хэндлеры ботов только
+# получают текст ответа и отправляют его через свой outbox.
+
+logger = logging.getLogger(__name__)
+
+TRIAL_DURATION_DAYS = 1  # Длительность тестового периода
+TRIAL_PLAN_NAME = "Пробный доступ"
+
+HELP_MESSAGE = "Доступные команды: /start, /get_trial, /status, /reset, /help. Для общения с AI просто пишите текст."
+SUBSCRIBE_MESSAGE = "Информация о платных подписках появится позже."
+QUEUE_FULL_MESSAGE = "Сейчас слишком много запросов к нейросети. ⏳\nПожалуйста, попробуйте чуть позже."
+QUOTA_EXCEEDED_MESSAGE = "Лимит вашего тарифа исчерпан. ⌛"
+AI_FAILED_MESSAGE = "К сожалению, не удалось получить ответ от нейросети. Попробуйте позже."
+NO_SUBSCRIPTION_MESSAGE = (
+    "Для доступа к нейросети необходима активная подписка. 😔\n"
+    "Вы можете получить пробный доступ на 1 день с помощью команды /get_trial."
+)
+
+
+def start_reply(user) -> str:
+    """/start: сохраняет пользователя и возвращает приветствие. Запись отложенная (database.user_writes) - диска не ждет."""
+    try:
+        add_or_update_user(user.id, user.username, user.first_name, user.last_name)
+        logger.info(
+            f"Информация о пользователе {user.username or user.first_name} (ID: {user.id}) сохранена/обновлена.")
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении пользователя {user.id} в БД: {e}", exc_info=True)
+
+    return (
+        f"Привет, <b>{user.first_name}</b>! 👋\n\n"
+        f"Я бот с доступом к нейросети DeepSeek.\n"
+        f"Для использования функций нейросети необходима активная подписка.\n\n"
+        f"➡️ Чтобы получить тестовый доступ на 1 день, используй команду /get_trial.\n"
+        f"➡️ Информация о платных подписках (когда появится): /subscribe.\n"
+        f"➡️ Проверить статус своей подписки: /status.\n"
+        f"➡️ Начать разговор с нейросетью заново: /reset.\n"
+        f"➡️ Нужна помощь? /help."
+    )
+
+
+def trial_reply(user_id: int) -> str:
+    """/get_trial: выдает пробный доступ, если активной подписки нет."""
+    if check_user_subscription(user_id):
+        logger.info(f"Пользователь {user_id} попытался активировать триал, имея активную подписку.")
+        return "У вас уже есть активная подписка! Можете пользоваться нейросетью."
+
+    if add_user_subscription(user_id, duration_days=TRIAL_DURATION_DAYS, plan_name=TRIAL_PLAN_NAME):
+        logger.info(f"Пробный доступ на {TRIAL_DURATION_DAYS} дней активирован для пользователя {user_id}.")
+        return f"Поздравляю! Вам предоставлен пробный доступ к нейросети на {TRIAL_DURATION_DAYS} день/дней."
+    logger.error(f"Не удалось активировать пробный доступ для пользователя {user_id}.")
+    return "К сожалению, не удалось активировать пробный доступ. Пожалуйста, попробуйте позже или свяжитесь с поддержкой."
+
+
+def status_reply(user_id: int) -> str:
+    """/status: есть ли подписка и остаток квоты тарифа."""
+    if check_user_subscription(user_id):
+        # В будущем здесь можно будет показывать дату окончания подписки
+        quota_status = quota_engine.status(user_id, get_active_plan(user_id))
+        text = "У вас есть активная подписка! ✅\n\n" + describe_quota(quota_status)
+    else:
+        text = "У вас нет активной подписки. ❌\nИспользуйте /get_trial для получения пробного доступа."
+    logger.info(f"Пользователь {user_id} проверил статус подписки.")
+    return text
+
+
+def reset_reply(user_id: int) -> str:
+    """/reset: очищает историю диалога с нейросетью."""
+    if reset_conversation(user_id):
+        logger.info(f"Пользователь {user_id} очистил историю диалога с AI.")
+        return "Начинаем разговор заново: предыдущие сообщения нейросеть больше не учитывает. 🧹"
+    return "Не удалось очистить историю диалога. Пожалуйста, попробуйте позже."
+
+
+def is_ai_text(message) -> bool:
+    """Текст для нейросети, а не команда, которую не поймали хэндлеры команд."""
+    user = message.from_user
+    if message.text.startswith('/'):
+        logger.info("Пользователь %s ввел необработанную команду: %s", user.id, message.text,
+                    extra=event("unknown_command", user.id))
+        return False
+    logger.info("Пользователь %s (%s) отправил текст для AI: \"%.50s...\"", user.id, user.first_name, message.text,
+                extra=event("user_text", user.id))
+    return True
+
+
+def admit_ai_request(user_id: int) -> tuple[str | None, str | None]:
+    """
+    Проверка перед запросом к нейросети: подписка и квота тарифа (счетчики в памяти; из БД расход
+    читается только при первом обращении к пользователю). Возвращает (тариф, None), если запрос
+    можно выполнять, или (None, текст отказа).
+    """
+    if not check_user_subscription(user_id):
+        logger.info("Пользователю %s отказано в доступе к AI (нет активной подписки).", user_id,
+                    extra=event("no_subscription", user_id))
+        return None, NO_SUBSCRIPTION_MESSAGE
+    plan = get_active_plan(user_id)
+    try:
+        quota_engine.check(user_id, plan)
+    except QuotaExceededError as e:
+        logger.info("Пользователю %s отказано: исчерпана квота тарифа '%s'.", user_id, plan,
+                    extra=event("quota_exceeded", user_id))
+        return None, QUOTA_EXCEEDED_MESSAGE + "\n\n" + describe_quota(e.status)
+    return plan, None
+
+
+def queue_full_reply(user_id: int) -> str:
+    logger.warning("Пользователю %s отказано: очередь запросов к нейросети переполнена.", user_id,
+                   extra=event("queue_full", user_id))
+    return QUEUE_FULL_MESSAGE
+
+
+def format_ai_text(text: str) -> str:
+    """Ответ модели - обычный текст: "<" и "&" в нем не должны разбираться как разметка."""
+    return html.escape(text, quote=False)
+
+
+def ai_reply(user_id: int, user_input: str, ai_response: str | None) -> str:
+    """Текст для полного (не потокового) ответа нейросети."""
+    if ai_response:
+        logger.info("Отправлен ответ AI пользователю %s.", user_id, extra=event("ai_reply", user_id))
+        return format_ai_text(ai_response)
+    logger.error("Не удалось получить ответ от AI для пользователя %s на запрос: \"%.50s...\"", user_id, user_input,
+                 extra=event("ai_reply", user_id))
+    return AI_FAILED_MESSAGE
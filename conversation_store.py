@@ -0,0 +1,201 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
+from database import append_conversation_messages, load_conversation, delete_conversation
+
+try:
+    from config import (CONVERSATION_MEMORY, CONVERSATION_TOKEN_BUDGET, CONVERSATION_MAX_MESSAGES,
+                        CONVERSATION_IDLE_TTL, CONVERSATION_MAX_USERS)
+except ImportError:
+    CONVERSATION_MEMORY = True  # Передавать нейросети предыдущие сообщения диалога
+    CONVERSATION_TOKEN_BUDGET = 3000  # Токенов на запрос: системный промпт + история + новое сообщение
+    CONVERSATION_MAX_MESSAGES = 40  # Сообщений истории в памяти на пользователя
+    CONVERSATION_IDLE_TTL = 1800.0  # Через сколько секунд без сообщений диалог выгружается из памяти
+    CONVERSATION_MAX_USERS = 10000  # Диалогов в памяти одновременно
+
+try:
+    from config import NEURO_SYSTEM_PROMPT
+except ImportError:
+    NEURO_SYSTEM_PROMPT = "Ты полезный ассистент."  # None или "" - без системного промпта
+
+logger = logging.getLogger(__name__)
+
+ROLE_USER = 0
+ROLE_ASSISTANT = 1
+_ROLE_NAMES = {ROLE_USER: "user", ROLE_ASSISTANT: "assistant"}
+
+_MESSAGE_OVERHEAD_TOKENS = 4  # Служебные токены роли и разделителей на каждое сообщение
+# При превышении бюджета история обрезается с запасом, до этой доли: следующие запросы
+# начинаются с того же префикса, и кэш префиксов на сервере нейросети продолжает работать
+_TRIM_TARGET = 0.6
+_SWEEP_INTERVAL = 60.0
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Быстрая оценка длины текста в токенах без токенизатора модели: байт UTF-8 / 4,
+    то есть ~4 символа латиницы или ~2 символа кириллицы на токен. Оценка с запасом.
+    """
+    return (len(text.encode("utf-8")) + 3) // 4
+
+
+def _message_cost(tokens: int) -> int:
+    return tokens + _MESSAGE_OVERHEAD_TOKENS
+
+
+def conversation_digest(messages: list[dict]) -> str:
+    """Отпечаток контекста (системный промпт и история) для ключа кэша ответов."""
+    digest = hashlib.sha256()
+    for message in messages:
+        digest.update(message["role"].encode("utf-8") + b"\x1e" + message["content"].encode("utf-8") + b"\x1f")
+    return digest.hexdigest()
+
+
+class _Conversation:
+    __slots__ = ("messages", "tokens", "last_used")
+
+    def __init__(self, rows: list[tuple[int, str, int]], now: float):
+        self.messages: deque[tuple[int, str, int]] = deque(rows)
+        self.tokens = sum(_message_cost(tokens) for _, _, tokens in rows)
+        self.last_used = now
+
+    def pop_oldest(self):
+        _, _, tokens = self.messages.popleft()
+        self.tokens -= _message_cost(tokens)
+
+
+class ConversationStore:
+    """
+    История диалогов пользователей с нейросетью.
+
+      * SQLite (таблица messages) - полная история, только дописывается;
+      * память - окно последних сообщений активных пользователей, при промахе загружается из БД;
+        диалоги без сообщений idle_ttl секунд и сверх max_users (LRU) выгружаются;
+      * build_messages() собирает запрос: системный промпт, история, новое сообщение - так,
+        чтобы оценка длины не превышала token_budget. Старые сообщения отбрасываются целыми репликами,
+        с запасом (_TRIM_TARGET), окно всегда начинается с сообщения пользователя.
+    """
+
+    def __init__(self, token_budget: int = CONVERSATION_TOKEN_BUDGET, max_messages: int = CONVERSATION_MAX_MESSAGES,
+                 idle_ttl: float = CONVERSATION_IDLE_TTL, max_users: int = CONVERSATION_MAX_USERS,
+                 system_prompt: str | None = NEURO_SYSTEM_PROMPT, enabled: bool = CONVERSATION_MEMORY,
+                 load=load_conversation, append=append_conversation_messages, delete=delete_conversation,
+                 clock=time.monotonic):
+        self.token_budget = token_budget
+        self.max_messages = max_messages
+        self.idle_ttl = idle_ttl
+        self.max_users = max_users
+        self.enabled = enabled and token_budget > 0
+        self._system = [{"role": "system", "content": system_prompt}] if system_prompt else []
+        self._system_cost = _message_cost(estimate_tokens(system_prompt)) if system_prompt else 0
+        self._load = load
+        self._append = append
+        self._delete = delete
+        self._clock = clock
+        self._conversations: OrderedDict[int, _Conversation] = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_sweep = clock()
+        # Статистика
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.trimmed = 0
+
+    def build_messages(self, user_id: int | None, prompt: str) -> list[dict]:
+        """Сообщения для запроса к нейросети. user_id=None или память выключена - без истории."""
+        request = [{"role": "user", "content": prompt}]
+        if user_id is None or not self.enabled:
+            return self._system + request
+
+        conversation = self._get(user_id)
+        available = self.token_budget - self._system_cost - _message_cost(estimate_tokens(prompt))
+        with self._lock:
+            self._trim_locked(conversation, available)
+            history = [{"role": _ROLE_NAMES[role], "content": content}
+                       for role, content, _ in conversation.messages]
+        return self._system + history + request
+
+    def record_turn(self, user_id: int | None, prompt: str, reply: str):
+        """Запоминает реплику пользователя и ответ нейросети (в памяти и в БД)."""
+        if user_id is None or not self.enabled:
+            return
+        rows = [(ROLE_USER, prompt, estimate_tokens(prompt)), (ROLE_ASSISTANT, reply, estimate_tokens(reply))]
+        self._append(user_id, rows)
+        with self._lock:
+            conversation = self._conversations.get(user_id)
+            if conversation is None:
+                return  # Диалог успели выгрузить - при следующем обращении загрузится из БД
+            for row in rows:
+                conversation.messages.append(row)
+                conversation.tokens += _message_cost(row[2])
+            conversation.last_used = self._clock()
+            self._trim_locked(conversation, self.token_budget - self._system_cost)
+
+    def reset(self, user_id: int) -> bool:
+        """Забывает диалог пользователя (/reset). False - не удалось удалить историю из БД."""
+        with self._lock:
+            self._conversations.pop(user_id, None)
+        return self._delete(user_id)
+
+    def _get(self, user_id: int) -> _Conversation:
+        now = self._clock()
+        with self._lock:
+            if now - self._last_sweep >= _SWEEP_INTERVAL:
+                self._sweep_locked(now)
+            conversation = self._conversations.get(user_id)
+            if conversation is not None:
+                self._conversations.move_to_end(user_id)
+                conversation.last_used = now
+                self.hits += 1
+                return conversation
+            self.misses += 1
+
+        # Загрузка из БД - вне блокировки, чтобы не задерживать других пользователей
+        loaded = _Conversation(self._load(user_id, self.max_messages), now)
+        with self._lock:
+            conversation = self._conversations.setdefault(user_id, loaded)
+            self._conversations.move_to_end(user_id)
+            while len(self._conversations) > self.max_users:
+                self._conversations.popitem(last=False)
+                self.evictions += 1
+            return conversation
+
+    def _trim_locked(self, conversation: _Conversation, available: int):
+        if conversation.tokens <= available and len(conversation.messages) <= self.max_messages:
+            return
+        target_tokens = available * _TRIM_TARGET
+        target_messages = int(self.max_messages * _TRIM_TARGET)
+        messages = conversation.messages
+        while messages and (conversation.tokens > target_tokens or len(messages) > target_messages):
+            conversation.pop_oldest()
+            self.trimmed += 1
+        # Ответ нейросети без вопроса в начале окна бесполезен
+        while messages and messages[0][0] != ROLE_USER:
+            conversation.pop_oldest()
+            self.trimmed += 1
+
+    def _sweep_locked(self, now: float):
+        self._last_sweep = now
+        idle = [user_id for user_id, conversation in self._conversations.items()
+                if now - conversation.last_used >= self.idle_ttl]
+        for user_id in idle:
+            del self._conversations[user_id]
+        self.evictions += len(idle)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "users": len(self._conversations),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "evictions": self.evictions,
+                "trimmed_messages": self.trimmed,
+            }
+
+
+conversation_store = ConversationStore()
@@ -1,52 +1,307 @@
 import sqlite3
 import logging
 import datetime
+import time
+
+from db_pool import SQLitePool
+from metrics import timed, DB_CALL_SECONDS
+from subscription_cache import SubscriptionCache
+from write_behind import WriteBehindBuffer
+
+try:
+    from config import DB_POOL_SIZE
+except ImportError:
+    DB_POOL_SIZE = 8
+
+try:
+    from config import SUBSCRIPTION_CACHE_SIZE, SUBSCRIPTION_NEGATIVE_TTL
+except ImportError:
+    SUBSCRIPTION_CACHE_SIZE = 10000  # Сколько пользователей держать в кэше подписок
+    SUBSCRIPTION_NEGATIVE_TTL = 30.0  # Сколько секунд помнить, что подписки нет
+
+try:
+    from config import USER_WRITE_BATCH_SIZE, USER_WRITE_FLUSH_INTERVAL, USER_FINGERPRINT_CACHE_SIZE
+except ImportError:
+    USER_WRITE_BATCH_SIZE = 500  # Сколько пользователей записывать одной транзакцией
+    USER_WRITE_FLUSH_INTERVAL = 1.0  # Не дольше скольких секунд изменения профиля ждут записи
+    USER_FINGERPRINT_CACHE_SIZE = 100000  # Для скольких пользователей помнить последний записанный профиль
 
 # Настройка логирования для этого модуля
 logger = logging.getLogger(__name__)
 
 DB_NAME = 'bot_database.db' # Имя файла вашей базы данных
 
+SECONDS_PER_DAY = 24 * 60 * 60
+EXTENDED_PLAN_SUFFIX = " (продлено)"  # Дописывается к plan_name при продлении подписки
+
+# Пул долгоживущих соединений: соединения открываются лениво при первом запросе
+_pool = SQLitePool(DB_NAME, max_connections=DB_POOL_SIZE)
+
+# Кэш статуса подписок перед check_user_subscription
+subscription_cache = SubscriptionCache(max_size=SUBSCRIPTION_CACHE_SIZE, negative_ttl=SUBSCRIPTION_NEGATIVE_TTL)
+
+
+def use_database(db_name: str):
+    """
+    Переключает модуль на другой файл БД (например, для бенчмарков или тестовой копии).
+    Старый пул соединений закрывается.
+    """
+    global DB_NAME, _pool
+    user_writes.flush()
+    user_writes.forget()
+    _pool.close()
+    DB_NAME = db_name
+    _pool = SQLitePool(db_name, max_connections=DB_POOL_SIZE)
+    subscription_cache.clear()
+
+
+def _format_epoch(epoch: int) -> str:
+    """Epoch-секунды в читаемое локальное время для логов."""
+    return datetime.datetime.fromtimestamp(epoch).isoformat(sep=' ', timespec='seconds')
+
+
+def close_database():
+    """Дописывает отложенные изменения пользователей и закрывает все соединения пула (при остановке бота)."""
+    user_writes.close()
+    logger.info(f"Статистика отложенной записи пользователей: {user_writes.stats()}")
+    logger.info(f"Статистика кэша подписок: {subscription_cache.stats()}")
+    _pool.close()
+    logger.info(f"Соединения с БД '{DB_NAME}' закрыты.")
+
+
+# --- Миграции схемы ---
+# Каждая миграция - функция, получающая курсор. Миграции применяются строго по порядку,
+# каждая в своей транзакции, номер последней примененной хранится в таблице schema_version.
+# Новые миграции добавляются ТОЛЬКО в конец списка MIGRATIONS, старые не меняются.
+
+def _migration_001_initial_schema(cursor: sqlite3.Cursor):
+    """Исходная схема: таблицы users и subscriptions."""
+    # Создаем таблицу 'users'
+    # przechowuje informacje o użytkownikach Telegramu
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            telegram_id INTEGER PRIMARY KEY,    -- Уникальный ID пользователя Telegram
+            username TEXT,                      -- Username пользователя (может быть None)
+            first_name TEXT,                    -- Имя пользователя
+            last_name TEXT,                     -- Фамилия пользователя (может быть None)
+            registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP -- Дата и время регистрации в боте
+        )
+    ''')
+    logger.info("Таблица 'users' проверена/создана.")
+
+    # Создаем таблицу 'subscriptions'
+    # przechowuje informacje o subskrypcjach użytkowników
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            subscription_id INTEGER PRIMARY KEY AUTOINCREMENT, -- Уникальный ID подписки
+            telegram_id INTEGER NOT NULL,                 -- ID пользователя, которому принадлежит подписка
+            start_date TIMESTAMP,                         -- Дата начала подписки
+            end_date TIMESTAMP,                           -- Дата окончания подписки
+            is_active BOOLEAN DEFAULT 0,                  -- Активна ли подписка (0 - нет, 1 - да)
+            plan_name TEXT,                               -- Название тарифного плана (например, 'месячный', 'годовой')
+            payment_id TEXT,                              -- ID платежа из платежной системы (опционально)
+            FOREIGN KEY (telegram_id) REFERENCES users (telegram_id) -- Связь с таблицей users
+        )
+    ''')
+    logger.info("Таблица 'subscriptions' проверена/создана.")
+
+
+def _migration_002_epoch_times_and_indexes(cursor: sqlite3.Cursor):
+    """
+    Даты подписок переводятся из текста (datetime.isoformat) в целые epoch-секунды,
+    добавляются составные индексы и колонка users.active_until - денормализованная
+    дата окончания самой поздней активной подписки (0 - подписки нет).
+    """
+    # Тип колонки в SQLite поменять нельзя, поэтому пересобираем таблицу.
+    # Старые даты записаны как локальное время без таймзоны (datetime.now()), модификатор 'utc'
+    # переводит их в UTC перед вычислением epoch.
+    cursor.execute('''
+        CREATE TABLE subscriptions_new (
+            subscription_id INTEGER PRIMARY KEY AUTOINCREMENT, -- Уникальный ID подписки
+            telegram_id INTEGER NOT NULL,                 -- ID пользователя, которому принадлежит подписка
+            start_date INTEGER,                           -- Начало подписки, epoch-секунды
+            end_date INTEGER,                             -- Окончание подписки, epoch-секунды
+            is_active INTEGER NOT NULL DEFAULT 0,         -- Активна ли подписка (0 - нет, 1 - да)
+            plan_name TEXT,                               -- Название тарифного плана (например, 'месячный', 'годовой')
+            payment_id TEXT,                              -- ID платежа из платежной системы (опционально)
+            FOREIGN KEY (telegram_id) REFERENCES users (telegram_id) -- Связь с таблицей users
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO subscriptions_new (subscription_id, telegram_id, start_date, end_date, is_active, plan_name, payment_id)
+        SELECT subscription_id,
+               telegram_id,
+               CAST(strftime('%s', start_date, 'utc') AS INTEGER),
+               CAST(strftime('%s', end_date, 'utc') AS INTEGER),
+               COALESCE(is_active, 0),
+               plan_name,
+               payment_id
+        FROM subscriptions
+    ''')
+    cursor.execute("DROP TABLE subscriptions")
+    cursor.execute("ALTER TABLE subscriptions_new RENAME TO subscriptions")
+
+    # Поиск активной подписки пользователя (check/add_user_subscription)
+    cursor.execute('''
+        CREATE INDEX idx_subscriptions_user_active
+            ON subscriptions (telegram_id, is_active, end_date)
+    ''')
+    # Выборки по сроку окончания без привязки к пользователю (истекающие подписки)
+    cursor.execute('''
+        CREATE INDEX idx_subscriptions_active_end
+            ON subscriptions (is_active, end_date)
+    ''')
+
+    cursor.execute("ALTER TABLE users ADD COLUMN active_until INTEGER NOT NULL DEFAULT 0")
+    # Пользователи, у которых есть подписка, но нет записи в users (триал без /start)
+    cursor.execute('''
+        INSERT OR IGNORE INTO users (telegram_id)
+        SELECT DISTINCT telegram_id FROM subscriptions
+    ''')
+    cursor.execute('''
+        UPDATE users
+        SET active_until = COALESCE((SELECT MAX(end_date)
+                                     FROM subscriptions
+                                     WHERE subscriptions.telegram_id = users.telegram_id
+                                       AND is_active = 1), 0)
+    ''')
+    logger.info("Даты подписок переведены в epoch, добавлены индексы и users.active_until.")
+
+
+def _migration_003_users_active_plan(cursor: sqlite3.Cursor):
+    """
+    Колонка users.active_plan - тариф самой поздней активной подписки (рядом с active_until),
+    чтобы приоритет запросов к нейросети определялся без обращения к subscriptions.
+    """
+    cursor.execute("ALTER TABLE users ADD COLUMN active_plan TEXT")
+    cursor.execute('''
+        UPDATE users
+        SET active_plan = (SELECT plan_name
+                           FROM subscriptions
+                           WHERE subscriptions.telegram_id = users.telegram_id
+                             AND is_active = 1
+                           ORDER BY end_date DESC LIMIT 1)
+    ''')
+    logger.info("Добавлена колонка users.active_plan.")
+
+
+def _migration_004_conversation_messages(cursor: sqlite3.Cursor):
+    """
+    Таблица messages - история диалога с нейросетью, только дописывается.
+    Роль хранится числом, оценка длины в токенах - рядом с текстом, чтобы не пересчитывать при загрузке.
+    """
+    cursor.execute('''
+        CREATE TABLE messages (
+            message_id INTEGER PRIMARY KEY,      -- Порядковый номер (rowid), растет со временем
+            telegram_id INTEGER NOT NULL,        -- Пользователь, с которым идет диалог
+            role INTEGER NOT NULL,               -- 0 - пользователь, 1 - нейросеть
+            content TEXT NOT NULL,               -- Текст сообщения
+            tokens INTEGER NOT NULL,             -- Оценка длины в токенах
+            created_at INTEGER NOT NULL          -- Время, epoch-секунды
+        )
+    ''')
+    # Последние сообщения пользователя - обратным проходом по индексу
+    cursor.execute("CREATE INDEX idx_messages_user ON messages (telegram_id, message_id)")
+    logger.info("Добавлена таблица messages.")
+
+
+def _migration_005_quota_usage(cursor: sqlite3.Cursor):
+    """
+    Таблица quota_usage - расход квоты нейросети по пользователям, одна строка на интервал
+    скользящего окна (quota.py). Счетчики в памяти процесса, сюда они сбрасываются пачками.
+    """
+    cursor.execute('''
+        CREATE TABLE quota_usage (
+            telegram_id INTEGER NOT NULL,        -- Пользователь
+            bucket_start INTEGER NOT NULL,       -- Начало интервала, epoch-секунды
+            requests INTEGER NOT NULL DEFAULT 0,           -- Запросов к нейросети
+            prompt_tokens INTEGER NOT NULL DEFAULT 0,      -- Токенов в запросах
+            completion_tokens INTEGER NOT NULL DEFAULT 0,  -- Токенов в ответах
+            PRIMARY KEY (telegram_id, bucket_start)
+        ) WITHOUT ROWID
+    ''')
+    logger.info("Добавлена таблица quota_usage.")
+
+
+def _migration_006_subscription_archive_and_checkpoints(cursor: sqlite3.Cursor):
+    """
+    Таблицы для фоновых задач (subscription_sweeper.py): subscriptions_archive - давно закончившиеся
+    подписки, перенесенные из subscriptions, и job_checkpoints - позиция, до которой дошла задача.
+    """
+    cursor.execute('''
+        CREATE TABLE subscriptions_archive (
+            subscription_id INTEGER PRIMARY KEY,      -- ID подписки из subscriptions
+            telegram_id INTEGER NOT NULL,
+            start_date INTEGER,
+            end_date INTEGER,
+            is_active INTEGER NOT NULL DEFAULT 0,
+            plan_name TEXT,
+            payment_id TEXT,
+            archived_at INTEGER NOT NULL              -- Когда перенесена в архив, epoch-секунды
+        )
+    ''')
+    cursor.execute("CREATE INDEX idx_subscriptions_archive_user ON subscriptions_archive (telegram_id)")
+    cursor.execute('''
+        CREATE TABLE job_checkpoints (
+            job TEXT PRIMARY KEY,                     -- Имя задачи
+            position_key INTEGER NOT NULL,            -- Позиция (ключ сортировки, например end_date)
+            position_id INTEGER NOT NULL,             -- и id последней обработанной строки
+            updated_at INTEGER NOT NULL
+        )
+    ''')
+    logger.info("Добавлены таблицы subscriptions_archive и job_checkpoints.")
+
+
+MIGRATIONS = [
+    (1, _migration_001_initial_schema),
+    (2, _migration_002_epoch_times_and_indexes),
+    (3, _migration_003_users_active_plan),
+    (4, _migration_004_conversation_messages),
+    (5, _migration_005_quota_usage),
+    (6, _migration_006_subscription_archive_and_checkpoints),
+]
+
+
+def _get_schema_version(cursor: sqlite3.Cursor) -> int:
+    cursor.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+    cursor.execute("SELECT MAX(version) FROM schema_version")
+    version = cursor.fetchone()[0]
+    return version or 0
+
+
+@timed(DB_CALL_SECONDS)
 def initialize_database():
     """
-    Инициализирует базу данных SQLite и создает таблицы, если они еще не существуют.
+    Инициализирует базу данных SQLite: создает таблицы и применяет
+    все непримененные миграции схемы (существующая БД обновляется на месте).
     """
     try:
-        # Подключаемся к БД (если файла нет, он будет создан)
-        conn = sqlite3.connect(DB_NAME)
+        # Берем соединение из пула (если файла нет, он будет создан)
+        conn = _pool.acquire()
         cursor = conn.cursor()
 
-        # Создаем таблицу 'users'
-        # przechowuje informacje o użytkownikach Telegramu
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                telegram_id INTEGER PRIMARY KEY,    -- Уникальный ID пользователя Telegram
-                username TEXT,                      -- Username пользователя (может быть None)
-                first_name TEXT,                    -- Имя пользователя
-                last_name TEXT,                     -- Фамилия пользователя (может быть None)
-                registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP -- Дата и время регистрации в боте
-            )
-        ''')
-        logger.info("Таблица 'users' проверена/создана.")
-
-        # Создаем таблицу 'subscriptions'
-        # przechowuje informacje o subskrypcjach użytkowników
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS subscriptions (
-                subscription_id INTEGER PRIMARY KEY AUTOINCREMENT, -- Уникальный ID подписки
-                telegram_id INTEGER NOT NULL,                 -- ID пользователя, которому принадлежит подписка
-                start_date TIMESTAMP,                         -- Дата начала подписки
-                end_date TIMESTAMP,                           -- Дата окончания подписки
-                is_active BOOLEAN DEFAULT 0,                  -- Активна ли подписка (0 - нет, 1 - да)
-                plan_name TEXT,                               -- Название тарифного плана (например, 'месячный', 'годовой')
-                payment_id TEXT,                              -- ID платежа из платежной системы (опционально)
-                FOREIGN KEY (telegram_id) REFERENCES users (telegram_id) -- Связь с таблицей users
-            )
-        ''')
-        logger.info("Таблица 'subscriptions' проверена/создана.")
-
-        # Сохраняем изменения
+        current_version = _get_schema_version(cursor)
         conn.commit()
+        logger.info(f"Текущая версия схемы БД: {current_version}.")
+
+        for version, migration in MIGRATIONS:
+            if version <= current_version:
+                continue
+            with _pool.write_lock():
+                # BEGIN IMMEDIATE сразу берет блокировку на запись: DDL и DML миграции атомарны
+                cursor.execute("BEGIN IMMEDIATE")
+                try:
+                    # Повторная проверка под блокировкой - миграцию мог применить другой процесс
+                    if _get_schema_version(cursor) >= version:
+                        conn.rollback()
+                        continue
+                    migration(cursor)
+                    cursor.execute("INSERT INTO schema_version (version) VALUES (?)", (version,))
+                    conn.commit()
+                except BaseException:
+                    conn.rollback()
+                    raise
+            logger.info(f"Применена миграция схемы БД №{version} ({migration.__name__}).")
 
     except sqlite3.Error as e:
         logger.error(f"Ошибка SQLite при инициализации базы данных: {e}", exc_info=True)
@@ -54,49 +309,73 @@ def initialize_database():
         logger.error(f"Неожиданная ошибка при инициализации базы данных: {e}", exc_info=True)
     finally:
         if 'conn' in locals() and conn:
-            conn.close() # Всегда закрываем соединение
-            logger.debug(f"Соединение с БД '{DB_NAME}' закрыто после инициализации.")
+            _pool.release(conn) # Всегда возвращаем соединение в пул
+            logger.debug(f"Соединение с БД '{DB_NAME}' возвращено в пул после инициализации.")
+
+
+@timed(DB_CALL_SECONDS)
+def _upsert_users(users: list[tuple]):
+    """
+    Записывает пачку (telegram_id, username, first_name, last_name) одной транзакцией. Ошибки не ловит.
+    Время записи учитывается только здесь: add_or_update_users_batch, flush_user_writes и фоновый
+    сброс user_writes вызывают эту функцию, и сами в DB_CALL_SECONDS не попадают.
+    """
+    with _pool.connection() as conn, _pool.write_lock():
+        # INSERT ... ON CONFLICT не удаляет старую запись: registration_date остается от первой вставки,
+        # active_until/active_plan (их пишет add_user_subscription) не затрагиваются
+        conn.executemany('''
+                         INSERT INTO users (telegram_id, username, first_name, last_name)
+                         VALUES (?, ?, ?, ?) ON CONFLICT(telegram_id) DO
+                         UPDATE SET
+                             username = excluded.username,
+                             first_name = excluded.first_name,
+                             last_name = excluded.last_name
+                         ''', users)
+        conn.commit()
+    logger.debug("Записано пользователей: %s.", len(users))
+
+
+# Отложенная запись профилей: /start не ждет диска, неизмененные профили не пишутся вовсе
+user_writes = WriteBehindBuffer(_upsert_users, batch_size=USER_WRITE_BATCH_SIZE,
+                                flush_interval=USER_WRITE_FLUSH_INTERVAL,
+                                fingerprint_size=USER_FINGERPRINT_CACHE_SIZE, name="user-writes")
 
 
 def add_or_update_user(telegram_id: int, username: str | None, first_name: str | None, last_name: str | None):
     """
     Добавляет нового пользователя в таблицу 'users' или обновляет его данные,
     если пользователь с таким telegram_id уже существует.
+    Запись отложенная: изменения попадают в БД пачкой не позже USER_WRITE_FLUSH_INTERVAL секунд
+    (или сразу при вызове flush_user_writes/close_database). Сам вызов в БД не ходит и в DB_CALL_SECONDS
+    не учитывается - время записи видно по _upsert_users.
     """
-    try:
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
+    user_writes.submit(telegram_id, (telegram_id, username, first_name, last_name))
 
-        # Используем INSERT OR REPLACE или INSERT ON CONFLICT для атомарной операции
-        # INSERT OR REPLACE: если запись существует, она удаляется и вставляется новая.
-        # INSERT ... ON CONFLICT(telegram_id) DO UPDATE SET ...: если конфликт по telegram_id, обновляем поля.
-        # Второй вариант предпочтительнее, т.к. не удаляет старую запись и может сохранить registration_date.
-
-        # Мы будем использовать INSERT ... ON CONFLICT
-        # registration_date будет установлен только при первой вставке благодаря DEFAULT CURRENT_TIMESTAMP
-        # При обновлении registration_date не будет меняться.
-        cursor.execute('''
-                       INSERT INTO users (telegram_id, username, first_name, last_name)
-                       VALUES (?, ?, ?, ?) ON CONFLICT(telegram_id) DO
-                       UPDATE SET
-                           username = excluded.username,
-                           first_name = excluded.first_name,
-                           last_name = excluded.last_name
-                       -- registration_date не обновляем, он остается от первой вставки
-                       ''', (telegram_id, username, first_name, last_name))
-
-        conn.commit()
-        logger.info(f"Пользователь ID: {telegram_id}, Username: {username} был добавлен/обновлен в БД.")
 
+def add_or_update_users_batch(users: list[tuple]) -> bool:
+    """
+    Добавляет/обновляет сразу много пользователей, users - список (telegram_id, username, first_name, last_name).
+    Пишет синхронно, одной транзакцией. Возвращает True в случае успеха.
+    """
+    try:
+        _upsert_users(users)
+        logger.info(f"Добавлено/обновлено пользователей в БД: {len(users)}.")
+        return True
     except sqlite3.Error as e:
-        logger.error(f"Ошибка SQLite при добавлении/обновлении пользователя ID {telegram_id}: {e}", exc_info=True)
+        logger.error(f"Ошибка SQLite при пакетном добавлении/обновлении {len(users)} пользователей: {e}",
+                     exc_info=True)
+        return False
     except Exception as e:
-        logger.error(f"Неожиданная ошибка при добавлении/обновлении пользователя ID {telegram_id}: {e}", exc_info=True)
-    finally:
-        if 'conn' in locals() and conn:
-            conn.close()
+        logger.error(f"Неожиданная ошибка при пакетном добавлении/обновлении пользователей: {e}", exc_info=True)
+        return False
+
+
+def flush_user_writes():
+    """Синхронно записывает все отложенные изменения пользователей."""
+    user_writes.flush()
 
 
+@timed(DB_CALL_SECONDS)
 def add_user_subscription(telegram_id: int, duration_days: int, plan_name: str = "Тестовый доступ"):
     """
     Добавляет или обновляет подписку для пользователя.
@@ -107,96 +386,341 @@ def add_user_subscription(telegram_id: int, duration_days: int, plan_name: str =
     Для начала, сделаем так: если есть активная, просто продлим ее. Если нет - создадим новую.
     """
     try:
-        conn = sqlite3.connect(DB_NAME)
+        conn = _pool.acquire()
         cursor = conn.cursor()
-        now = datetime.datetime.now()
+        with _pool.write_lock():
+            # Блокировка на запись сразу: проверка и продление/создание подписки атомарны
+            cursor.execute("BEGIN IMMEDIATE")
+            now = int(time.time())
+            duration_seconds = duration_days * SECONDS_PER_DAY
 
-        # Проверяем, есть ли уже активная подписка у этого пользователя
-        cursor.execute('''
-                       SELECT subscription_id, end_date
-                       FROM subscriptions
-                       WHERE telegram_id = ?
-                         AND is_active = 1
-                         AND end_date > ?
-                       ORDER BY end_date DESC LIMIT 1
-                       ''', (telegram_id, now))
-        active_subscription = cursor.fetchone()
-
-        if active_subscription:
-            # Если есть активная подписка, продлеваем ее
-            sub_id, current_end_date_str = active_subscription
-            current_end_date = datetime.datetime.fromisoformat(current_end_date_str)  # Преобразуем строку в datetime
-            new_end_date = current_end_date + datetime.timedelta(days=duration_days)
+            # Проверяем, есть ли уже активная подписка у этого пользователя
             cursor.execute('''
-                           UPDATE subscriptions
-                           SET end_date  = ?,
-                               plan_name = ?
-                           WHERE subscription_id = ?
-                           ''', (new_end_date, plan_name + " (продлено)", sub_id))
-            logger.info(f"Подписка ID {sub_id} для пользователя {telegram_id} продлена до {new_end_date}.")
-        else:
-            # Если активной подписки нет, создаем новую
-            start_date = now
-            end_date = start_date + datetime.timedelta(days=duration_days)
+                           SELECT subscription_id, end_date
+                           FROM subscriptions
+                           WHERE telegram_id = ?
+                             AND is_active = 1
+                             AND end_date > ?
+                           ORDER BY end_date DESC LIMIT 1
+                           ''', (telegram_id, now))
+            active_subscription = cursor.fetchone()
+
+            if active_subscription:
+                # Если есть активная подписка, продлеваем ее
+                sub_id, current_end_date = active_subscription
+                new_end_date = current_end_date + duration_seconds
+                cursor.execute('''
+                               UPDATE subscriptions
+                               SET end_date  = ?,
+                                   plan_name = ?
+                               WHERE subscription_id = ?
+                               ''', (new_end_date, plan_name + EXTENDED_PLAN_SUFFIX, sub_id))
+                logger.info(
+                    f"Подписка ID {sub_id} для пользователя {telegram_id} продлена до {_format_epoch(new_end_date)}.")
+                active_until = new_end_date
+                active_plan = plan_name + EXTENDED_PLAN_SUFFIX
+            else:
+                # Если активной подписки нет, создаем новую
+                start_date = now
+                end_date = start_date + duration_seconds
+                cursor.execute('''
+                               INSERT INTO subscriptions (telegram_id, start_date, end_date, is_active, plan_name)
+                               VALUES (?, ?, ?, 1, ?)
+                               ''', (telegram_id, start_date, end_date, plan_name))
+                logger.info(
+                    f"Новая подписка '{plan_name}' на {duration_days} дней добавлена для пользователя {telegram_id} до {_format_epoch(end_date)}.")
+                active_until = end_date
+                active_plan = plan_name
+
+            # Держим users.active_until/active_plan в синхронизации (запись пользователя создается, если ее еще нет)
             cursor.execute('''
-                           INSERT INTO subscriptions (telegram_id, start_date, end_date, is_active, plan_name)
-                           VALUES (?, ?, ?, 1, ?)
-                           ''', (telegram_id, start_date, end_date, plan_name))
-            logger.info(
-                f"Новая подписка '{plan_name}' на {duration_days} дней добавлена для пользователя {telegram_id} до {end_date}.")
+                           INSERT INTO users (telegram_id, active_until, active_plan)
+                           VALUES (?, ?, ?) ON CONFLICT(telegram_id) DO
+                           UPDATE SET active_until = MAX(active_until, excluded.active_until),
+                                      active_plan = CASE WHEN excluded.active_until >= active_until
+                                                         THEN excluded.active_plan ELSE active_plan END
+                           ''', (telegram_id, active_until, active_plan))
 
-        conn.commit()
+            conn.commit()
+        # Обновляем кэш сразу, чтобы новая подписка была видна без ожидания TTL
+        subscription_cache.set_active_until(telegram_id, active_until, active_plan)
         return True  # Возвращаем True в случае успеха
 
     except sqlite3.Error as e:
         logger.error(f"Ошибка SQLite при добавлении/продлении подписки для пользователя ID {telegram_id}: {e}",
                      exc_info=True)
+        subscription_cache.invalidate(telegram_id)
         return False  # Возвращаем False в случае ошибки
     except Exception as e:
         logger.error(f"Неожиданная ошибка при добавлении/продлении подписки для ID {telegram_id}: {e}", exc_info=True)
+        subscription_cache.invalidate(telegram_id)
         return False
     finally:
         if 'conn' in locals() and conn:
-            conn.close()
+            _pool.release(conn)
 
 
-def check_user_subscription(telegram_id: int) -> bool:
+def _get_subscription_status(telegram_id: int) -> tuple[bool, str | None]:
     """
-    Проверяет, есть ли у пользователя активная и не истекшая подписка.
-    Возвращает True, если активная подписка есть, иначе False.
+    Возвращает (есть ли активная подписка, название тарифа).
+    Сначала смотрит в subscription_cache, в БД идет только при промахе.
     """
+    cached = subscription_cache.get(telegram_id)
+    if cached is not None:
+        return cached
+
     try:
-        conn = sqlite3.connect(DB_NAME)
+        conn = _pool.acquire()
         cursor = conn.cursor()
-        now = datetime.datetime.now()  # Текущее время
 
-        # Выбираем активные подписки, у которых дата окончания еще не наступила
+        # Поиск по первичному ключу: users.active_until - дата окончания самой поздней активной подписки
         cursor.execute('''
-                       SELECT 1
-                       FROM subscriptions
+                       SELECT active_until, active_plan
+                       FROM users
                        WHERE telegram_id = ?
-                         AND is_active = 1
-                         AND end_date > ? LIMIT 1
-                       ''', (telegram_id, now))
+                       ''', (telegram_id,))
 
-        result = cursor.fetchone()  # fetchone() вернет (1,) если найдена запись, или None
+        result = cursor.fetchone()  # fetchone() вернет (active_until, active_plan) если пользователь есть, или None
 
-        if result:
-            logger.debug(f"У пользователя ID {telegram_id} найдена активная подписка.")
-            return True
+        if result and result[0] > time.time():
+            # Проверка идет на каждое сообщение: форматирование откладывается до проверки уровня
+            logger.debug("У пользователя ID %s найдена активная подписка.", telegram_id)
+            subscription_cache.set_active_until(telegram_id, result[0], result[1])
+            return True, result[1]
         else:
-            logger.debug(f"Активная подписка для пользователя ID {telegram_id} не найдена или истекла.")
-            return False
+            logger.debug("Активная подписка для пользователя ID %s не найдена или истекла.", telegram_id)
+            subscription_cache.set_inactive(telegram_id)
+            return False, None
 
     except sqlite3.Error as e:
         logger.error(f"Ошибка SQLite при проверке подписки для пользователя ID {telegram_id}: {e}", exc_info=True)
-        return False  # В случае ошибки считаем, что подписки нет
+        return False, None  # В случае ошибки считаем, что подписки нет
     except Exception as e:
         logger.error(f"Неожиданная ошибка при проверке подписки для ID {telegram_id}: {e}", exc_info=True)
-        return False
+        return False, None
     finally:
         if 'conn' in locals() and conn:
-            conn.close()
+            _pool.release(conn)
+
+
+@timed(DB_CALL_SECONDS)
+def check_user_subscription(telegram_id: int) -> bool:
+    """
+    Проверяет, есть ли у пользователя активная и не истекшая подписка.
+    Возвращает True, если активная подписка есть, иначе False.
+    """
+    return _get_subscription_status(telegram_id)[0]
+
+
+@timed(DB_CALL_SECONDS)
+def get_active_plan(telegram_id: int) -> str | None:
+    """
+    Возвращает название тарифа активной подписки пользователя (без пометки о продлении)
+    или None, если активной подписки нет.
+    """
+    is_active, plan_name = _get_subscription_status(telegram_id)
+    if not is_active or plan_name is None:
+        return None
+    return plan_name.removesuffix(EXTENDED_PLAN_SUFFIX)
+
+
+# --- История диалогов с нейросетью (conversation_store.py) ---
+
+@timed(DB_CALL_SECONDS)
+def append_conversation_messages(telegram_id: int, messages: list[tuple[int, str, int]]) -> bool:
+    """
+    Дописывает сообщения диалога (role, content, tokens) в конец истории пользователя одной транзакцией.
+    Возвращает True в случае успеха.
+    """
+    now = int(time.time())
+    try:
+        with _pool.connection() as conn, _pool.write_lock():
+            conn.executemany('''
+                             INSERT INTO messages (telegram_id, role, content, tokens, created_at)
+                             VALUES (?, ?, ?, ?, ?)
+                             ''', [(telegram_id, role, content, tokens, now) for role, content, tokens in messages])
+            conn.commit()
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка SQLite при сохранении истории диалога пользователя ID {telegram_id}: {e}", exc_info=True)
+        return False
+
+
+@timed(DB_CALL_SECONDS)
+def load_conversation(telegram_id: int, limit: int) -> list[tuple[int, str, int]]:
+    """Последние limit сообщений диалога пользователя (role, content, tokens), от старых к новым."""
+    try:
+        with _pool.connection() as conn:
+            rows = conn.execute('''
+                                SELECT role, content, tokens
+                                FROM messages
+                                WHERE telegram_id = ?
+                                ORDER BY message_id DESC LIMIT ?
+                                ''', (telegram_id, limit)).fetchall()
+        rows.reverse()
+        return rows
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка SQLite при загрузке истории диалога пользователя ID {telegram_id}: {e}", exc_info=True)
+        return []
+
+
+@timed(DB_CALL_SECONDS)
+def delete_conversation(telegram_id: int) -> bool:
+    """Удаляет всю историю диалога пользователя (/reset). Возвращает True в случае успеха."""
+    try:
+        with _pool.connection() as conn, _pool.write_lock():
+            deleted = conn.execute("DELETE FROM messages WHERE telegram_id = ?", (telegram_id,)).rowcount
+            conn.commit()
+        logger.info(f"История диалога пользователя ID {telegram_id} удалена ({deleted} сообщений).")
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка SQLite при удалении истории диалога пользователя ID {telegram_id}: {e}", exc_info=True)
+        return False
+
+
+# --- Расход квоты нейросети (quota.py) ---
+
+@timed(DB_CALL_SECONDS)
+def load_quota_usage(telegram_id: int, since: int) -> list[tuple[int, int, int, int]]:
+    """Расход пользователя по интервалам, начиная с since: (bucket_start, requests, prompt_tokens, completion_tokens)."""
+    with _pool.connection() as conn:
+        return conn.execute('''
+                            SELECT bucket_start, requests, prompt_tokens, completion_tokens
+                            FROM quota_usage
+                            WHERE telegram_id = ?
+                              AND bucket_start >= ?
+                            ORDER BY bucket_start
+                            ''', (telegram_id, since)).fetchall()
+
+
+@timed(DB_CALL_SECONDS)
+def add_quota_usage(rows: list[tuple[int, int, int, int, int]], purge_before: int | None = None):
+    """
+    Прибавляет расход (telegram_id, bucket_start, requests, prompt_tokens, completion_tokens) к счетчикам в БД
+    одной транзакцией; purge_before - заодно удалить интервалы, начавшиеся раньше. Ошибки не ловит.
+    """
+    with _pool.connection() as conn, _pool.write_lock():
+        conn.executemany('''
+                         INSERT INTO quota_usage (telegram_id, bucket_start, requests, prompt_tokens, completion_tokens)
+                         VALUES (?, ?, ?, ?, ?) ON CONFLICT(telegram_id, bucket_start) DO
+                         UPDATE SET requests = requests + excluded.requests,
+                                    prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                                    completion_tokens = completion_tokens + excluded.completion_tokens
+                         ''', rows)
+        if purge_before is not None:
+            conn.execute("DELETE FROM quota_usage WHERE bucket_start < ?", (purge_before,))
+        conn.commit()
+
+
+# --- Обслуживание подписок (subscription_sweeper.py) ---
+
+@timed(DB_CALL_SECONDS)
+def deactivate_expired_subscriptions(now: int, limit: int) -> int:
+    """
+    Снимает is_active не более чем с limit закончившихся к now подписок одной короткой транзакцией.
+    Возвращает число обновленных строк. Ошибки не ловит.
+    """
+    with _pool.connection() as conn, _pool.write_lock():
+        # Выборка по индексу (is_active, end_date): самые давно закончившиеся первыми
+        updated = conn.execute('''
+                               UPDATE subscriptions
+                               SET is_active = 0
+                               WHERE subscription_id IN (SELECT subscription_id
+                                                         FROM subscriptions
+                                                         WHERE is_active = 1
+                                                           AND end_date <= ?
+                                                         ORDER BY end_date LIMIT ?)
+                               ''', (now, limit)).rowcount
+        conn.commit()
+    return updated
+
+
+@timed(DB_CALL_SECONDS)
+def archive_subscriptions(ended_before: int, limit: int) -> int:
+    """
+    Переносит не более limit неактивных подписок, закончившихся до ended_before, в subscriptions_archive
+    (копирование и удаление - одна транзакция). Возвращает число перенесенных строк. Ошибки не ловит.
+    """
+    with _pool.connection() as conn, _pool.write_lock():
+        ids = [row[0] for row in conn.execute('''
+                                              SELECT subscription_id
+                                              FROM subscriptions
+                                              WHERE is_active = 0
+                                                AND end_date < ?
+                                              ORDER BY end_date LIMIT ?
+                                              ''', (ended_before, limit))]
+        if not ids:
+            conn.rollback()
+            return 0
+        placeholders = ",".join("?" * len(ids))
+        conn.execute(f'''
+                     INSERT OR REPLACE INTO subscriptions_archive
+                         (subscription_id, telegram_id, start_date, end_date, is_active, plan_name, payment_id, archived_at)
+                     SELECT subscription_id, telegram_id, start_date, end_date, is_active, plan_name, payment_id, ?
+                     FROM subscriptions
+                     WHERE subscription_id IN ({placeholders})
+                     ''', (int(time.time()), *ids))
+        conn.execute(f"DELETE FROM subscriptions WHERE subscription_id IN ({placeholders})", ids)
+        conn.commit()
+    return len(ids)
+
+
+@timed(DB_CALL_SECONDS)
+def load_expiring_subscriptions(after: tuple[int, int], until: int,
+                                limit: int) -> list[tuple[int, int, int, str | None]]:
+    """
+    Страница активных подписок, заканчивающихся не позже until, в порядке (end_date, subscription_id)
+    строго после позиции after: (subscription_id, telegram_id, end_date, plan_name).
+    Только последняя подписка пользователя - если есть более поздняя, предупреждать не о чем.
+    """
+    end_date, subscription_id = after
+    with _pool.connection() as conn:
+        return conn.execute('''
+                            SELECT s.subscription_id, s.telegram_id, s.end_date, s.plan_name
+                            FROM subscriptions AS s
+                                     JOIN users AS u ON u.telegram_id = s.telegram_id
+                            WHERE s.is_active = 1
+                              AND s.end_date <= ?
+                              AND (s.end_date > ? OR (s.end_date = ? AND s.subscription_id > ?))
+                              AND u.active_until = s.end_date
+                            ORDER BY s.end_date, s.subscription_id LIMIT ?
+                            ''', (until, end_date, end_date, subscription_id, limit)).fetchall()
+
+
+def iter_expiring_subscriptions(after: tuple[int, int], until: int, page_size: int = 200):
+    """
+    Генератор подписок из load_expiring_subscriptions по страницам: в памяти - одна страница,
+    между страницами транзакция чтения не держится (долгая читающая транзакция не дает
+    WAL-журналу сбрасываться в основной файл, пока рассылка идет с ограничением частоты).
+    """
+    while True:
+        page = load_expiring_subscriptions(after, until, page_size)
+        yield from page
+        if len(page) < page_size:
+            return
+        after = (page[-1][2], page[-1][0])
+
+
+@timed(DB_CALL_SECONDS)
+def load_checkpoint(job: str) -> tuple[int, int] | None:
+    """Сохраненная позиция задачи (position_key, position_id) или None."""
+    with _pool.connection() as conn:
+        row = conn.execute("SELECT position_key, position_id FROM job_checkpoints WHERE job = ?", (job,)).fetchone()
+    return tuple(row) if row else None
+
+
+@timed(DB_CALL_SECONDS)
+def save_checkpoint(job: str, position: tuple[int, int]):
+    """Запоминает позицию задачи. Ошибки не ловит."""
+    with _pool.connection() as conn, _pool.write_lock():
+        conn.execute('''
+                     INSERT INTO job_checkpoints (job, position_key, position_id, updated_at)
+                     VALUES (?, ?, ?, ?) ON CONFLICT(job) DO
+                     UPDATE SET position_key = excluded.position_key,
+                                position_id = excluded.position_id,
+                                updated_at = excluded.updated_at
+                     ''', (job, position[0], position[1], int(time.time())))
+        conn.commit()
 
 
 # Этот блок выполнится, если запустить database.py напрямую (python database.py)
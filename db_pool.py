@@ -0,0 +1,157 @@
+import sqlite3
+import logging
+import threading
+import contextlib
+
+try:
+    import fcntl  # Файловые блокировки между процессами (POSIX)
+except ImportError:
+    fcntl = None
+
+# Настройка логирования для этого модуля
+logger = logging.getLogger(__name__)
+
+# PRAGMA, которые применяются к каждому новому соединению.
+# WAL позволяет читателям не блокировать писателя (и наоборот),
+# synchronous=NORMAL в режиме WAL делает fsync только при чекпоинте, а не на каждый commit.
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",      # ~16 МБ страничного кэша на соединение
+    "PRAGMA mmap_size=268435456",    # 256 МБ memory-mapped I/O
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",      # ждем до 5 с, если БД занята другим писателем
+)
+
+# Размер кэша подготовленных выражений в модуле sqlite3 (на каждое соединение).
+# Одинаковые строки SQL компилируются один раз и дальше переиспользуются.
+STATEMENT_CACHE_SIZE = 128
+
+
+class SQLitePool:
+    """
+    Ограниченный пул долгоживущих соединений SQLite.
+    Соединения создаются лениво и возвращаются в пул после использования,
+    поэтому подготовленные выражения и страничный кэш живут между вызовами.
+    Одно соединение в каждый момент используется только одним потоком.
+    """
+
+    def __init__(self, db_name: str, max_connections: int = 8, timeout: float = 30.0):
+        self.db_name = db_name
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._idle: list[sqlite3.Connection] = []
+        self._all: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._closed = False
+        self._write_lock = threading.Lock()
+        self._write_lock_file = None
+
+    def _create_connection(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_name,
+            timeout=self.timeout,
+            check_same_thread=False,  # соединение переходит между потоками, но не используется параллельно
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        logger.debug(f"Открыто новое соединение с БД '{self.db_name}'.")
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        """
+        Берет свободное соединение из пула (или создает новое, если лимит не исчерпан).
+        Блокируется, если все max_connections соединений заняты.
+        """
+        if not self._slots.acquire(timeout=self.timeout):
+            raise sqlite3.OperationalError(f"Нет свободных соединений с БД '{self.db_name}' за {self.timeout} с.")
+        try:
+            with self._lock:
+                if self._closed:
+                    raise sqlite3.ProgrammingError(f"Пул соединений с БД '{self.db_name}' закрыт.")
+                if self._idle:
+                    return self._idle.pop()
+            conn = self._create_connection()
+            with self._lock:
+                self._all.append(conn)
+            return conn
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, conn: sqlite3.Connection):
+        """Возвращает соединение в пул. Незавершенная транзакция откатывается."""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # Соединение в неисправном состоянии - выбрасываем его
+            self._discard(conn)
+        else:
+            with self._lock:
+                if self._closed:
+                    conn.close()
+                else:
+                    self._idle.append(conn)
+        finally:
+            self._slots.release()
+
+    def _discard(self, conn: sqlite3.Connection):
+        with self._lock:
+            if conn in self._all:
+                self._all.remove(conn)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    @contextlib.contextmanager
+    def connection(self):
+        """
+        Контекстный менеджер для работы с соединением:
+
+            with pool.connection() as conn:
+                conn.execute(...)
+                conn.commit()
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    @contextlib.contextmanager
+    def write_lock(self):
+        """
+        Сериализует транзакции записи между потоками и процессами (воркеры webhook-режима).
+        Писатели ждут в очереди на файловой блокировке "<БД>.lock", а не опрашивают БД
+        через busy_timeout, поэтому под нагрузкой из нескольких процессов не бывает "database is locked".
+        Читателей (режим WAL) блокировка не касается.
+        """
+        with self._write_lock:
+            if fcntl is None or self.db_name == ":memory:":
+                yield
+                return
+            if self._write_lock_file is None:
+                self._write_lock_file = open(f"{self.db_name}.lock", "a")
+            fcntl.flock(self._write_lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._write_lock_file, fcntl.LOCK_UN)
+
+    def close(self):
+        """Закрывает все соединения пула. Занятые соединения закроются при возврате."""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._all = [conn for conn in self._all if conn not in idle]
+        for conn in idle:
+            conn.close()
+        with self._write_lock:
+            if self._write_lock_file is not None:
+                self._write_lock_file.close()
+                self._write_lock_file = None
+        logger.debug(f"Пул соединений с БД '{self.db_name}' закрыт.")
@@ -7,144 +7,254 @@ except ImportError:
     exit()
 
 try:
-    # Добавили add_user_subscription и check_user_subscription
-    from database import initialize_database, add_or_update_user, add_user_subscription, check_user_subscription
+    from config import BOT_RUNTIME
+except ImportError:
+    # "sync" - TeleBot с пулом потоков, "async" - AsyncTeleBot (async_bot.py),
+    # "webhook" - HTTP-сервер и несколько процессов-обработчиков (webhook_server.py)
+    BOT_RUNTIME = "sync"
+
+try:
+    from config import TELEGRAM_API_URL
+except ImportError:
+    TELEGRAM_API_URL = None  # Свой адрес Bot API, например "http://127.0.0.1:8081/bot{0}/{1}" (None - api.telegram.org)
+
+try:
+    from config import AI_STREAMING
+except ImportError:
+    AI_STREAMING = True  # Показывать ответ нейросети по мере генерации (правками сообщения)
+
+try:
+    from config import BOT_WORKER_THREADS
+except ImportError:
+    BOT_WORKER_THREADS = 16  # Потоков обработки сообщений; ожидающие очереди к нейросети тоже занимают поток
+
+try:
+    from config import BOT_RESERVED_THREADS
+except ImportError:
+    BOT_RESERVED_THREADS = 4  # Потоков, которые не отдаются запросам к нейросети (команды, отказы)
+
+from llm_scheduler import llm_scheduler, QueueFullError
+from metrics import timed, HANDLER_SECONDS, start_metrics_server
+from subscription_sweeper import SubscriptionSweeper, SUBSCRIPTION_SWEEPER
+from outbox import Outbox
+from generation_tracker import generation_tracker, Generation, INTERRUPTED_NOTE
+from conversation_store import estimate_tokens
+from quota import quota_engine
+from log_pipeline import setup_logging, logging_stats, event
+import bot_logic
+
+try:
+    from database import initialize_database, check_user_subscription, close_database
 except ImportError:
     print("Проблемы с импортом из database.py!")
     # Заглушки
     def initialize_database(): logger.error("initialize_database не импортирована.")
-    def add_or_update_user(tid, uname, fname, lname): logger.error("add_or_update_user не импортирована.")
-    def add_user_subscription(tid, dur, plan): logger.error("add_user_subscription не импортирована."); return False
     def check_user_subscription(tid): logger.error("check_user_subscription не импортирована."); return False # Для тестов без БД вернем False
+    def close_database(): pass
     # exit()
 
 try:
-    from ai_interface import get_custom_ai_response
+    from ai_interface import get_custom_ai_response, stream_custom_ai_response, close_ai_interface
+    from streaming import StreamingReply
 except ImportError:
     print("Файл ai_interface.py или функция get_custom_ai_response не найдены!")
+    AI_STREAMING = False
     def get_custom_ai_response(prompt: str, **kwargs) -> str: # Заглушка
         logger.error("Функция get_custom_ai_response не импортирована. AI функционал недоступен.")
         return "Извините, сервис нейросети временно недоступен."
+    def close_ai_interface(): pass
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
+# Очередь и фоновый поток записи, JSON и семплирование - см. LOG_* в log_pipeline.py
+setup_logging()
 logger = logging.getLogger(__name__)
 
-bot = telebot.TeleBot(BOT_TOKEN, parse_mode="HTML")
+if TELEGRAM_API_URL:
+    telebot.apihelper.API_URL = TELEGRAM_API_URL
 
-logger.info("Инициализация базы данных...")
-initialize_database()
-logger.info("База данных готова к работе.")
+# Создаются в create_bot(): режимы "async" и "webhook" (главный процесс) импортируют модуль,
+# но синхронный бот, его потоки отправки и обслуживание подписок им не нужны
+bot: telebot.TeleBot | None = None
+outbox: Outbox | None = None
+subscription_sweeper: SubscriptionSweeper | None = None
 
+# Хэндлеры модуля в порядке объявления; регистрируются в боте при create_bot()
+_HANDLERS: list[tuple] = []
 
-@bot.message_handler(commands=['start'])
-def send_welcome(message: telebot.types.Message):
-    user = message.from_user
-    try:
-        add_or_update_user(user.id, user.username, user.first_name, user.last_name)
-        logger.info(
-            f"Информация о пользователе {user.username or user.first_name} (ID: {user.id}) сохранена/обновлена.")
-    except Exception as e:
-        logger.error(f"Ошибка при сохранении пользователя {user.id} в БД: {e}", exc_info=True)
 
-    welcome_text = (
-        f"Привет, <b>{user.first_name}</b>! 👋\n\n"
-        f"Я бот с доступом к нейросети DeepSeek.\n"
-        f"Для использования функций нейросети необходима активная подписка.\n\n"
-        f"➡️ Чтобы получить тестовый доступ на 1 день, используй команду /get_trial.\n"
-        f"➡️ Информация о платных подписках (когда появится): /subscribe.\n"
-        f"➡️ Проверить статус своей подписки: /status.\n"
-        f"➡️ Нужна помощь? /help."
-    )
-    bot.reply_to(message, welcome_text)
+def _message_handler(**filters):
+    def register(handler):
+        _HANDLERS.append((handler, filters))
+        return handler
+    return register
 
 
-@bot.message_handler(commands=['get_trial'])
-def get_trial_subscription(message: telebot.types.Message):
-    user = message.from_user
-    trial_duration_days = 1  # Длительность тестового периода
+def create_bot(threaded: bool = True) -> telebot.TeleBot:
+    """
+    Создает синхронного бота с хэндлерами этого модуля, outbox и обслуживание подписок
+    (режим "sync" и процессы-обработчики webhook_server.py). БД к этому моменту уже инициализирована.
+    threaded=False - хэндлеры выполняются в чужом пуле потоков (KeyedExecutor в webhook_server.py).
+    """
+    global bot, outbox, subscription_sweeper
+    bot = telebot.TeleBot(BOT_TOKEN, parse_mode="HTML", threaded=threaded, num_threads=BOT_WORKER_THREADS)
+    for handler, filters in _HANDLERS:
+        bot.register_message_handler(handler, **filters)
+    # Ответы уходят через очередь с лимитами Telegram: хэндлер не ждет отправки и не ловит 429
+    outbox = Outbox(bot)
+    # Снятие истекших подписок, архив и предупреждения об окончании - в фоновом потоке (запускается отдельно)
+    subscription_sweeper = SubscriptionSweeper(notify=outbox.send_message)
+    # И выполняемый, и ожидающий очереди запрос к нейросети держит поток обработки
+    llm_scheduler.fit_to_threads(BOT_WORKER_THREADS, BOT_RESERVED_THREADS)
+    return bot
 
-    if check_user_subscription(user.id):
-        bot.reply_to(message, "У вас уже есть активная подписка! Можете пользоваться нейросетью.")
-        logger.info(f"Пользователь {user.id} попытался активировать триал, имея активную подписку.")
-        return
 
-    if add_user_subscription(user.id, duration_days=trial_duration_days, plan_name="Пробный доступ"):
-        bot.reply_to(message,
-                     f"Поздравляю! Вам предоставлен пробный доступ к нейросети на {trial_duration_days} день/дней.")
-        logger.info(f"Пробный доступ на {trial_duration_days} дней активирован для пользователя {user.id}.")
-    else:
-        bot.reply_to(message,
-                     "К сожалению, не удалось активировать пробный доступ. Пожалуйста, попробуйте позже или свяжитесь с поддержкой.")
-        logger.error(f"Не удалось активировать пробный доступ для пользователя {user.id}.")
+# Тексты ответов и решения по командам - в bot_logic.py (общие с async_bot.py), здесь только отправка
+
+@_message_handler(commands=['start'])
+@timed(HANDLER_SECONDS)
+def send_welcome(message: telebot.types.Message):
+    outbox.reply_to(message, bot_logic.start_reply(message.from_user))
+
+
+@_message_handler(commands=['get_trial'])
+@timed(HANDLER_SECONDS)
+def get_trial_subscription(message: telebot.types.Message):
+    outbox.reply_to(message, bot_logic.trial_reply(message.from_user.id))
 
 
-# --- НОВЫЙ ХЭНДЛЕР для проверки статуса подписки ---
-@bot.message_handler(commands=['status'])
+@_message_handler(commands=['status'])
+@timed(HANDLER_SECONDS)
 def check_subscription_status(message: telebot.types.Message):
-    user_id = message.from_user.id
-    if check_user_subscription(user_id):
-        # В будущем здесь можно будет показывать дату окончания подписки
-        bot.reply_to(message, "У вас есть активная подписка! ✅")
-    else:
-        bot.reply_to(message, "У вас нет активной подписки. ❌\nИспользуйте /get_trial для получения пробного доступа.")
-    logger.info(f"Пользователь {user_id} проверил статус подписки.")
+    outbox.reply_to(message, bot_logic.status_reply(message.from_user.id))
 
 
-# Хэндлер для /help (можно оставить или обновить)
-@bot.message_handler(commands=['help'])
+@_message_handler(commands=['help'])
+@timed(HANDLER_SECONDS)
 def send_help(message: telebot.types.Message):
-    # ... ваш текст для /help ...
-    bot.reply_to(message,
-                 "Доступные команды: /start, /get_trial, /status, /help. Для общения с AI просто пишите текст.")
+    outbox.reply_to(message, bot_logic.HELP_MESSAGE)
+
 
+@_message_handler(commands=['reset'])
+@timed(HANDLER_SECONDS)
+def reset_ai_conversation(message: telebot.types.Message):
+    outbox.reply_to(message, bot_logic.reset_reply(message.from_user.id))
 
-# Хэндлер для /subscribe (заглушка)
-@bot.message_handler(commands=['subscribe'])
+
+@_message_handler(commands=['subscribe'])
+@timed(HANDLER_SECONDS)
 def send_subscribe_info(message: telebot.types.Message):
-    # ... ваш текст-заглушка ...
-    bot.reply_to(message, "Информация о платных подписках появится позже.")
+    outbox.reply_to(message, bot_logic.SUBSCRIBE_MESSAGE)
+
+
+def reply_with_ai(message: telebot.types.Message, generation: Generation) -> int:
+    """
+    Запрашивает ответ нейросети на текст сообщения (generation.prompt - вместе с объединенными
+    предыдущими сообщениями) и отправляет его пользователю. Возвращает оценку длины ответа в токенах.
+    """
+    user = message.from_user
+    user_input = generation.prompt
+    outbox.send_chat_action(message.chat.id, 'typing')
+
+    if AI_STREAMING:
+        # Сразу отправляем заглушку и дописываем ее по мере генерации ответа
+        reply = StreamingReply(outbox, message)
+        reply.start()
+        parts = []
+        for delta in stream_custom_ai_response(user_input, user_id=user.id, cancel=generation.cancel_event):
+            parts.append(delta)
+            reply.feed(bot_logic.format_ai_text(delta))
+        if generation.cancelled:
+            reply.feed(INTERRUPTED_NOTE)
+        reply.finish()
+        logger.info("Отправлен потоковый ответ AI пользователю %s%s.", user.id,
+                    " (прерван новым сообщением)" if generation.cancelled else "", extra=event("ai_reply", user.id))
+        return estimate_tokens(''.join(parts))
+
+    ai_response = get_custom_ai_response(user_input, user_id=user.id, cancel=generation.cancel_event) # Функция из ai_interface.py
 
+    if generation.cancelled:
+        # Пока ждали ответа, пользователь написал снова - ответ на устаревший вопрос не отправляем
+        logger.info("Ответ AI пользователю %s отброшен: получено новое сообщение.", user.id, extra=event("ai_reply", user.id))
+        return estimate_tokens(ai_response or "")
+    outbox.reply_to(message, bot_logic.ai_reply(user.id, user_input, ai_response))
+    return estimate_tokens(ai_response or "")
 
-@bot.message_handler(func=lambda message: True, content_types=['text'])
+
+@_message_handler(func=lambda message: True, content_types=['text'])
+@timed(HANDLER_SECONDS)
 def handle_text_message_for_ai(message: telebot.types.Message):
     user = message.from_user
-    user_input = message.text
+    if not bot_logic.is_ai_text(message):
+        return
 
-    if user_input.startswith('/'): # Игнорируем команды, которые не были пойманы выше
-        logger.info(f"Пользователь {user.id} ввел необработанную команду: {user_input}")
+    plan, refusal = bot_logic.admit_ai_request(user.id)
+    if refusal is not None:
+        outbox.reply_to(message, refusal)
         return
+    # Незаконченный ответ на предыдущее сообщение отменяется, недавнее сообщение объединяется с этим
+    generation = generation_tracker.begin(user.id, message.text)
+    reply_tokens = 0
+    try:
+        # Ждем своей очереди к нейросети (справедливо между пользователями, платные тарифы - приоритетнее)
+        # Новое сообщение пользователя прерывает и ожидание в очереди
+        with llm_scheduler.slot(user.id, plan, generation.cancel_event) as granted:
+            if granted and generation_tracker.start(generation):
+                reply_tokens = reply_with_ai(message, generation)
+    except QueueFullError:
+        outbox.reply_to(message, bot_logic.queue_full_reply(user.id))
+    finally:
+        # Без стриминга синхронный запрос к нейросети не прервать - при отмене ответ лишь отбрасывается
+        generation_tracker.finish(generation, reply_tokens, aborted_upstream=AI_STREAMING)
+
+
+def preempt_generation(update: telebot.types.Update):
+    """
+    Для webhook_server.py: там апдейты одного пользователя обрабатываются строго по очереди,
+    поэтому текущую генерацию новое сообщение отменяет сразу при получении, а не в своем хэндлере.
+    """
+    message = update.message
+    if message is None or not message.text or message.text.startswith('/'):
+        return
+    if check_user_subscription(message.from_user.id):
+        generation_tracker.preempt(message.from_user.id)
+
+
+def shutdown():
+    """Освобождает ресурсы при остановке бота (в том числе в процессах-обработчиках webhook_server.py)."""
+    subscription_sweeper.stop()
+    outbox.close()
+    close_ai_interface()
+    logger.info(f"Статистика очереди запросов к нейросети: {llm_scheduler.stats()}")
+    logger.info(f"Статистика отмены генераций: {generation_tracker.stats()}")
+    # Расход квот, еще не сброшенный в БД
+    quota_engine.close()
+    logger.info(f"Статистика квот: {quota_engine.stats()}")
+    close_database()
+    logger.info(f"Статистика логирования: {logging_stats()}")
 
-    logger.info(f"Пользователь {user.id} ({user.first_name}) отправил текст для AI: \"{user_input[:50]}...\"")
-
-    # --- НОВАЯ ПРОВЕРКА ПОДПИСКИ ---
-    if check_user_subscription(user.id):
-        bot.send_chat_action(message.chat.id, 'typing')
-        ai_response = get_custom_ai_response(user_input) # Функция из ai_interface.py
-
-        if ai_response:
-            bot.reply_to(message, ai_response)
-            logger.info(f"Отправлен ответ AI пользователю {user.id}.")
-        else:
-            bot.reply_to(message, "К сожалению, не удалось получить ответ от нейросети. Попробуйте позже.")
-            logger.error(f"Не удалось получить ответ от AI для пользователя {user.id} на запрос: \"{user_input[:50]}...\"")
-    else:
-        # Если подписки нет
-        no_subscription_message = (
-            "Для доступа к нейросети необходима активная подписка. 😔\n"
-            "Вы можете получить пробный доступ на 1 день с помощью команды /get_trial."
-        )
-        bot.reply_to(message, no_subscription_message)
-        logger.info(f"Пользователю {user.id} отказано в доступе к AI (нет активной подписки).")
 
 if __name__ == '__main__':
+    if BOT_RUNTIME == "async":
+        import async_bot
+        async_bot.run()
+        exit()
+    if BOT_RUNTIME == "webhook":
+        import webhook_server
+        webhook_server.run()
+        exit()
+
+    logger.info("Инициализация базы данных...")
+    initialize_database()
+    logger.info("База данных готова к работе.")
+    create_bot()
+
     logger.info("Бот запускается...")
+    start_metrics_server()
+    if SUBSCRIPTION_SWEEPER:
+        subscription_sweeper.start()
     try:
         bot.polling(none_stop=True, interval=0)
     except Exception as e:
         logger.error(f"Ошибка при запуске или работе бота: {e}", exc_info=True)
     finally:
+        shutdown()
         logger.info("Бот остановлен.")
\ No newline at end of file
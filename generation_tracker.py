@@ -0,0 +1,220 @@
+import logging
+import threading
+import time
+
+try:
+    from config import SUPERSEDE_GENERATIONS, FOLLOWUP_MERGE_WINDOW
+except ImportError:
+    SUPERSEDE_GENERATIONS = True  # Новое сообщение пользователя отменяет еще не законченный ответ на предыдущее
+    FOLLOWUP_MERGE_WINDOW = 3.0  # Сообщения, отправленные с таким интервалом (с), объединяются в один запрос
+
+logger = logging.getLogger(__name__)
+
+INTERRUPTED_NOTE = "\n\n<i>Ответ прерван: учитываю ваше новое сообщение.</i>"
+
+# Средняя длина ответа (токенов) до первых замеров и вес нового замера в скользящем среднем
+_DEFAULT_REPLY_TOKENS = 300.0
+_EWMA_ALPHA = 0.1
+# Сколько секунд ждать begin() сообщения, вытеснившего генерацию через preempt()
+_PREEMPTED_TTL = 60.0
+
+
+class CancelEvent(threading.Event):
+    """
+    threading.Event, который при установке вызывает подписанные функции. Так отмена сразу будит поток,
+    ждущий слота в llm_scheduler, и закрывает HTTP-поток, пока ждем первого чанка от нейросети.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._callbacks = []
+        self._callbacks_lock = threading.Lock()
+
+    def add_callback(self, callback):
+        """callback() вызывается в потоке, установившем событие (сразу, если оно уже установлено)."""
+        with self._callbacks_lock:
+            if not self.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback):
+        with self._callbacks_lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def set(self):
+        with self._callbacks_lock:
+            super().set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Ошибка в обработчике отмены генерации: {e}")
+
+
+class Generation:
+    """Один запрос пользователя к нейросети: от постановки в очередь до отправки ответа."""
+
+    __slots__ = ("user_id", "prompt", "created_at", "superseded_at", "started", "finished", "cancel_event",
+                 "merged", "_task")
+
+    def __init__(self, user_id: int, prompt: str, created_at: float, merged: int = 0):
+        self.user_id = user_id
+        self.prompt = prompt  # Вместе с предыдущими сообщениями, если они объединены
+        self.created_at = created_at
+        self.superseded_at: float | None = None  # Когда пришло вытеснившее ее сообщение
+        self.started = False  # Запрос к нейросети уже отправлен (вышли из очереди)
+        self.finished = False
+        self.cancel_event = CancelEvent()
+        self.merged = merged  # Сколько предыдущих сообщений вошло в prompt
+        self._task = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def attach_task(self, task):
+        """Режим asyncio: отмена генерации отменяет задачу (и закрывает ее HTTP-соединение)."""
+        self._task = task
+        if self.cancelled:
+            task.cancel()
+
+    def _cancel(self):
+        self.cancel_event.set()
+        if self._task is not None:
+            self._task.get_loop().call_soon_threadsafe(self._task.cancel)
+
+
+class GenerationTracker:
+    """
+    Текущие генерации пользователей. begin() для нового сообщения отменяет незаконченную генерацию
+    того же пользователя (в очереди - она просто не начнется, в работе - закрывается поток к нейросети).
+    Если предыдущее сообщение пришло не раньше merge_window секунд назад, его текст
+    объединяется с новым: пользователь дописал или исправил вопрос.
+
+    Обработчик передает generation.cancel_event в llm_scheduler и запрос к нейросети (синхронный режим)
+    или отдает задачу в attach_task (asyncio) и по окончании вызывает finish(). Если сообщения одного
+    пользователя обрабатываются строго по очереди (webhook_server.py), отменить текущую генерацию
+    при получении нового сообщения можно через preempt().
+    """
+
+    def __init__(self, enabled: bool = SUPERSEDE_GENERATIONS, merge_window: float = FOLLOWUP_MERGE_WINDOW,
+                 clock=time.monotonic):
+        self.enabled = enabled
+        self.merge_window = merge_window
+        self._clock = clock
+        # Незаконченная генерация пользователя
+        self._current: dict[int, Generation] = {}
+        # Законченные генерации, вытесненные через preempt(): их текст объединится с сообщением,
+        # которое их вытеснило, в его begin()
+        self._preempted: dict[int, Generation] = {}
+        self._lock = threading.Lock()
+        self._reply_tokens = _DEFAULT_REPLY_TOKENS
+        # Статистика
+        self.superseded = 0
+        self.merged = 0
+        self.cancelled_queued = 0
+        self.cancelled_running = 0
+        self.completed = 0
+        self.tokens_before_cancel = 0
+        self.tokens_saved = 0.0
+
+    def preempt(self, user_id: int):
+        """Пришло новое сообщение пользователя: отменяет его текущую генерацию, не дожидаясь begin()."""
+        if not self.enabled:
+            return
+        with self._lock:
+            previous = self._current.get(user_id)
+            if previous is not None and not previous.finished:
+                self._supersede_locked(previous, self._clock())
+
+    def begin(self, user_id: int, prompt: str) -> Generation:
+        now = self._clock()
+        with self._lock:
+            preempted = self._preempted.pop(user_id, None)
+            previous = (self._current.get(user_id) or preempted) if self.enabled else None
+            if previous is None:
+                generation = Generation(user_id, prompt, now)
+            else:
+                self._supersede_locked(previous, now)
+                if previous.superseded_at - previous.created_at <= self.merge_window:
+                    self.merged += 1
+                    generation = Generation(user_id, f"{previous.prompt}\n{prompt}", now, previous.merged + 1)
+                else:
+                    generation = Generation(user_id, prompt, now)
+            self._current[user_id] = generation
+            return generation
+
+    def _supersede_locked(self, previous: Generation, now: float):
+        if previous.cancelled:
+            return  # Уже вытеснена (preempt)
+        previous.superseded_at = now
+        self.superseded += 1
+        if previous.started:
+            self.cancelled_running += 1
+        else:
+            self.cancelled_queued += 1
+            # Запрос не был отправлен - сэкономлен ответ целиком
+            self.tokens_saved += self._reply_tokens
+        previous._cancel()
+        logger.info(f"Новое сообщение пользователя {previous.user_id} отменило предыдущую генерацию.")
+
+    def start(self, generation: Generation) -> bool:
+        """Генерация вышла из очереди. False - ее уже отменили, запрос отправлять не нужно."""
+        with self._lock:
+            if generation.cancelled:
+                return False
+            generation.started = True
+            return True
+
+    def finish(self, generation: Generation, reply_tokens: int = 0, aborted_upstream: bool = True):
+        """
+        Генерация закончилась. reply_tokens - оценка длины полученного текста: для завершенной генерации
+        это длина ответа, для прерванной - сколько успели сгенерировать до отмены.
+        aborted_upstream=False - запрос к нейросети прервать нельзя (синхронный вызов без стриминга),
+        при отмене ответ только отбрасывается и ничего не экономится.
+        """
+        with self._lock:
+            generation.finished = True
+            if self._current.get(generation.user_id) is generation:
+                del self._current[generation.user_id]
+                if generation.cancelled:
+                    self._remember_preempted_locked(generation)
+            if not generation.started:
+                return
+            if generation.cancelled:
+                self.tokens_before_cancel += reply_tokens
+                if aborted_upstream:
+                    # Оценка сэкономленного: средняя длина ответа минус уже сгенерированное
+                    self.tokens_saved += max(self._reply_tokens - reply_tokens, 0.0)
+            else:
+                self.completed += 1
+                self._reply_tokens += _EWMA_ALPHA * (reply_tokens - self._reply_tokens)
+
+    def _remember_preempted_locked(self, generation: Generation):
+        now = self._clock()
+        # begin() вытеснившего сообщения может и не случиться (ошибка до него) - старые записи удаляются
+        for user_id, stale in list(self._preempted.items()):
+            if now - stale.superseded_at > _PREEMPTED_TTL:
+                del self._preempted[user_id]
+        if generation.superseded_at - generation.created_at <= self.merge_window:
+            self._preempted[generation.user_id] = generation
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": len(self._current),
+                "completed": self.completed,
+                "superseded": self.superseded,
+                "merged": self.merged,
+                "cancelled_queued": self.cancelled_queued,
+                "cancelled_running": self.cancelled_running,
+                "tokens_before_cancel": self.tokens_before_cancel,
+                "tokens_saved_estimate": round(self.tokens_saved),
+                "avg_reply_tokens": round(self._reply_tokens, 1),
+            }
+
+
+generation_tracker = GenerationTracker()
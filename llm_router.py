@@ -0,0 +1,655 @@
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import openai
+from openai import OpenAI, AsyncOpenAI
+
+from generation_tracker import CancelEvent
+
+# Настройка логирования для этого модуля
+logger = logging.getLogger(__name__)
+
+try:
+    from config import (LLM_MAX_ATTEMPTS, LLM_HEDGING, LLM_HEDGE_DELAY, LLM_HEALTH_CHECK_INTERVAL,
+                        LLM_BREAKER_FAILURES, LLM_BREAKER_RESET_TIMEOUT)
+except ImportError:
+    LLM_MAX_ATTEMPTS = 3  # Попыток на запрос (на разных серверах)
+    LLM_HEDGING = True  # Дублировать медленный запрос на другой сервер
+    LLM_HEDGE_DELAY = None  # Через сколько секунд дублировать (None - по наблюдаемой задержке сервера)
+    LLM_HEALTH_CHECK_INTERVAL = 15.0  # Период активной проверки серверов, секунды (0 - выключено)
+    LLM_BREAKER_FAILURES = 3  # Ошибок подряд, после которых сервер исключается из ротации
+    LLM_BREAKER_RESET_TIMEOUT = 30.0  # Через сколько секунд пробовать исключенный сервер снова
+
+try:
+    from config import LLM_HEDGE_MAX_IN_FLIGHT
+except ImportError:
+    # Синхронных дублированных запросов одновременно: проигравший запрос не прервать, он дорабатывает в фоне
+    LLM_HEDGE_MAX_IN_FLIGHT = 4
+
+# Задержка сервера, пока по нему нет наблюдений, секунды
+_INITIAL_LATENCY = 1.0
+# Коэффициент сглаживания экспоненциального среднего задержки
+_EWMA_ALPHA = 0.2
+# Границы адаптивной задержки перед дублированием запроса, секунды
+_HEDGE_DELAY_MIN = 1.0
+_HEDGE_DELAY_MAX = 30.0
+
+
+# Сервер, выполнивший последний успешный запрос роутера в текущем потоке (задаче asyncio):
+# вызывающий код пишет в лог, какой сервер и какая модель на самом деле ответили
+served_endpoint: contextvars.ContextVar["Endpoint | None"] = contextvars.ContextVar("served_endpoint", default=None)
+
+
+class NoAvailableEndpointError(Exception):
+    """Нет ни одного сервера нейросети, готового принять запрос (все выключены предохранителем)."""
+
+
+def is_retryable_error(e: BaseException) -> bool:
+    """Ошибка сервера, а не запроса: есть смысл повторить на другом сервере."""
+    if isinstance(e, (openai.APIConnectionError, NoAvailableEndpointError)):  # включая APITimeoutError
+        return True
+    if isinstance(e, openai.APIStatusError):
+        return e.status_code == 429 or e.status_code >= 500
+    return False
+
+
+def _rejects_stream_options(e: BaseException, request: dict) -> bool:
+    """Сервер отклонил запрос с stream_options: часть OpenAI-совместимых серверов не знает этот параметр."""
+    return "stream_options" in request and isinstance(e, openai.APIStatusError) and e.status_code in (400, 422)
+
+
+class CircuitBreaker:
+    """
+    Предохранитель сервера: после failure_threshold ошибок подряд сервер "размыкается"
+    на reset_timeout секунд, затем пропускает один пробный запрос (half-open).
+    Успех пробного запроса замыкает цепь, ошибка - снова размыкает.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = LLM_BREAKER_FAILURES, reset_timeout: float = LLM_BREAKER_RESET_TIMEOUT,
+                 clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+
+    def available(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            return self._clock() - self.opened_at >= self.reset_timeout
+        return not self._trial_in_flight
+
+    def acquire(self):
+        """Вызывается, когда сервер выбран для запроса (после available() == True)."""
+        if self.state == self.OPEN:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            self._trial_in_flight = True
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"Предохранитель разомкнут после {self.failures} ошибок подряд.")
+            self.state = self.OPEN
+            self.opened_at = self._clock()
+
+    def release(self):
+        """Запрос завершился без результата (отменен) - пробный слот освобождается."""
+        self._trial_in_flight = False
+
+    def probe_succeeded(self):
+        """
+        Сервер ответил на проверку здоровья: разомкнутый предохранитель сразу пропускает пробный запрос,
+        не дожидаясь reset_timeout. Замыкает цепь только успех настоящего запроса - сервер может
+        отвечать на GET /models, но не справляться с генерацией.
+        """
+        if self.state == self.OPEN:
+            self.state = self.HALF_OPEN
+            self._trial_in_flight = False
+
+
+class Endpoint:
+    """
+    Один OpenAI-совместимый сервер. Держит собственные клиенты (и пулы соединений),
+    счетчик запросов в работе, сглаженную задержку и предохранитель.
+    """
+
+    def __init__(self, name: str, base_url: str, model: str, api_key: str = "sk-dummy-key-for-local",
+                 weight: float = 1.0, fallback: bool = False, timeout: float = 120.0, health_check: bool = True,
+                 breaker: CircuitBreaker | None = None):
+        self.name = name
+        self.base_url = base_url
+        self.model = model
+        self.weight = weight
+        self.fallback = fallback
+        self.health_check = health_check
+        self.breaker = breaker or CircuitBreaker()
+        # Повторы делает роутер (на другом сервере), поэтому встроенные повторы клиента выключены
+        self.client = OpenAI(base_url=base_url, api_key=api_key, timeout=timeout, max_retries=0)
+        self.async_client = AsyncOpenAI(base_url=base_url, api_key=api_key, timeout=timeout, max_retries=0)
+        self.outstanding = 0
+        self.latency: float | None = None
+        self.requests = 0
+        self.errors = 0
+        self.healthy = True
+        self.stream_options = True  # False - сервер отклонил stream_options, поток запрашивается без них
+
+    def score(self) -> float:
+        """Чем меньше, тем лучше: запросы в работе с учетом задержки и веса сервера."""
+        return (self.outstanding + 1) * (self.latency or _INITIAL_LATENCY) / self.weight
+
+    def observe_latency(self, seconds: float):
+        self.latency = seconds if self.latency is None else (1 - _EWMA_ALPHA) * self.latency + _EWMA_ALPHA * seconds
+
+    def stats(self) -> dict:
+        return {
+            "base_url": self.base_url,
+            "model": self.model,
+            "outstanding": self.outstanding,
+            "latency": self.latency,
+            "requests": self.requests,
+            "errors": self.errors,
+            "breaker": self.breaker.state,
+            "healthy": self.healthy,
+            "stream_options": self.stream_options,
+        }
+
+
+class LLMRouter:
+    """
+    Распределяет запросы к нейросети между несколькими OpenAI-совместимыми серверами:
+
+      * выбирается сервер с наименьшим числом запросов в работе с учетом задержки (Endpoint.score);
+      * серверы с fallback=True используются, только если основные недоступны;
+      * ошибки соединения, 429 и 5xx повторяются на другом сервере (до max_attempts попыток);
+      * запрос без потока, не ответивший за hedge_delay, дублируется на другой сервер,
+        берется первый ответ. В asyncio проигравший запрос отменяется (соединение закрывается).
+        У синхронного клиента OpenAI нет способа прервать запрос в работе: проигравший дорабатывает
+        в фоне, занимая поток пула и сервер, поэтому одновременно дублируется не больше
+        max_hedges_in_flight запросов (считая с дубля до окончания обоих), остальные просто ждут ответа;
+      * фоновый поток периодически проверяет серверы (GET /models); не ответивший сервер
+        исключается из ротации до следующей успешной проверки.
+    """
+
+    def __init__(self, endpoints: list[Endpoint], max_attempts: int = LLM_MAX_ATTEMPTS, hedging: bool = LLM_HEDGING,
+                 hedge_delay: float | None = LLM_HEDGE_DELAY, health_interval: float = LLM_HEALTH_CHECK_INTERVAL,
+                 max_hedges_in_flight: int = LLM_HEDGE_MAX_IN_FLIGHT, clock=time.monotonic):
+        if not endpoints:
+            raise ValueError("Нужен хотя бы один сервер нейросети.")
+        self.endpoints = endpoints
+        # Модели всех серверов: ответить может любой из них, поэтому кэш ответов ключуется этим набором
+        self.model_id = "+".join(sorted({ep.model for ep in endpoints}))
+        self.max_attempts = max_attempts
+        self.hedging = hedging and len(endpoints) > 1
+        self.hedge_delay = hedge_delay
+        self.health_interval = health_interval
+        self.max_hedges_in_flight = max_hedges_in_flight
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=64, thread_name_prefix="llm") if self.hedging else None
+        self._health_thread: threading.Thread | None = None
+        self._stop = threading.Event()
+        self._hedges_in_flight = 0
+        self.hedged = 0
+        self.hedges_skipped = 0
+        self.retries = 0
+
+    @classmethod
+    def from_config(cls, endpoints_config: list[dict]) -> "LLMRouter":
+        """
+        endpoints_config - список словарей: name, base_url, model, api_key, а также
+        необязательные weight, fallback, timeout, health_check.
+        """
+        endpoints = []
+        for i, ep in enumerate(endpoints_config):
+            endpoints.append(Endpoint(
+                name=ep.get("name") or f"endpoint-{i}",
+                base_url=ep["base_url"],
+                model=ep["model"],
+                api_key=ep.get("api_key") or "sk-dummy-key-for-local",
+                weight=ep.get("weight", 1.0),
+                fallback=ep.get("fallback", False),
+                timeout=ep.get("timeout", 120.0),
+                health_check=ep.get("health_check", True),
+            ))
+        return cls(endpoints)
+
+    # --- Выбор сервера ---
+
+    def _pick(self, exclude: list[Endpoint]) -> Endpoint:
+        """
+        Выбирает сервер и сразу учитывает запрос в его счетчике (атомарно). Сервер, не прошедший
+        последнюю проверку здоровья, запросов не получает до следующей успешной проверки.
+        """
+        with self._lock:
+            candidates = [ep for ep in self.endpoints
+                          if ep not in exclude and ep.healthy and ep.breaker.available()]
+            primary = [ep for ep in candidates if not ep.fallback]
+            candidates = primary or candidates
+            if not candidates:
+                raise NoAvailableEndpointError("Все серверы нейросети недоступны.")
+            endpoint = min(candidates, key=Endpoint.score)
+            endpoint.breaker.acquire()
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def _finish(self, endpoint: Endpoint, latency: float | None = None, error: BaseException | None = None,
+                cancelled: bool = False):
+        with self._lock:
+            endpoint.outstanding -= 1
+            if cancelled:
+                endpoint.breaker.release()
+            elif error is not None and is_retryable_error(error):
+                endpoint.errors += 1
+                endpoint.breaker.record_failure()
+            else:
+                # Ошибка самого запроса (400 и т.п.) сервер не характеризует
+                endpoint.breaker.record_success()
+                if latency is not None:
+                    endpoint.observe_latency(latency)
+
+    def _hedge_delay_for(self, endpoint: Endpoint) -> float:
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+        return min(max(2 * (endpoint.latency or _HEDGE_DELAY_MAX), _HEDGE_DELAY_MIN), _HEDGE_DELAY_MAX)
+
+    # --- Синхронные запросы ---
+
+    def _call(self, endpoint: Endpoint, kwargs: dict):
+        started = self._clock()
+        try:
+            result = endpoint.client.chat.completions.create(**{**kwargs, "model": endpoint.model})
+        except BaseException as e:
+            self._finish(endpoint, error=e)
+            raise
+        self._finish(endpoint, latency=self._clock() - started)
+        return endpoint, result
+
+    def create(self, **kwargs):
+        """Аналог client.chat.completions.create(...) без stream, с повторами и дублированием."""
+        tried: list[Endpoint] = []
+        last_error: BaseException | None = None
+        for attempt in range(self.max_attempts):
+            try:
+                endpoint = self._pick(tried)
+            except NoAvailableEndpointError:
+                raise last_error or NoAvailableEndpointError("Все серверы нейросети недоступны.")
+            tried.append(endpoint)
+            if attempt:
+                self.retries += 1
+            try:
+                if self._executor is None:
+                    served, result = self._call(endpoint, kwargs)
+                else:
+                    served, result = self._create_hedged(endpoint, tried, kwargs)
+                served_endpoint.set(served)
+                return result
+            except Exception as e:
+                if not is_retryable_error(e):
+                    raise
+                last_error = e
+                logger.warning(f"Сервер нейросети {endpoint.name} ответил ошибкой ({type(e).__name__}), "
+                               f"попытка {attempt + 1} из {self.max_attempts}.")
+        raise last_error
+
+    def _reserve_hedge(self) -> bool:
+        with self._lock:
+            if self._hedges_in_flight >= self.max_hedges_in_flight:
+                self.hedges_skipped += 1
+                return False
+            self._hedges_in_flight += 1
+            return True
+
+    def _release_hedge_when_done(self, futures: list):
+        """Дубль занимает место в max_hedges_in_flight, пока не закончатся оба запроса."""
+        left = [len(futures)]
+
+        def on_done(_future):
+            with self._lock:
+                left[0] -= 1
+                if not left[0]:
+                    self._hedges_in_flight -= 1
+
+        for future in futures:
+            future.add_done_callback(on_done)
+
+    def _create_hedged(self, primary: Endpoint, tried: list[Endpoint], kwargs: dict):
+        first = self._executor.submit(self._call, primary, kwargs)
+        pending = {first}
+        done, _ = wait(pending, timeout=self._hedge_delay_for(primary))
+        if not done and self._reserve_hedge():
+            try:
+                backup = self._pick(tried)
+            except NoAvailableEndpointError:
+                backup = None
+            if backup is None:
+                with self._lock:
+                    self._hedges_in_flight -= 1
+            else:
+                tried.append(backup)
+                self.hedged += 1
+                logger.info(f"Запрос к {primary.name} выполняется долго, дублируем на {backup.name}.")
+                second = self._executor.submit(self._call, backup, kwargs)
+                pending.add(second)
+                self._release_hedge_when_done([first, second])
+
+        errors = []
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # Проигравший запрос доработает в фоне (см. max_hedges_in_flight), его результат отбрасывается
+                    return future.result()
+                errors.append(future.exception())
+        raise errors[0]
+
+    def stream(self, cancel: CancelEvent | None = None, **kwargs):
+        """
+        Аналог client.chat.completions.create(..., stream=True): генератор чанков.
+        Ошибки до первого чанка повторяются на другом сервере; закрытие генератора закрывает поток.
+        Установка cancel, пока ждем первого чанка, закрывает поток из отменяющего потока -
+        генератор заканчивается без чанков (дальше cancel проверяет вызывающий код на каждом чанке).
+        """
+        tried: list[Endpoint] = []
+        last_error: BaseException | None = None
+        for attempt in range(self.max_attempts):
+            try:
+                endpoint = self._pick(tried)
+            except NoAvailableEndpointError:
+                raise last_error or NoAvailableEndpointError("Все серверы нейросети недоступны.")
+            tried.append(endpoint)
+            if attempt:
+                self.retries += 1
+            started = self._clock()
+            try:
+                upstream, iterator, first = self._open_stream(endpoint, kwargs, cancel)
+                break
+            except Exception as e:
+                if cancel is not None and cancel.is_set():
+                    self._finish(endpoint, cancelled=True)
+                    return
+                self._finish(endpoint, error=e)
+                if not is_retryable_error(e):
+                    raise
+                last_error = e
+                logger.warning(f"Сервер нейросети {endpoint.name} не начал поток ({type(e).__name__}), "
+                               f"попытка {attempt + 1} из {self.max_attempts}.")
+        else:
+            raise last_error
+
+        if cancel is not None and cancel.is_set():
+            upstream.close()
+            self._finish(endpoint, cancelled=True)
+            return
+        served_endpoint.set(endpoint)
+        time_to_first_chunk = self._clock() - started
+        error = None
+        try:
+            if first is not None:
+                yield first
+            for chunk in iterator:
+                yield chunk
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            upstream.close()
+            self._finish(endpoint, latency=time_to_first_chunk, error=error)
+
+    def _open_stream(self, endpoint: Endpoint, kwargs: dict, cancel: CancelEvent | None):
+        """
+        Открывает поток на сервере и читает первый чанк: (поток, итератор, первый чанк).
+        Если сервер отклонил stream_options (400/422), запрос повторяется на нем же без них;
+        удался повтор - этому серверу stream_options больше не передаются.
+        """
+        request = self._stream_request(endpoint, kwargs)
+        try:
+            return self._start_stream(endpoint, request, cancel)
+        except Exception as e:
+            if not _rejects_stream_options(e, request) or (cancel is not None and cancel.is_set()):
+                raise
+            del request["stream_options"]
+            opened = self._start_stream(endpoint, request, cancel)
+            self._disable_stream_options(endpoint, e)
+            return opened
+
+    def _start_stream(self, endpoint: Endpoint, request: dict, cancel: CancelEvent | None):
+        upstream = endpoint.client.chat.completions.create(**request)
+        try:
+            iterator = iter(upstream)
+            return upstream, iterator, self._first_chunk(upstream, iterator, cancel)
+        except BaseException:
+            # Поток открыт, но первый чанк не пришел - закрываем соединение перед следующей попыткой
+            upstream.close()
+            raise
+
+    @staticmethod
+    def _stream_request(endpoint: Endpoint, kwargs: dict) -> dict:
+        request = {**kwargs, "model": endpoint.model, "stream": True}
+        if not endpoint.stream_options:
+            request.pop("stream_options", None)
+        return request
+
+    @staticmethod
+    def _disable_stream_options(endpoint: Endpoint, error: BaseException):
+        endpoint.stream_options = False
+        logger.warning(f"Сервер нейросети {endpoint.name} не поддерживает stream_options ({error}): потоки на него "
+                       f"идут без них, расход токенов оценивается по длине текста.")
+
+    @staticmethod
+    def _first_chunk(upstream, iterator, cancel: CancelEvent | None):
+        if cancel is None:
+            return next(iterator, None)
+        # Чтение первого чанка не прервать флагом: при отмене соединение закрывается, и next() завершается
+        cancel.add_callback(upstream.close)
+        try:
+            return next(iterator, None)
+        finally:
+            cancel.remove_callback(upstream.close)
+
+    # --- Асинхронные запросы ---
+
+    async def _acall(self, endpoint: Endpoint, kwargs: dict):
+        started = self._clock()
+        try:
+            result = await endpoint.async_client.chat.completions.create(**{**kwargs, "model": endpoint.model})
+        except asyncio.CancelledError:
+            self._finish(endpoint, cancelled=True)
+            raise
+        except BaseException as e:
+            self._finish(endpoint, error=e)
+            raise
+        self._finish(endpoint, latency=self._clock() - started)
+        return endpoint, result
+
+    async def acreate(self, **kwargs):
+        """Асинхронный create: проигравший дублированный запрос отменяется (соединение закрывается)."""
+        tried: list[Endpoint] = []
+        last_error: BaseException | None = None
+        for attempt in range(self.max_attempts):
+            try:
+                endpoint = self._pick(tried)
+            except NoAvailableEndpointError:
+                raise last_error or NoAvailableEndpointError("Все серверы нейросети недоступны.")
+            tried.append(endpoint)
+            if attempt:
+                self.retries += 1
+            try:
+                if not self.hedging:
+                    served, result = await self._acall(endpoint, kwargs)
+                else:
+                    served, result = await self._acreate_hedged(endpoint, tried, kwargs)
+                served_endpoint.set(served)
+                return result
+            except Exception as e:
+                if not is_retryable_error(e):
+                    raise
+                last_error = e
+                logger.warning(f"Сервер нейросети {endpoint.name} ответил ошибкой ({type(e).__name__}), "
+                               f"попытка {attempt + 1} из {self.max_attempts}.")
+        raise last_error
+
+    async def _acreate_hedged(self, primary: Endpoint, tried: list[Endpoint], kwargs: dict):
+        pending = {asyncio.create_task(self._acall(primary, kwargs))}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=self._hedge_delay_for(primary))
+            if not done:
+                try:
+                    backup = self._pick(tried)
+                except NoAvailableEndpointError:
+                    backup = None
+                if backup is not None:
+                    tried.append(backup)
+                    self.hedged += 1
+                    logger.info(f"Запрос к {primary.name} выполняется долго, дублируем на {backup.name}.")
+                    pending.add(asyncio.create_task(self._acall(backup, kwargs)))
+
+            errors = []
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    errors.append(task.exception())
+            raise errors[0]
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def astream(self, **kwargs):
+        """Асинхронный вариант stream()."""
+        tried: list[Endpoint] = []
+        last_error: BaseException | None = None
+        for attempt in range(self.max_attempts):
+            try:
+                endpoint = self._pick(tried)
+            except NoAvailableEndpointError:
+                raise last_error or NoAvailableEndpointError("Все серверы нейросети недоступны.")
+            tried.append(endpoint)
+            if attempt:
+                self.retries += 1
+            started = self._clock()
+            try:
+                upstream, iterator, first = await self._aopen_stream(endpoint, kwargs)
+                break
+            except asyncio.CancelledError:
+                self._finish(endpoint, cancelled=True)
+                raise
+            except Exception as e:
+                self._finish(endpoint, error=e)
+                if not is_retryable_error(e):
+                    raise
+                last_error = e
+                logger.warning(f"Сервер нейросети {endpoint.name} не начал поток ({type(e).__name__}), "
+                               f"попытка {attempt + 1} из {self.max_attempts}.")
+        else:
+            raise last_error
+
+        served_endpoint.set(endpoint)
+        time_to_first_chunk = self._clock() - started
+        error = None
+        try:
+            if first is not None:
+                yield first
+            async for chunk in iterator:
+                yield chunk
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            await upstream.close()
+            self._finish(endpoint, latency=time_to_first_chunk, error=error)
+
+    async def _aopen_stream(self, endpoint: Endpoint, kwargs: dict):
+        """Асинхронный вариант _open_stream()."""
+        request = self._stream_request(endpoint, kwargs)
+        try:
+            return await self._astart_stream(endpoint, request)
+        except Exception as e:
+            if not _rejects_stream_options(e, request):
+                raise
+            del request["stream_options"]
+            opened = await self._astart_stream(endpoint, request)
+            self._disable_stream_options(endpoint, e)
+            return opened
+
+    @staticmethod
+    async def _astart_stream(endpoint: Endpoint, request: dict):
+        upstream = await endpoint.async_client.chat.completions.create(**request)
+        try:
+            iterator = upstream.__aiter__()
+            return upstream, iterator, await anext(iterator, None)
+        except BaseException:
+            await upstream.close()
+            raise
+
+    # --- Проверка здоровья ---
+
+    def check_health(self):
+        """Один проход активной проверки всех серверов."""
+        for endpoint in self.endpoints:
+            if not endpoint.health_check:
+                continue
+            try:
+                endpoint.client.with_options(timeout=5.0).models.list()
+            except Exception as e:
+                with self._lock:
+                    endpoint.healthy = False
+                    endpoint.breaker.record_failure()
+                logger.warning(f"Сервер нейросети {endpoint.name} не прошел проверку: {type(e).__name__} - {e}")
+            else:
+                with self._lock:
+                    if not endpoint.healthy:
+                        logger.info(f"Сервер нейросети {endpoint.name} снова доступен.")
+                    endpoint.healthy = True
+                    endpoint.breaker.probe_succeeded()
+
+    def _health_loop(self):
+        while not self._stop.wait(self.health_interval):
+            self.check_health()
+
+    def start_health_checks(self):
+        if self.health_interval <= 0 or self._health_thread is not None:
+            return
+        self._health_thread = threading.Thread(target=self._health_loop, name="llm-health", daemon=True)
+        self._health_thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        for endpoint in self.endpoints:
+            endpoint.client.close()
+
+    async def aclose(self):
+        for endpoint in self.endpoints:
+            await endpoint.async_client.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hedged": self.hedged,
+                "hedges_in_flight": self._hedges_in_flight,
+                "hedges_skipped": self.hedges_skipped,
+                "retries": self.retries,
+                "endpoints": {ep.name: ep.stats() for ep in self.endpoints},
+            }
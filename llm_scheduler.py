@@ -0,0 +1,263 @@
+import asyncio
+import contextlib
+import logging
+import threading
+import time
+from collections import deque
+
+from generation_tracker import CancelEvent
+
+try:
+    from config import (LLM_MAX_CONCURRENT, LLM_PER_USER_CONCURRENCY, LLM_QUEUE_SIZE, LLM_PER_USER_QUEUE,
+                        LLM_PLAN_WEIGHTS, LLM_DEFAULT_PLAN_WEIGHT)
+except ImportError:
+    LLM_MAX_CONCURRENT = 8  # Одновременных запросов к нейросети на весь бот
+    LLM_PER_USER_CONCURRENCY = 1  # Одновременных запросов от одного пользователя
+    LLM_QUEUE_SIZE = 100  # Всего запросов в очереди ожидания
+    LLM_PER_USER_QUEUE = 3  # Запросов одного пользователя в очереди ожидания
+    # Вес тарифа: пользователь с весом 4 обслуживается в 4 раза чаще пользователя с весом 1
+    LLM_PLAN_WEIGHTS = {"Пробный доступ": 1, "Тестовый доступ": 1}
+    LLM_DEFAULT_PLAN_WEIGHT = 4  # Вес платных тарифов, не перечисленных в LLM_PLAN_WEIGHTS
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних времен ожидания хранить для перцентилей
+_WAIT_SAMPLES = 1000
+
+
+class QueueFullError(Exception):
+    """Очередь запросов к нейросети переполнена - запрос нужно отклонить сразу."""
+
+
+class _Ticket:
+    __slots__ = ("user_id", "enqueued_at", "granted", "_wake")
+
+    def __init__(self, user_id: int, enqueued_at: float, wake):
+        self.user_id = user_id
+        self.enqueued_at = enqueued_at
+        self.granted = False
+        self._wake = wake
+
+
+class LLMScheduler:
+    """
+    Планировщик запросов к нейросети между обработчиками сообщений и клиентом API.
+
+      * не больше max_concurrent запросов одновременно на весь бот;
+      * не больше per_user_limit одновременных запросов от одного пользователя;
+      * ограниченная очередь ожидания (всего max_queue, на пользователя per_user_queue),
+        при переполнении - QueueFullError сразу, без ожидания;
+      * справедливость: взвешенный round-robin по пользователям (stride scheduling) -
+        каждый выданный слот сдвигает "виртуальное время" пользователя на 1/вес тарифа,
+        следующий слот получает ожидающий пользователь с наименьшим виртуальным временем.
+
+    Ядро потокобезопасно и используется как из потоков TeleBot (slot), так и из asyncio (async_slot).
+    """
+
+    def __init__(self, max_concurrent: int = LLM_MAX_CONCURRENT, per_user_limit: int = LLM_PER_USER_CONCURRENCY,
+                 max_queue: int = LLM_QUEUE_SIZE, per_user_queue: int = LLM_PER_USER_QUEUE,
+                 plan_weights: dict | None = None, default_weight: float = LLM_DEFAULT_PLAN_WEIGHT,
+                 clock=time.monotonic):
+        self.max_concurrent = max_concurrent
+        self.per_user_limit = per_user_limit
+        self.max_queue = max_queue
+        self.per_user_queue = per_user_queue
+        self.plan_weights = LLM_PLAN_WEIGHTS if plan_weights is None else plan_weights
+        self.default_weight = default_weight
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._running = 0
+        self._running_per_user: dict[int, int] = {}
+        self._waiting: dict[int, deque[_Ticket]] = {}
+        self._queued = 0
+        self._weights: dict[int, float] = {}
+        self._vtime: dict[int, float] = {}
+        self._global_vtime = 0.0
+        # Статистика
+        self.granted = 0
+        self.rejected = 0
+        self.max_queue_depth = 0
+        self._waits: deque[float] = deque(maxlen=_WAIT_SAMPLES)
+        self._wait_total = 0.0
+
+    def weight_for(self, plan_name: str | None) -> float:
+        if plan_name is None:
+            return 1
+        return self.plan_weights.get(plan_name, self.default_weight)
+
+    def fit_to_threads(self, threads: int, reserved: int):
+        """
+        Для обработчиков в пуле потоков (TeleBot, webhook_server.py): и выполняемый, и ожидающий запрос
+        держат поток. Уменьшает max_concurrent и max_queue так, чтобы вместе они занимали не больше
+        threads - reserved потоков: остальные апдейты (команды, отказ "очередь переполнена")
+        всегда находят свободный поток.
+        """
+        available = max(threads - reserved, 1)
+        with self._lock:
+            max_concurrent = min(self.max_concurrent, available)
+            max_queue = min(self.max_queue, available - max_concurrent)
+            if (max_concurrent, max_queue) == (self.max_concurrent, self.max_queue):
+                return
+            logger.info(f"Потоков обработки {threads} (из них {reserved} в резерве): одновременных запросов "
+                        f"к нейросети {self.max_concurrent} -> {max_concurrent}, очередь {self.max_queue} -> "
+                        f"{max_queue}. Для большей очереди увеличьте BOT_WORKER_THREADS.")
+            self.max_concurrent = max_concurrent
+            self.max_queue = max_queue
+
+    # --- Ядро (все методы с "_locked" вызываются под self._lock) ---
+
+    def _enqueue(self, user_id: int, plan_name: str | None, wake) -> _Ticket:
+        now = self._clock()
+        with self._lock:
+            self._weights[user_id] = self.weight_for(plan_name)
+            ticket = _Ticket(user_id, now, wake)
+            if not self._waiting and self._running < self.max_concurrent and self._user_can_run_locked(user_id):
+                self._grant_locked(ticket, now)
+                return ticket
+
+            user_queue = self._waiting.get(user_id)
+            if self._queued >= self.max_queue or (user_queue and len(user_queue) >= self.per_user_queue):
+                self.rejected += 1
+                raise QueueFullError()
+            if user_queue is None:
+                user_queue = self._waiting[user_id] = deque()
+                # Вернувшийся после паузы пользователь не должен "копить" приоритет за время простоя
+                self._vtime[user_id] = max(self._vtime.get(user_id, 0.0), self._global_vtime)
+            user_queue.append(ticket)
+            self._queued += 1
+            self.max_queue_depth = max(self.max_queue_depth, self._queued)
+            self._dispatch_locked()
+            return ticket
+
+    def _user_can_run_locked(self, user_id: int) -> bool:
+        return self._running_per_user.get(user_id, 0) < self.per_user_limit
+
+    def _grant_locked(self, ticket: _Ticket, now: float):
+        user_id = ticket.user_id
+        self._running += 1
+        self._running_per_user[user_id] = self._running_per_user.get(user_id, 0) + 1
+        vtime = max(self._vtime.get(user_id, 0.0), self._global_vtime)
+        self._global_vtime = vtime
+        self._vtime[user_id] = vtime + 1.0 / self._weights.get(user_id, 1)
+        wait = now - ticket.enqueued_at
+        self._waits.append(wait)
+        self._wait_total += wait
+        self.granted += 1
+        ticket.granted = True
+
+    def _dispatch_locked(self):
+        """Раздает освободившиеся слоты ожидающим пользователям."""
+        now = self._clock()
+        while self._running < self.max_concurrent and self._waiting:
+            candidates = [uid for uid in self._waiting if self._user_can_run_locked(uid)]
+            if not candidates:
+                return
+            user_id = min(candidates, key=lambda uid: self._vtime.get(uid, 0.0))
+            user_queue = self._waiting[user_id]
+            ticket = user_queue.popleft()
+            if not user_queue:
+                del self._waiting[user_id]
+            self._queued -= 1
+            self._grant_locked(ticket, now)
+            ticket._wake()
+
+    def _release(self, ticket: _Ticket):
+        with self._lock:
+            if ticket.granted:
+                user_id = ticket.user_id
+                self._running -= 1
+                left = self._running_per_user[user_id] - 1
+                if left:
+                    self._running_per_user[user_id] = left
+                else:
+                    del self._running_per_user[user_id]
+                    if user_id not in self._waiting:
+                        self._forget_user_locked(user_id)
+            else:
+                # Ожидание прервано (отмена задачи или генерации) - убираем билет из очереди
+                user_queue = self._waiting.get(ticket.user_id)
+                if user_queue and ticket in user_queue:
+                    user_queue.remove(ticket)
+                    self._queued -= 1
+                    if not user_queue:
+                        del self._waiting[ticket.user_id]
+            self._dispatch_locked()
+
+    def _forget_user_locked(self, user_id: int):
+        # Виртуальное время бездействующего пользователя все равно поднимется до глобального при возвращении
+        self._weights.pop(user_id, None)
+        self._vtime.pop(user_id, None)
+
+    # --- Интерфейсы для потоков и asyncio ---
+
+    @contextlib.contextmanager
+    def slot(self, user_id: int, plan_name: str | None = None, cancel: CancelEvent | None = None):
+        """
+        Блокирующее ожидание слота для синхронного бота:
+
+            with llm_scheduler.slot(user.id, plan_name, generation.cancel_event) as granted:
+                if granted:
+                    ...запрос к нейросети...
+
+        granted - False, если ожидание прервал cancel: запрос к нейросети не нужен, при выходе из блока
+        билет убирается из очереди.
+        Бросает QueueFullError, если очередь переполнена.
+        """
+        event = threading.Event()
+        ticket = self._enqueue(user_id, plan_name, event.set)
+        try:
+            if not ticket.granted:
+                if cancel is not None:
+                    cancel.add_callback(event.set)
+                try:
+                    event.wait()
+                finally:
+                    if cancel is not None:
+                        cancel.remove_callback(event.set)
+            yield ticket.granted
+        finally:
+            self._release(ticket)
+
+    @contextlib.asynccontextmanager
+    async def async_slot(self, user_id: int, plan_name: str | None = None, cancel: CancelEvent | None = None):
+        """То же, что slot, для asyncio: ожидание не блокирует event loop."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        ticket = self._enqueue(user_id, plan_name, wake)
+        try:
+            if not ticket.granted:
+                if cancel is not None:
+                    cancel.add_callback(wake)
+                try:
+                    await future
+                finally:
+                    if cancel is not None:
+                        cancel.remove_callback(wake)
+            yield ticket.granted
+        finally:
+            self._release(ticket)
+
+    def stats(self) -> dict:
+        """Глубина очереди и статистика времени ожидания (в секундах)."""
+        with self._lock:
+            waits = sorted(self._waits)
+            return {
+                "running": self._running,
+                "queue_depth": self._queued,
+                "max_queue_depth": self.max_queue_depth,
+                "waiting_users": len(self._waiting),
+                "granted": self.granted,
+                "rejected": self.rejected,
+                "wait_avg": self._wait_total / self.granted if self.granted else 0.0,
+                "wait_p50": waits[len(waits) // 2] if waits else 0.0,
+                "wait_p95": waits[int(len(waits) * 0.95)] if waits else 0.0,
+                "wait_max": waits[-1] if waits else 0.0,
+            }
+
+
+# Общий планировщик процесса
+llm_scheduler = LLMScheduler()
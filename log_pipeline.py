@@ -0,0 +1,199 @@
+import atexit
+import datetime
+import json
+import logging
+import queue
+import random
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+try:
+    from config import LOG_LEVEL, LOG_FORMAT, LOG_FILE, LOG_ASYNC, LOG_QUEUE_SIZE, LOG_SAMPLING, LOG_SAMPLING_PERIOD
+except ImportError:
+    LOG_LEVEL = "INFO"
+    LOG_FORMAT = "text"  # "text" - строки как раньше, "json" - одна JSON-запись на строку (для сборщиков логов)
+    LOG_FILE = None  # Файл логов (None - stderr)
+    LOG_ASYNC = True  # Форматирование и запись - в фоновом потоке, хэндлер только кладет запись в очередь
+    LOG_QUEUE_SIZE = 10000  # Записей в очереди; при переполнении рядовые записи отбрасываются, ошибки - нет
+    # Доля пользователей, чьи рядовые записи данного события сохраняются (событие не указано - 1.0).
+    # WARNING и выше сохраняются всегда
+    LOG_SAMPLING = {"user_text": 0.1, "llm_request": 0.1, "llm_response": 0.1, "ai_reply": 0.1}
+    LOG_SAMPLING_PERIOD = 600  # Раз в сколько секунд заново выбираются пользователи, чьи записи сохраняются
+
+try:
+    from config import LOG_CALLER_INFO
+except ImportError:
+    # Заполнять в записях файл, строку и функцию вызова (pathname, lineno, funcName). Встроенные форматы
+    # их не выводят; False экономит поиск места вызова по стеку на каждой записи, но отключает его для
+    # всех логгеров процесса, включая сторонние библиотеки
+    LOG_CALLER_INFO = True
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+TEXT_DATEFMT = '%Y-%m-%d %H:%M:%S'
+
+# Атрибуты, которые есть у любой LogRecord; остальные пришли через extra и попадают в JSON
+_RECORD_ATTRS = frozenset(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "asctime"}
+
+# Значение logging._srcfile по умолчанию: по нему logging узнает свои кадры стека при поиске места вызова
+_STDLIB_SRCFILE = logging._srcfile
+
+_listener: QueueListener | None = None
+_handler: logging.Handler | None = None
+_sampler: "EventSampler | None" = None
+
+
+def event(name: str, user_id: int | None = None) -> dict:
+    """extra для записи о событии: logger.info("...", extra=event("user_text", user.id))."""
+    return {"event": name, "user_id": user_id}
+
+
+class EventSampler(logging.Filter):
+    """
+    Семплирование рядовых записей по событию (extra "event") и пользователю (extra "user_id").
+
+    Пользователь попадает в выборку события с вероятностью rates[event], выбор меняется раз
+    в period секунд. Для выбранного пользователя сохраняются все записи события за период, поэтому
+    путь его сообщения (текст -> запрос к нейросети -> ответ) виден целиком, а не обрывками.
+    Записи без события и записи уровня WARNING и выше проходят всегда.
+    """
+
+    def __init__(self, rates: dict, period: float = LOG_SAMPLING_PERIOD, clock=time.time):
+        super().__init__()
+        self.rates = dict(rates)
+        self.period = max(int(period), 1)
+        self._clock = clock
+        self.passed = 0
+        self.sampled_out = 0
+
+    def _keep(self, rate: float, user_id) -> bool:
+        if user_id is None:
+            return random.random() < rate
+        # hash кортежа целых не зависит от PYTHONHASHSEED - выбор одинаков во всех процессах
+        period = int(self._clock()) // self.period
+        return (hash((user_id, period)) & 0xFFFFFFFF) < rate * 0x100000000
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING:
+            rate = self.rates.get(getattr(record, "event", None))
+            if rate is not None and rate < 1.0 and not self._keep(rate, getattr(record, "user_id", None)):
+                self.sampled_out += 1
+                return False
+        self.passed += 1
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON: время, уровень, логгер, сообщение, поля из extra и трейсбек."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    QueueHandler, который не форматирует запись в потоке хэндлера: сообщение (msg % args),
+    трейсбек и JSON собираются уже в потоке QueueListener. Поэтому в args стоит передавать
+    значения, которые не меняются после вызова logger (числа, строки, свежие словари stats()).
+
+    Очередь - queue.SimpleQueue (без блокировок на Python-уровне), размер ограничен приблизительно:
+    сверх max_size рядовые записи отбрасываются (dropped), WARNING и выше добавляются всегда -
+    ошибки не теряются, а поток хэндлера не ждет места в очереди.
+    """
+
+    def __init__(self, max_size: int = LOG_QUEUE_SIZE):
+        super().__init__(queue.SimpleQueue())
+        self.max_size = max_size
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        if record.levelno < logging.WARNING and self.queue.qsize() >= self.max_size:
+            self.dropped += 1
+            return
+        self.queue.put_nowait(record)
+
+
+def _make_output(log_format: str, log_file: str | None) -> logging.Handler:
+    output = logging.FileHandler(log_file, encoding="utf-8") if log_file else logging.StreamHandler(sys.stderr)
+    if log_format == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter(TEXT_FORMAT, TEXT_DATEFMT))
+    return output
+
+
+def setup_logging(level=LOG_LEVEL, log_format: str = LOG_FORMAT, log_file: str | None = LOG_FILE,
+                  use_queue: bool = LOG_ASYNC, queue_size: int = LOG_QUEUE_SIZE, sampling: dict | None = LOG_SAMPLING,
+                  sampling_period: float = LOG_SAMPLING_PERIOD, caller_info: bool = LOG_CALLER_INFO):
+    """
+    Настраивает корневой логгер вместо logging.basicConfig. С use_queue хэндлер лишь кладет запись
+    в очередь, форматирование и запись в файл/stderr выполняет фоновый поток QueueListener.
+    Повторный вызов заменяет прежнюю настройку (остаток очереди дописывается).
+    caller_info=False - записи без файла и строки вызова (logging._srcfile = None, прием из раздела
+    Optimization в Logging HOWTO): действует на весь процесс.
+    """
+    global _listener, _handler, _sampler
+    stop_logging()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+
+    output = _make_output(log_format, log_file)
+    if use_queue:
+        _handler = LazyQueueHandler(queue_size)
+        _listener = QueueListener(_handler.queue, output, respect_handler_level=True)
+        _listener.start()
+    else:
+        _handler = output
+    # Фильтр на стороне хэндлера: отброшенная запись не форматируется и не попадает в очередь
+    _sampler = EventSampler(sampling, sampling_period) if sampling else None
+    if _sampler is not None:
+        _handler.addFilter(_sampler)
+    root.addHandler(_handler)
+    root.setLevel(level)
+    logging._srcfile = _STDLIB_SRCFILE if caller_info else None
+
+
+def stop_logging():
+    """Дописывает очередь и останавливает фоновый поток (вызывается и при выходе из процесса)."""
+    global _listener, _handler
+    listener, _listener = _listener, None
+    if listener is None:
+        return
+    listener.stop()
+    # Записи после остановки пишутся сразу, в потоке вызова - иначе они копились бы в очереди без читателя
+    root = logging.getLogger()
+    root.removeHandler(_handler)
+    _handler = listener.handlers[0]
+    if _sampler is not None:
+        _handler.addFilter(_sampler)
+    root.addHandler(_handler)
+
+
+def logging_stats() -> dict:
+    return {
+        "queued": _handler.queue.qsize() if isinstance(_handler, LazyQueueHandler) else 0,
+        "dropped": _handler.dropped if isinstance(_handler, LazyQueueHandler) else 0,
+        "sampled_out": _sampler.sampled_out if _sampler is not None else 0,
+        "passed": _sampler.passed if _sampler is not None else 0,
+    }
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,401 @@
+import abc
+import functools
+import inspect
+import logging
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter as _CounterDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+try:
+    from config import METRICS_HOST, METRICS_PORT, METRICS_PROFILER
+except ImportError:
+    METRICS_HOST = "127.0.0.1"  # Только локальный доступ: Prometheus или агент на той же машине
+    METRICS_PORT = 9464  # Порт эндпоинта /metrics (None - выключен); в webhook-режиме обработчик №i - METRICS_PORT + i
+    METRICS_PROFILER = False  # Разрешить включать семплирующий профилировщик через /profile
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм по умолчанию, секунды: от миллисекунды (SQLite) до минуты (нейросеть)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+_RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500)
+
+_PROFILE_MAX_SECONDS = 300.0
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric(abc.ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._children: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        if len(labels) != len(self.label_names):
+            raise ValueError(f"Метрика {self.name} ожидает метки {self.label_names}, получено {tuple(labels)}")
+        return tuple(labels[name] for name in self.label_names)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            children = sorted(self._children.items(), key=lambda item: tuple(map(str, item[0])))
+            lines.extend(self._render_children(children))
+        return lines
+
+    @abc.abstractmethod
+    def _render_children(self, children: list) -> list[str]:
+        """Строки экспозиции для отсортированных пар (значения меток, дочерний объект). Вызывается под self._lock."""
+
+
+class Counter(_Metric):
+    """Монотонный счетчик."""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._children[key] = self._children.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._children.get(self._key(labels), 0)
+
+    def _render_children(self, children: list) -> list[str]:
+        return [f"{self.name}_total{_format_labels(self.label_names, key)} {_format_number(value)}"
+                for key, value in children]
+
+
+class _HistogramChild:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, buckets: int):
+        self.counts = [0] * (buckets + 1)  # Последняя - +Inf
+        self.sum = 0.0
+        self.count = 0
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: "Histogram", labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class Histogram(_Metric):
+    """
+    Гистограмма с фиксированными корзинами. observe() - поиск корзины и три сложения под блокировкой,
+    перцентили считает Prometheus (histogram_quantile).
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = _HistogramChild(len(self.buckets))
+            child.counts[index] += 1
+            child.sum += value
+            child.count += 1
+
+    def time(self, **labels) -> _Timer:
+        """Контекстный менеджер: записывает время выполнения блока."""
+        return _Timer(self, labels)
+
+    def snapshot(self, **labels) -> tuple[int, float]:
+        """(количество, сумма) наблюдений - для тестов и логов."""
+        with self._lock:
+            child = self._children.get(self._key(labels))
+            return (child.count, child.sum) if child is not None else (0, 0.0)
+
+    def _render_children(self, children: list) -> list[str]:
+        lines = []
+        for key, child in children:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                le = f'le="{_format_number(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_number(child.sum)}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {child.count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus (version 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labels: tuple = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labels))
+
+
+def histogram(name: str, documentation: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labels, buckets))
+
+
+def timed(metric: Histogram, **labels):
+    """
+    Декоратор: время выполнения функции (обычной или async) в гистограмму metric.
+    Без labels у гистограммы с одной меткой ее значение - имя функции.
+    """
+    def decorator(func):
+        func_labels = labels
+        if not func_labels and len(metric.label_names) == 1:
+            func_labels = {metric.label_names[0]: func.__name__}
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    metric.observe(time.perf_counter() - started, **func_labels)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                metric.observe(time.perf_counter() - started, **func_labels)
+        return wrapper
+
+    return decorator
+
+
+# --- Метрики бота ---
+
+HANDLER_SECONDS = histogram("bot_handler_seconds", "Время обработки сообщения хэндлером", ("handler",))
+DB_CALL_SECONDS = histogram("db_call_seconds", "Время вызова функций database.py", ("function",))
+LLM_REQUEST_SECONDS = histogram("llm_request_seconds", "Время запроса к нейросети (поток - до последнего чанка)",
+                                ("mode",))
+LLM_TIME_TO_FIRST_TOKEN_SECONDS = histogram("llm_time_to_first_token_seconds",
+                                            "Время до первого текста потокового ответа", ("mode",))
+LLM_TOKENS_PER_SECOND = histogram("llm_tokens_per_second", "Скорость генерации потокового ответа, токенов/с",
+                                  ("mode",), buckets=_RATE_BUCKETS)
+LLM_TOKENS = counter("llm_tokens", "Токенов запросов и ответов нейросети", ("kind",))
+TELEGRAM_SEND_SECONDS = histogram("telegram_send_seconds", "Время запроса к Bot API на отправку", ("method",))
+PROFILER_SAMPLES = counter("profiler_samples", "Снимков стеков, сделанных профилировщиком")
+
+
+# --- Семплирующий профилировщик ---
+
+class SamplingProfiler:
+    """
+    Раз в interval секунд снимает стеки всех потоков (sys._current_frames) и считает одинаковые.
+    Отчет - "свернутые" стеки (поток;функция;...;функция количество), формат flamegraph.pl и speedscope.
+    Пока выключен, ничего не стоит; включается и выключается на ходу.
+    """
+
+    def __init__(self):
+        self._counts: _CounterDict = _CounterDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.interval = 0.01
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, interval: float = 0.01) -> bool:
+        """Включает профилировщик. False - уже работает."""
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self.interval = interval
+            self._counts = _CounterDict()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+        logger.info(f"Профилировщик включен, интервал {interval} с.")
+        return True
+
+    def stop(self) -> str:
+        """Выключает профилировщик и возвращает отчет."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+            logger.info("Профилировщик выключен.")
+        return self.report()
+
+    def report(self) -> str:
+        with self._lock:
+            counts = self._counts.most_common()
+        return "".join(f"{stack} {count}\n" for stack, count in counts)
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            samples = []
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                samples.append(";".join(reversed(stack)))
+            with self._lock:
+                self._counts.update(samples)
+            PROFILER_SAMPLES.inc(len(samples))
+
+
+profiler = SamplingProfiler()
+
+
+# --- HTTP-эндпоинт ---
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    server: "MetricsServer"
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} - {format % args}")
+
+    def _respond(self, status: int, body: str = "", content_type: str = "text/plain; charset=utf-8"):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _profiler_allowed(self) -> bool:
+        if not self.server.profiler_enabled:
+            self._respond(403, "Профилировщик выключен (METRICS_PROFILER).\n")
+            return False
+        return True
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/metrics":
+            self._respond(200, self.server.registry.render(), "text/plain; version=0.0.4; charset=utf-8")
+        elif url.path == "/profile":
+            # Профиль за seconds секунд: curl 'http://127.0.0.1:9464/profile?seconds=30' > bot.folded
+            if not self._profiler_allowed():
+                return
+            query = parse_qs(url.query)
+            try:
+                seconds = min(float(query.get("seconds", ["10"])[0]), _PROFILE_MAX_SECONDS)
+                interval = float(query.get("interval", ["0.01"])[0])
+            except ValueError:
+                self._respond(400, "Неверные параметры seconds или interval.\n")
+                return
+            if not profiler.start(interval):
+                self._respond(409, "Профилировщик уже работает.\n")
+                return
+            time.sleep(seconds)
+            self._respond(200, profiler.stop())
+        else:
+            self._respond(404)
+
+    def do_POST(self):
+        # Включение и выключение без ограничения по времени: POST /profile/start, затем POST /profile/stop
+        url = urlsplit(self.path)
+        if url.path not in ("/profile/start", "/profile/stop"):
+            self._respond(404)
+            return
+        if not self._profiler_allowed():
+            return
+        if url.path == "/profile/stop":
+            self._respond(200, profiler.stop())
+            return
+        try:
+            interval = float(parse_qs(url.query).get("interval", ["0.01"])[0])
+        except ValueError:
+            self._respond(400, "Неверный параметр interval.\n")
+            return
+        self._respond(200 if profiler.start(interval) else 409)
+
+
+class MetricsServer(ThreadingHTTPServer):
+    """Локальный HTTP-сервер: /metrics для Prometheus и, если разрешено, /profile."""
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], registry: Registry = REGISTRY, profiler_enabled: bool = METRICS_PROFILER):
+        super().__init__(address, _MetricsHandler)
+        self.registry = registry
+        self.profiler_enabled = profiler_enabled
+
+
+def start_metrics_server(port: int | None = METRICS_PORT, host: str = METRICS_HOST) -> MetricsServer | None:
+    """Запускает эндпоинт метрик в фоновом потоке. Не удалось открыть порт - бот работает без него."""
+    if port is None:
+        return None
+    try:
+        server = MetricsServer((host, port))
+    except OSError as e:
+        logger.error(f"Не удалось запустить эндпоинт метрик на {host}:{port}: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f"Метрики доступны на http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,544 @@
+import abc
+import asyncio
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+from telebot.apihelper import ApiTelegramException
+
+from metrics import TELEGRAM_SEND_SECONDS
+
+try:
+    # Асинхронный клиент telebot бросает собственный класс исключения (требует aiohttp)
+    from telebot.asyncio_helper import ApiTelegramException as AsyncApiTelegramException
+except ImportError:
+    AsyncApiTelegramException = ApiTelegramException
+
+try:
+    from config import (OUTBOX_GLOBAL_RATE, OUTBOX_CHAT_RATE, OUTBOX_CHAT_BURST, OUTBOX_MAX_RETRIES,
+                        OUTBOX_QUEUE_SIZE, OUTBOX_WORKERS)
+except ImportError:
+    OUTBOX_GLOBAL_RATE = 30.0  # Сообщений в секунду на весь бот (лимит Telegram - около 30)
+    OUTBOX_CHAT_RATE = 1.0  # Сообщений в секунду в один чат
+    OUTBOX_CHAT_BURST = 3  # Сколько сообщений в чат можно отправить подряд без паузы
+    OUTBOX_MAX_RETRIES = 5  # Повторов при 429 и сетевых ошибках, затем сообщение отбрасывается
+    OUTBOX_QUEUE_SIZE = 10000  # Сообщений в очереди; при переполнении новые отбрасываются
+    OUTBOX_WORKERS = 4  # Одновременных запросов к Bot API
+
+# Настройка логирования для этого модуля
+logger = logging.getLogger(__name__)
+
+TELEGRAM_MESSAGE_LIMIT = 4096  # Максимальная длина текста одного сообщения Telegram
+# Telegram показывает "печатает..." около 5 секунд или до следующего сообщения бота
+CHAT_ACTION_TTL = 5.0
+# Сколько последних задержек отправки хранить для перцентилей
+_LATENCY_SAMPLES = 1000
+# Как часто удалять из памяти простаивающие чаты, секунды
+_SWEEP_INTERVAL = 60.0
+# Пауза перед повтором после сетевой ошибки (удваивается с каждой попыткой), секунды
+_NETWORK_RETRY_DELAY = 0.5
+
+# Теги, которые понимает Telegram (parse_mode="HTML"); остальное с "<" - обычный текст
+_TELEGRAM_TAGS = ("b", "strong", "i", "em", "u", "ins", "s", "strike", "del", "span", "tg-spoiler", "a",
+                  "code", "pre", "blockquote", "tg-emoji")
+_TAG_NAMES = "|".join(sorted(_TELEGRAM_TAGS, key=len, reverse=True))
+_HTML_TOKEN_RE = re.compile(rf"<(/?)({_TAG_NAMES})(?=[\s>/])[^<>]*>|&#?\w+;", re.IGNORECASE)
+# Тег или сущность, оборванные концом текста (потоковый ответ еще дописывается)
+_HTML_PARTIAL_RE = re.compile(rf"</?(?:(?:{_TAG_NAMES})(?:\s[^<>]*)?|[a-zA-Z-]{{0,10}})$|&#?\w*$", re.IGNORECASE)
+
+
+def _apply_tag(stack: tuple, match) -> tuple:
+    """Стек открытых тегов после токена match (стеки - кортежи, их можно запоминать без копирования)."""
+    if not match or not match.group(2) or match.group(0).endswith("/>"):
+        return stack
+    name = match.group(2).lower()
+    if not match.group(1):
+        return stack + ((name, match.group(0)),)
+    # Закрывающий тег снимает со стека ближайший одноименный открытый
+    for i in range(len(stack) - 1, -1, -1):
+        if stack[i][0] == name:
+            return stack[:i] + stack[i + 1:]
+    return stack
+
+
+def _closing_tags(stack: tuple) -> str:
+    return "".join(f"</{name}>" for name, _ in reversed(stack))
+
+
+def split_html_text(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> list[str]:
+    """
+    Режет текст с HTML-разметкой на части не длиннее limit, по возможности по переводу строки
+    или пробелу. Теги и сущности (&amp;) не разрезаются; теги, открытые на границе, закрываются
+    в конце части и открываются заново в начале следующей.
+    Граница каждой части зависит только от начала текста, поэтому при дописывании
+    текста в конец уже отправленные части не меняются.
+    """
+    chunks = []
+    reopen: tuple = ()
+    while True:
+        head = "".join(tag for _, tag in reopen)
+        if len(head) + len(text) <= limit:
+            chunks.append(head + text)
+            return chunks
+
+        budget = limit - len(head)
+        stack = reopen
+        newline_cut = space_cut = any_cut = None  # (позиция, стек открытых тегов в ней)
+        pos = 0
+        while pos < len(text):
+            match = _HTML_TOKEN_RE.match(text, pos) if text[pos] in "<&" else None
+            if not match and text[pos] in "<&" and _HTML_PARTIAL_RE.match(text, pos):
+                # Дописанный тег все равно не поместится в эту часть - граница не должна зависеть от его хвоста
+                break
+            end = match.end() if match else pos + 1
+            new_stack = _apply_tag(stack, match)
+            if end + len(_closing_tags(new_stack)) > budget:
+                break
+            if not match and text[pos] == "\n":
+                newline_cut = (pos, stack)
+            elif not match and text[pos] == " ":
+                space_cut = (pos, stack)
+            stack = new_stack
+            pos = end
+            any_cut = (pos, stack)
+
+        if newline_cut and newline_cut[0] >= budget // 2:
+            cut, stack = newline_cut
+        elif space_cut and space_cut[0] > 0:
+            cut, stack = space_cut
+        elif any_cut:
+            cut, stack = any_cut
+        else:
+            # Даже один тег не помещается в лимит - режем без учета разметки
+            cut, stack = max(budget, 1), ()
+        chunks.append(head + text[:cut].rstrip() + _closing_tags(stack))
+        reopen = stack
+        text = text[cut:].lstrip()
+
+
+class OutboxFullError(Exception):
+    """Очередь исходящих сообщений переполнена - сообщение отброшено."""
+
+
+def _is_parse_error(e) -> bool:
+    return e.error_code == 400 and "can't parse entities" in e.description
+
+
+def _is_not_modified(e) -> bool:
+    return e.error_code == 400 and "message is not modified" in e.description
+
+
+def _retry_after(e) -> float | None:
+    if e.error_code != 429:
+        return None
+    return float((e.result_json or {}).get("parameters", {}).get("retry_after", 1))
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity в запасе."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Через сколько секунд будет доступен токен (0 - уже доступен)."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def full(self, now: float) -> bool:
+        return self.delay(now) == 0.0 and self.tokens >= self.capacity
+
+
+class _Item:
+    __slots__ = ("chat_id", "method", "args", "kwargs", "future", "enqueued_at", "attempts")
+
+    def __init__(self, chat_id, method: str, args: tuple, kwargs: dict, enqueued_at: float):
+        self.chat_id = chat_id
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.enqueued_at = enqueued_at
+        self.attempts = 0
+
+
+class _Chat:
+    __slots__ = ("items", "action", "bucket", "busy", "not_before", "action_shown_at")
+
+    def __init__(self, bucket: TokenBucket):
+        self.items: deque[_Item] = deque()
+        self.action: _Item | None = None
+        self.bucket = bucket
+        self.busy = False  # Запрос в этот чат уже выполняется - следующий ждет (порядок сообщений)
+        self.not_before = 0.0  # До этого момента в чат не отправляем (после 429)
+        self.action_shown_at = float("-inf")
+
+
+class _OutboxCore(abc.ABC):
+    """
+    Диспетчер исходящих сообщений: обработчики ставят сообщения в очередь и сразу возвращаются.
+
+      * общее ведро токенов (global_rate в секунду) и ведро на каждый чат (chat_rate, запас chat_burst);
+      * в пределах чата сообщения уходят строго по порядку, чаты обслуживаются по кругу;
+      * 429 - повтор через retry_after из ответа Telegram, сетевые ошибки и 5xx - повтор с паузой;
+      * send_chat_action - дешевый путь: действие не ставится, если в чат уже идут сообщения
+        или то же действие еще отображается (CHAT_ACTION_TTL);
+      * длинные тексты режутся по лимиту Telegram с учетом HTML-разметки.
+
+    Ядро потокобезопасно; Outbox отправляет из потоков (TeleBot), AsyncOutbox - из задач asyncio.
+    """
+
+    def __init__(self, bot, global_rate: float = OUTBOX_GLOBAL_RATE, chat_rate: float = OUTBOX_CHAT_RATE,
+                 chat_burst: int = OUTBOX_CHAT_BURST, max_retries: int = OUTBOX_MAX_RETRIES,
+                 max_queue: int = OUTBOX_QUEUE_SIZE, clock=time.monotonic):
+        self.bot = bot
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_queue = max_queue
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._chats: OrderedDict[int | str, _Chat] = OrderedDict()
+        self._global = TokenBucket(global_rate, global_rate, clock())
+        self._queued = 0
+        self._in_flight = 0
+        self._closing = False
+        self._last_sweep = clock()
+        # Статистика
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.retried = 0
+        self.collapsed_actions = 0
+        self._latencies: deque[float] = deque(maxlen=_LATENCY_SAMPLES)
+        self._latency_total = 0.0
+
+    def set_global_rate(self, rate: float):
+        """Меняет общий лимит (webhook_server.py делит его между процессами-обработчиками)."""
+        with self._lock:
+            self.global_rate = rate
+            self._global = TokenBucket(rate, rate, self._clock())
+
+    # --- Постановка в очередь ---
+
+    def send_message(self, chat_id: int | str, text: str, **kwargs) -> Future:
+        """
+        Ставит текст в очередь, длинный текст - несколькими сообщениями.
+        Возвращает Future последней части (результат - telebot.types.Message).
+        """
+        future = None
+        for chunk in split_html_text(text):
+            future = self._enqueue(chat_id, "send_message", (chat_id, chunk), kwargs)
+        return future
+
+    def reply_to(self, message, text: str, **kwargs) -> Future:
+        """Ответ на сообщение: первая часть - reply_to, остальные - обычными сообщениями в тот же чат."""
+        chat_id = message.chat.id
+        future = None
+        for i, chunk in enumerate(split_html_text(text)):
+            if i == 0:
+                future = self._enqueue(chat_id, "reply_to", (message, chunk), kwargs)
+            else:
+                future = self._enqueue(chat_id, "send_message", (chat_id, chunk), kwargs)
+        return future
+
+    def edit_message_text(self, text: str, chat_id: int | str, message_id: int, **kwargs) -> Future:
+        """Правка сообщения (потоковый ответ): в очереди чата наравне с сообщениями и с теми же лимитами."""
+        return self._enqueue(chat_id, "edit_message_text", (text, chat_id, message_id), kwargs)
+
+    def send_chat_action(self, chat_id: int | str, action: str = "typing"):
+        """Показывает действие в чате ("печатает..."); повторные и бесполезные действия схлопываются."""
+        now = self._clock()
+        with self._lock:
+            chat = self._chat_locked(chat_id, now)
+            if (chat.items or chat.busy or chat.action is not None
+                    or now - chat.action_shown_at < CHAT_ACTION_TTL):
+                self.collapsed_actions += 1
+                return
+            chat.action = _Item(chat_id, "send_chat_action", (chat_id, action), {}, now)
+            self._wake_locked()
+
+    def _enqueue(self, chat_id, method: str, args: tuple, kwargs: dict) -> Future:
+        now = self._clock()
+        item = _Item(chat_id, method, args, kwargs, now)
+        with self._lock:
+            if self._queued >= self.max_queue or self._closing:
+                self.dropped += 1
+                item.future.set_exception(OutboxFullError())
+                logger.warning(f"Очередь исходящих сообщений переполнена, сообщение в чат {chat_id} отброшено.")
+                return item.future
+            chat = self._chat_locked(chat_id, now)
+            # Сообщение в чат делает ожидающее действие ненужным
+            if chat.action is not None:
+                chat.action = None
+                self.collapsed_actions += 1
+            chat.items.append(item)
+            self._queued += 1
+            self._wake_locked()
+        return item.future
+
+    def _chat_locked(self, chat_id, now: float) -> _Chat:
+        if now - self._last_sweep >= _SWEEP_INTERVAL:
+            self._sweep_locked(now)
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _Chat(TokenBucket(self.chat_rate, self.chat_burst, now))
+        return chat
+
+    def _sweep_locked(self, now: float):
+        """Удаляет простаивающие чаты, чтобы их число не росло с числом пользователей."""
+        self._last_sweep = now
+        idle = [chat_id for chat_id, chat in self._chats.items()
+                if not chat.items and chat.action is None and not chat.busy and now >= chat.not_before
+                and now - chat.action_shown_at >= CHAT_ACTION_TTL and chat.bucket.full(now)]
+        for chat_id in idle:
+            del self._chats[chat_id]
+
+    # --- Выбор следующего запроса (все методы с "_locked" вызываются под self._lock) ---
+
+    def _next_locked(self, now: float) -> tuple[_Item | None, float]:
+        """Следующий запрос, который можно отправить сейчас, или (None, сколько ждать)."""
+        wait = self._global.delay(now)
+        if wait > 0:
+            return None, wait
+        wait = float("inf")
+        # Сначала сообщения, потом действия: действие не должно занимать токен, нужный сообщению
+        for chat_id, chat in self._chats.items():
+            if chat.busy or not chat.items:
+                continue
+            delay = max(chat.not_before - now, chat.bucket.delay(now))
+            if delay > 0:
+                wait = min(wait, delay)
+                continue
+            item = chat.items.popleft()
+            self._queued -= 1
+            chat.bucket.take()
+            return self._start_locked(chat_id, chat, item), 0.0
+        for chat_id, chat in self._chats.items():
+            if chat.busy or chat.action is None:
+                continue
+            delay = chat.not_before - now
+            if delay > 0:
+                wait = min(wait, delay)
+                continue
+            item, chat.action = chat.action, None
+            return self._start_locked(chat_id, chat, item), 0.0
+        return None, wait
+
+    def _start_locked(self, chat_id, chat: _Chat, item: _Item) -> _Item:
+        self._global.take()
+        chat.busy = True
+        self._in_flight += 1
+        # Чат в конец круга - остальные чаты не ждут, пока этот отправит все свои сообщения
+        self._chats.move_to_end(chat_id)
+        return item
+
+    def _idle_locked(self) -> bool:
+        return not self._queued and not self._in_flight and not any(c.action for c in self._chats.values())
+
+    def _complete(self, item: _Item, result=None, error: BaseException | None = None):
+        now = self._clock()
+        resolve = None
+        with self._lock:
+            self._in_flight -= 1
+            chat = self._chats[item.chat_id]
+            chat.busy = False
+            if error is None:
+                if item.method == "send_chat_action":
+                    chat.action_shown_at = now
+                else:
+                    # Сообщение бота убирает индикатор действия
+                    chat.action_shown_at = float("-inf")
+                    latency = now - item.enqueued_at
+                    self._latencies.append(latency)
+                    self._latency_total += latency
+                self.sent += 1
+                resolve = (item.future.set_result, result)
+            else:
+                delay = self._retry_delay(item, error)
+                if delay is not None and item.attempts < self.max_retries:
+                    item.attempts += 1
+                    self.retried += 1
+                    chat.not_before = max(chat.not_before, now + delay)
+                    if item.method == "send_chat_action":
+                        chat.action = chat.action or item
+                    else:
+                        chat.items.appendleft(item)
+                        self._queued += 1
+                else:
+                    self.failed += 1
+                    logger.warning(f"Не удалось отправить {item.method} в чат {item.chat_id}: "
+                                   f"{type(error).__name__} - {error}")
+                    resolve = (item.future.set_exception, error)
+            self._wake_locked()
+        if resolve:
+            resolve[0](resolve[1])
+
+    def _retry_delay(self, item: _Item, error: BaseException) -> float | None:
+        """Через сколько секунд повторить запрос или None, если повторять бессмысленно."""
+        if isinstance(error, (ApiTelegramException, AsyncApiTelegramException)):
+            retry_after = _retry_after(error)
+            if retry_after is not None:
+                logger.info(f"Telegram ограничил отправку в чат {item.chat_id}, повтор через {retry_after} с.")
+                return retry_after
+            if error.error_code >= 500:
+                return _NETWORK_RETRY_DELAY * 2 ** item.attempts
+            return None
+        # Сетевая ошибка (таймаут, обрыв соединения)
+        return _NETWORK_RETRY_DELAY * 2 ** item.attempts
+
+    @abc.abstractmethod
+    def _wake_locked(self):
+        """Будит отправителя: в очереди появилось сообщение. Вызывается под self._lock."""
+
+    def stats(self) -> dict:
+        """Глубина очереди, счетчики и задержка отправки (от постановки в очередь до ответа Telegram), секунды."""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            messages = len(latencies)
+            return {
+                "queue_depth": self._queued,
+                "in_flight": self._in_flight,
+                "chats": len(self._chats),
+                "sent": self.sent,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "retried": self.retried,
+                "collapsed_actions": self.collapsed_actions,
+                "latency_avg": sum(latencies) / messages if messages else 0.0,
+                "latency_p50": latencies[messages // 2] if messages else 0.0,
+                "latency_p95": latencies[int(messages * 0.95)] if messages else 0.0,
+                "latency_max": latencies[-1] if messages else 0.0,
+            }
+
+
+class Outbox(_OutboxCore):
+    """Диспетчер исходящих сообщений для синхронного TeleBot: отправка из workers фоновых потоков."""
+
+    def __init__(self, bot, workers: int = OUTBOX_WORKERS, **kwargs):
+        super().__init__(bot, **kwargs)
+        self._cond = threading.Condition(self._lock)
+        self._threads = [threading.Thread(target=self._worker_loop, name=f"outbox-{i}", daemon=True)
+                         for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def _wake_locked(self):
+        self._cond.notify_all()
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    item, wait = self._next_locked(self._clock())
+                    if item is not None:
+                        break
+                    if self._closing and self._idle_locked():
+                        return
+                    self._cond.wait(None if wait == float("inf") else wait)
+            try:
+                result = self._call(item)
+            except Exception as e:
+                self._complete(item, error=e)
+            else:
+                self._complete(item, result)
+
+    def _call(self, item: _Item):
+        method = getattr(self.bot, item.method)
+        with TELEGRAM_SEND_SECONDS.time(method=item.method):
+            try:
+                return method(*item.args, **item.kwargs)
+            except ApiTelegramException as e:
+                # Разметка ответа нейросети может оказаться некорректной - отправляем текст без нее
+                if _is_parse_error(e) and item.method != "send_chat_action":
+                    return method(*item.args, **{**item.kwargs, "parse_mode": ""})
+                # Правка с тем же текстом - сообщение уже в нужном виде
+                if _is_not_modified(e):
+                    return None
+                raise
+
+    def close(self, timeout: float = 10.0):
+        """Дожидается отправки уже поставленных сообщений (не дольше timeout) и останавливает потоки."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        logger.info(f"Статистика исходящих сообщений: {self.stats()}")
+
+
+class AsyncOutbox(_OutboxCore):
+    """То же, что Outbox, для AsyncTeleBot: отправка из задач asyncio (создаются при первом сообщении)."""
+
+    def __init__(self, bot, workers: int = OUTBOX_WORKERS, **kwargs):
+        super().__init__(bot, **kwargs)
+        self.workers = workers
+        self._tasks: list[asyncio.Task] = []
+        self._wakeup: asyncio.Event | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def _wake_locked(self):
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+            self._wakeup = asyncio.Event()
+            self._tasks = [self._loop.create_task(self._worker_loop()) for _ in range(self.workers)]
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _worker_loop(self):
+        while True:
+            # Сбрасываем событие до проверки очереди, чтобы не пропустить постановку между ними
+            self._wakeup.clear()
+            with self._lock:
+                item, wait = self._next_locked(self._clock())
+                finished = item is None and self._closing and self._idle_locked()
+            if finished:
+                return
+            if item is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), None if wait == float("inf") else wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                result = await self._call(item)
+            except Exception as e:
+                self._complete(item, error=e)
+            else:
+                self._complete(item, result)
+
+    async def _call(self, item: _Item):
+        method = getattr(self.bot, item.method)
+        with TELEGRAM_SEND_SECONDS.time(method=item.method):
+            try:
+                return await method(*item.args, **item.kwargs)
+            except AsyncApiTelegramException as e:
+                if _is_parse_error(e) and item.method != "send_chat_action":
+                    return await method(*item.args, **{**item.kwargs, "parse_mode": ""})
+                if _is_not_modified(e):
+                    return None
+                raise
+
+    async def aclose(self, timeout: float = 10.0):
+        """Дожидается отправки уже поставленных сообщений (не дольше timeout) и останавливает задачи."""
+        with self._lock:
+            self._closing = True
+        if self._tasks:
+            self._wakeup.set()
+            done, pending = await asyncio.wait(self._tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+        logger.info(f"Статистика исходящих сообщений: {self.stats()}")
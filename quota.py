@@ -0,0 +1,294 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import NamedTuple
+
+from database import load_quota_usage, add_quota_usage
+
+try:
+    from config import PLAN_QUOTAS, DEFAULT_PLAN_QUOTA, QUOTA_WINDOW, QUOTA_FLUSH_INTERVAL
+except ImportError:
+    # Лимиты по названию тарифа (subscriptions.plan_name): запросов и токенов (запрос + ответ) за окно.
+    # None - без ограничения
+    PLAN_QUOTAS = {
+        "Пробный доступ": {"requests": 30, "tokens": 30000},
+        "Тестовый доступ": {"requests": 30, "tokens": 30000},
+    }
+    DEFAULT_PLAN_QUOTA = {"requests": 500, "tokens": 1000000}  # Для тарифов, которых нет в PLAN_QUOTAS
+    QUOTA_WINDOW = 24 * 60 * 60  # Скользящее окно квоты, секунд
+    QUOTA_FLUSH_INTERVAL = 30.0  # Как часто счетчики сбрасываются в БД, секунд
+
+logger = logging.getLogger(__name__)
+
+# Окно делится на интервалы: расход учитывается по интервалам, самый старый выпадает из окна целиком
+_BUCKETS_PER_WINDOW = 24
+
+
+class QuotaStatus(NamedTuple):
+    plan: str | None
+    requests_used: int
+    requests_limit: int | None
+    tokens_used: int
+    tokens_limit: int | None
+    resets_in: float  # Через сколько секунд из окна выпадет самый старый интервал с расходом
+
+    @property
+    def requests_left(self) -> int | None:
+        return None if self.requests_limit is None else max(self.requests_limit - self.requests_used, 0)
+
+    @property
+    def tokens_left(self) -> int | None:
+        return None if self.tokens_limit is None else max(self.tokens_limit - self.tokens_used, 0)
+
+    @property
+    def exhausted(self) -> bool:
+        return self.requests_left == 0 or self.tokens_left == 0
+
+
+class QuotaExceededError(Exception):
+    """Квота тарифа на окно исчерпана."""
+
+    def __init__(self, status: QuotaStatus):
+        super().__init__(f"Квота тарифа '{status.plan}' исчерпана")
+        self.status = status
+
+
+class _Usage:
+    __slots__ = ("buckets", "last_used")
+
+    def __init__(self, rows, now: float):
+        # начало интервала -> [запросов, токенов запроса, токенов ответа]
+        self.buckets: dict[int, list[int]] = {bucket: [requests, prompt, completion]
+                                              for bucket, requests, prompt, completion in rows}
+        self.last_used = now
+
+
+class QuotaEngine:
+    """
+    Квоты нейросети по тарифам: запросы и токены пользователя за скользящее окно.
+
+      * check() перед запросом - только память (при первом обращении к пользователю расход
+        загружается из БД), QuotaExceededError, если лимит тарифа исчерпан. Если загрузить расход
+        не удалось, проверка пропускает запрос (в БД расход считается нулевым);
+      * record() после ответа - прибавляет расход (usage из ответа нейросети) к счетчикам в памяти;
+      * фоновый поток раз в flush_interval секунд пишет накопленные приращения в quota_usage
+        одной транзакцией - запись в БД на пути сообщения не нужна.
+
+    В БД пишутся приращения, а не итоги, поэтому несколько процессов (webhook_server.py) могут
+    учитывать расход в одной таблице. Пользователи без расхода в окне выгружаются из памяти.
+    """
+
+    def __init__(self, plan_limits: dict = PLAN_QUOTAS, default_limits: dict = DEFAULT_PLAN_QUOTA,
+                 window: int = QUOTA_WINDOW, flush_interval: float = QUOTA_FLUSH_INTERVAL,
+                 load=load_quota_usage, flush_rows=add_quota_usage, clock=time.time):
+        self.plan_limits = plan_limits
+        self.default_limits = default_limits
+        self.window = int(window)
+        self.bucket_size = max(self.window // _BUCKETS_PER_WINDOW, 1)
+        self.flush_interval = flush_interval
+        self._load = load
+        self._flush_rows = flush_rows
+        self._clock = clock
+        self._users: dict[int, _Usage] = {}
+        # Еще не записанные в БД приращения: (пользователь, интервал) -> [запросов, токенов запроса, ответа]
+        self._dirty: defaultdict[tuple[int, int], list[int]] = defaultdict(lambda: [0, 0, 0])
+        self._lock = threading.Lock()
+        # Загрузка из БД и сброс приращений не пересекаются: иначе только что записанное
+        # приращение учлось бы дважды - в загруженных строках и в _dirty
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._closing = False
+        # Статистика
+        self.checks = 0
+        self.rejected = 0
+        self.loads = 0
+        self.failed_loads = 0
+        self.flushed_rows = 0
+        self.failed_flushes = 0
+
+    def limits_for(self, plan: str | None) -> tuple[int | None, int | None]:
+        limits = self.plan_limits.get(plan, self.default_limits)
+        return limits.get("requests"), limits.get("tokens")
+
+    def _bucket(self, now: float) -> int:
+        return int(now) // self.bucket_size * self.bucket_size
+
+    def _window_start(self, now: float) -> int:
+        # Интервал, начавшийся раньше, целиком вне окна
+        return self._bucket(now) - self.window + self.bucket_size
+
+    def status(self, user_id: int, plan: str | None) -> QuotaStatus:
+        """Расход пользователя за окно и лимиты его тарифа."""
+        now = self._clock()
+        since = self._window_start(now)
+        usage = self._get(user_id, now, since)
+        requests = tokens = 0
+        oldest = None
+        with self._lock:
+            for bucket, (bucket_requests, prompt, completion) in usage.buckets.items():
+                if bucket < since:
+                    continue
+                requests += bucket_requests
+                tokens += prompt + completion
+                if oldest is None or bucket < oldest:
+                    oldest = bucket
+        resets_in = max(oldest + self.window - now, 0.0) if oldest is not None else 0.0
+        requests_limit, tokens_limit = self.limits_for(plan)
+        return QuotaStatus(plan, requests, requests_limit, tokens, tokens_limit, resets_in)
+
+    def check(self, user_id: int, plan: str | None) -> QuotaStatus:
+        """Проверка перед запросом к нейросети. QuotaExceededError - лимит исчерпан."""
+        status = self.status(user_id, plan)
+        with self._lock:
+            self.checks += 1
+            if status.exhausted:
+                self.rejected += 1
+        if status.exhausted:
+            raise QuotaExceededError(status)
+        return status
+
+    def record(self, user_id: int, prompt_tokens: int, completion_tokens: int, requests: int = 1):
+        """Учитывает запрос к нейросети. Только память: в БД попадет при следующем сбросе."""
+        now = self._clock()
+        bucket = self._bucket(now)
+        with self._lock:
+            delta = self._dirty[(user_id, bucket)]
+            delta[0] += requests
+            delta[1] += prompt_tokens
+            delta[2] += completion_tokens
+            usage = self._users.get(user_id)
+            if usage is not None:
+                # Не загруженный пользователь получит приращение из _dirty при загрузке
+                counters = usage.buckets.setdefault(bucket, [0, 0, 0])
+                counters[0] += requests
+                counters[1] += prompt_tokens
+                counters[2] += completion_tokens
+                usage.last_used = now
+            if self._thread is None and not self._closing:
+                self._thread = threading.Thread(target=self._flush_loop, name="quota-flush", daemon=True)
+                self._thread.start()
+        if self._closing:
+            self.flush()
+
+    def _get(self, user_id: int, now: float, since: int) -> _Usage:
+        with self._lock:
+            usage = self._users.get(user_id)
+            if usage is not None:
+                usage.last_used = now
+                return usage
+
+        with self._flush_lock:
+            try:
+                rows = self._load(user_id, since)
+            except Exception as e:
+                # БД недоступна - квоту не проверить, но пользователю не отказываем: считаем расход в БД нулевым.
+                # Такой расход не кэшируется, при следующем обращении загрузка повторится
+                logger.error(f"Не удалось загрузить расход квоты пользователя {user_id}: {e}", exc_info=True)
+                rows = None
+            with self._lock:
+                usage = self._users.get(user_id)
+                if usage is not None:
+                    return usage
+                if rows is None:
+                    self.failed_loads += 1
+                else:
+                    self.loads += 1
+                usage = _Usage(rows or (), now)
+                for (dirty_user, bucket), delta in self._dirty.items():
+                    if dirty_user == user_id:
+                        counters = usage.buckets.setdefault(bucket, [0, 0, 0])
+                        for i in range(3):
+                            counters[i] += delta[i]
+                if rows is not None:
+                    self._users[user_id] = usage
+                return usage
+
+    def _flush_loop(self):
+        while not self._closing:
+            self._wakeup.wait(self.flush_interval)
+            if self._closing:
+                return
+            self.flush()
+
+    def flush(self):
+        """Записывает накопленные приращения в БД и выгружает пользователей без расхода в окне."""
+        with self._flush_lock:
+            now = self._clock()
+            since = self._window_start(now)
+            with self._lock:
+                dirty, self._dirty = self._dirty, defaultdict(lambda: [0, 0, 0])
+                for user_id in [user_id for user_id, usage in self._users.items() if now - usage.last_used >= self.window]:
+                    del self._users[user_id]
+                for usage in self._users.values():
+                    for bucket in [bucket for bucket in usage.buckets if bucket < since]:
+                        del usage.buckets[bucket]
+            if not dirty:
+                return
+            rows = [(user_id, bucket, *delta) for (user_id, bucket), delta in dirty.items()]
+            try:
+                self._flush_rows(rows, purge_before=since)
+            except Exception as e:
+                logger.error(f"Не удалось записать расход квот ({len(rows)} строк): {e}", exc_info=True)
+                with self._lock:
+                    self.failed_flushes += 1
+                    # Вернем приращения: запишутся при следующем сбросе
+                    for key, delta in dirty.items():
+                        counters = self._dirty[key]
+                        for i in range(3):
+                            counters[i] += delta[i]
+                return
+            with self._lock:
+                self.flushed_rows += len(rows)
+
+    def close(self):
+        """Останавливает фоновый поток и записывает остаток. Последующие record() пишут сразу."""
+        with self._lock:
+            self._closing = True
+            thread = self._thread
+        self._wakeup.set()
+        if thread is not None:
+            thread.join()
+        self.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "users": len(self._users),
+                "pending_rows": len(self._dirty),
+                "checks": self.checks,
+                "rejected": self.rejected,
+                "loads": self.loads,
+                "failed_loads": self.failed_loads,
+                "flushed_rows": self.flushed_rows,
+                "failed_flushes": self.failed_flushes,
+            }
+
+
+def _format_duration(seconds: float) -> str:
+    minutes = max(int(seconds + 59) // 60, 1)
+    hours, minutes = divmod(minutes, 60)
+    if hours and minutes:
+        return f"{hours} ч {minutes} мин"
+    return f"{hours} ч" if hours else f"{minutes} мин"
+
+
+def _format_left(left: int | None, limit: int | None) -> str:
+    return "без ограничений" if limit is None else f"{left} из {limit}"
+
+
+def describe_quota(status: QuotaStatus, window: int = QUOTA_WINDOW) -> str:
+    """Остаток квоты для /status и сообщения об исчерпанном лимите."""
+    hours = window // 3600
+    lines = [
+        f"Квота за последние {hours} ч:" if hours else "Квота:",
+        f"Запросов к нейросети: {_format_left(status.requests_left, status.requests_limit)}",
+        f"Токенов: {_format_left(status.tokens_left, status.tokens_limit)}",
+    ]
+    if status.exhausted:
+        lines.append(f"Лимит начнет восстанавливаться через {_format_duration(status.resets_in)}.")
+    return "\n".join(lines)
+
+
+quota_engine = QuotaEngine()
@@ -0,0 +1,192 @@
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from db_pool import SQLitePool
+
+# Настройка логирования для этого модуля
+logger = logging.getLogger(__name__)
+
+# Знаки по краям промпта, которые не влияют на смысл: "Привет!" и "привет" - один и тот же запрос
+_EDGE_PUNCTUATION = " \t\n.,!?;:…-—\"'«»()"
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# Раз в сколько записей в дисковый уровень удалять из него истекшие записи
+_DISK_PURGE_EVERY = 500
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Приводит промпт к канонической форме: регистр, ё/е, пробелы, пунктуация по краям."""
+    text = unicodedata.normalize("NFKC", prompt).casefold().replace("ё", "е")
+    text = _WHITESPACE_RE.sub(" ", text)
+    return text.strip(_EDGE_PUNCTUATION)
+
+
+class ResponseCache:
+    """
+    Кэш ответов нейросети, ключ - (модель, нормализованный промпт, temperature, max_tokens, контекст).
+
+    Два уровня:
+      * память - LRU, ограниченная числом записей и суммарным размером ответов в байтах;
+      * диск (опционально) - таблица SQLite, переживает перезапуск бота.
+    У каждой записи свой срок жизни. При temperature выше max_temperature кэш не используется:
+    от такого запроса ждут разнообразных ответов. Не используется он и при истории диалога длиннее
+    max_context_tokens: контекст входит в ключ, а длинная история у каждого пользователя своя -
+    такой ответ из кэша никто не получит, он только вытеснит полезные записи.
+    """
+
+    def __init__(self, max_entries: int = 1000, max_bytes: int = 8 * 1024 * 1024, default_ttl: float = 3600.0,
+                 max_temperature: float = 0.8, max_context_tokens: int = 200, db_path: str | None = None,
+                 clock=time.time):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.max_temperature = max_temperature
+        self.max_context_tokens = max_context_tokens
+        self._clock = clock
+        # key -> (response, expires_at, size_bytes)
+        self._entries: OrderedDict[str, tuple[str, float, int]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._pool = SQLitePool(db_path, max_connections=2) if db_path else None
+        self._disk_ready = False
+        self._disk_writes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.evictions = 0
+        self.bytes_served = 0
+
+    @property
+    def persistent(self) -> bool:
+        return self._pool is not None
+
+    def enabled_for(self, temperature: float, context_tokens: int = 0) -> bool:
+        if (self.max_entries <= 0 or temperature > self.max_temperature
+                or context_tokens > self.max_context_tokens):
+            with self._lock:
+                self.bypasses += 1
+            return False
+        return True
+
+    @staticmethod
+    def make_key(model: str, prompt: str, temperature: float, max_tokens: int, context: str = "") -> str:
+        """context - отпечаток всего, что модель видит помимо промпта (системный промпт, история диалога)."""
+        raw = "\x1f".join((model or "", normalize_prompt(prompt), f"{temperature:.3f}", str(max_tokens), context))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    self.bytes_served += entry[2]
+                    return entry[0]
+                self._remove(key)
+
+        response = self._disk_get(key, now) if self._pool else None
+        with self._lock:
+            if response is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self.bytes_served += len(response[0].encode("utf-8"))
+        # Поднимаем запись в память
+        self._memory_put(key, response[0], response[1])
+        return response[0]
+
+    def put(self, key: str, response: str, ttl: float | None = None):
+        expires_at = self._clock() + (self.default_ttl if ttl is None else ttl)
+        self._memory_put(key, response, expires_at)
+        if self._pool:
+            self._disk_put(key, response, expires_at)
+
+    def _memory_put(self, key: str, response: str, expires_at: float):
+        size = len(response.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (response, expires_at, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key: str):
+        # Вызывается под self._lock
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    # --- Дисковый уровень ---
+
+    def _ensure_disk_table(self, conn: sqlite3.Connection):
+        if self._disk_ready:
+            return
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS response_cache (
+                cache_key TEXT PRIMARY KEY,     -- sha256 от модели, промпта и параметров
+                response TEXT NOT NULL,         -- Текст ответа
+                expires_at REAL NOT NULL        -- Срок жизни, epoch-секунды
+            ) WITHOUT ROWID
+        ''')
+        conn.commit()
+        self._disk_ready = True
+
+    def _disk_get(self, key: str, now: float) -> tuple[str, float] | None:
+        try:
+            with self._pool.connection() as conn:
+                self._ensure_disk_table(conn)
+                row = conn.execute(
+                    "SELECT response, expires_at FROM response_cache WHERE cache_key = ? AND expires_at > ?",
+                    (key, now)).fetchone()
+                return row
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка SQLite при чтении кэша ответов: {e}", exc_info=True)
+            return None
+
+    def _disk_put(self, key: str, response: str, expires_at: float):
+        try:
+            with self._pool.connection() as conn:
+                self._ensure_disk_table(conn)
+                conn.execute('''
+                    INSERT INTO response_cache (cache_key, response, expires_at)
+                    VALUES (?, ?, ?) ON CONFLICT(cache_key) DO
+                    UPDATE SET response = excluded.response, expires_at = excluded.expires_at
+                ''', (key, response, expires_at))
+                self._disk_writes += 1
+                if self._disk_writes % _DISK_PURGE_EVERY == 0:
+                    conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (self._clock(),))
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка SQLite при записи в кэш ответов: {e}", exc_info=True)
+
+    def close(self):
+        if self._pool:
+            self._pool.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "bypasses": self.bypasses,
+                "evictions": self.evictions,
+                "bytes_served": self.bytes_served,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
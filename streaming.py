@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import Future
+
+from ai_interface import finalize_streamed_text
+from outbox import split_html_text
+
+try:
+    from config import STREAM_EDIT_INTERVAL, STREAM_EDIT_MIN_CHARS
+except ImportError:
+    STREAM_EDIT_INTERVAL = 1.0  # Не чаще одного редактирования сообщения в секунду
+    STREAM_EDIT_MIN_CHARS = 20  # Не редактировать ради пары новых символов
+
+# Настройка логирования для этого модуля
+logger = logging.getLogger(__name__)
+
+PLACEHOLDER_TEXT = "⏳ Думаю..."
+
+
+class _StreamState:
+    """
+    Общая логика потокового ответа без ввода-вывода: накапливает текст
+    и решает, когда пора обновлять сообщения (не чаще min_interval секунд
+    и не меньше чем на min_chars новых символов).
+    """
+
+    def __init__(self, min_interval: float, min_chars: int, clock=time.monotonic):
+        self.min_interval = min_interval
+        self.min_chars = min_chars
+        self._clock = clock
+        self.parts: list[str] = []
+        self.length = 0
+        self.flushed_length = 0
+        self.last_flush = clock()
+
+    def append(self, delta: str) -> bool:
+        """Добавляет кусок текста, возвращает True, если пора обновить сообщения."""
+        self.parts.append(delta)
+        self.length += len(delta)
+        return (self.length - self.flushed_length >= self.min_chars
+                and self._clock() - self.last_flush >= self.min_interval)
+
+    def render(self, final: bool) -> list[str]:
+        text = ''.join(self.parts)
+        self.flushed_length = self.length
+        self.last_flush = self._clock()
+        return split_html_text(finalize_streamed_text(text) if final else text.strip())
+
+    @property
+    def final_text(self) -> str:
+        return finalize_streamed_text(''.join(self.parts))
+
+
+def _busy(sent: Future, edit: Future | None) -> bool:
+    """Отправка сообщения или прошлая правка еще ждут в очереди outbox."""
+    return not sent.done() or (edit is not None and not edit.done())
+
+
+class StreamingReply:
+    """
+    Потоковый ответ для синхронного TeleBot: сначала отправляется сообщение-заглушка,
+    затем оно редактируется по мере поступления текста. Текст длиннее лимита Telegram
+    продолжается в новых сообщениях.
+
+    Заглушка, правки и новые сообщения идут через Outbox - с его лимитами (общим и на чат)
+    и повторами после 429. Пока прошлая правка сообщения ждет в очереди, промежуточный текст
+    не ставится: следующая правка все равно покажет более полный. Окончательный текст ставится всегда.
+
+        reply = StreamingReply(outbox, message)
+        reply.start()
+        for delta in stream_custom_ai_response(prompt):
+            reply.feed(delta)
+        reply.finish()
+    """
+
+    def __init__(self, outbox, message, min_interval: float = STREAM_EDIT_INTERVAL,
+                 min_chars: int = STREAM_EDIT_MIN_CHARS):
+        self.outbox = outbox
+        self.message = message
+        self.chat_id = message.chat.id
+        self.state = _StreamState(min_interval, min_chars)
+        self.messages: list[Future] = []  # Отправка каждого сообщения ответа (результат - Message)
+        self.shown: list[str] = []
+        self._edits: dict[int, Future] = {}  # Последняя поставленная правка сообщения
+
+    def start(self):
+        self.messages.append(self.outbox.reply_to(self.message, PLACEHOLDER_TEXT))
+        self.shown.append(PLACEHOLDER_TEXT)
+
+    def feed(self, delta: str):
+        if self.state.append(delta):
+            self._flush(final=False)
+
+    def finish(self) -> str:
+        """Ставит в очередь окончательный текст и возвращает его."""
+        self._flush(final=True)
+        return self.state.final_text
+
+    def _flush(self, final: bool):
+        for i, chunk in enumerate(self.state.render(final)):
+            if not chunk or (i < len(self.shown) and chunk == self.shown[i]):
+                continue
+            if i >= len(self.messages):
+                self.messages.append(self.outbox.send_message(self.chat_id, chunk))
+                self.shown.append(chunk)
+            elif final or not _busy(self.messages[i], self._edits.get(i)):
+                self._edit(i, chunk)
+
+    def _edit(self, i: int, chunk: str):
+        try:
+            # Окончательная правка ждет отправки сообщения: без него нечего править
+            message_id = self.messages[i].result().message_id
+        except Exception as e:
+            logger.warning(f"Сообщение потокового ответа в чат {self.chat_id} не отправлено ({e}), "
+                           f"текст уйдет новым сообщением.")
+            self.messages[i] = self.outbox.send_message(self.chat_id, chunk)
+        else:
+            self._edits[i] = self.outbox.edit_message_text(chunk, self.chat_id, message_id)
+        self.shown[i] = chunk
+
+
+class AsyncStreamingReply:
+    """То же, что StreamingReply, для AsyncTeleBot и AsyncOutbox (режим asyncio)."""
+
+    def __init__(self, outbox, message, min_interval: float = STREAM_EDIT_INTERVAL,
+                 min_chars: int = STREAM_EDIT_MIN_CHARS):
+        self.outbox = outbox
+        self.message = message
+        self.chat_id = message.chat.id
+        self.state = _StreamState(min_interval, min_chars)
+        self.messages: list[Future] = []
+        self.shown: list[str] = []
+        self._edits: dict[int, Future] = {}
+
+    async def start(self):
+        self.messages.append(self.outbox.reply_to(self.message, PLACEHOLDER_TEXT))
+        self.shown.append(PLACEHOLDER_TEXT)
+
+    async def feed(self, delta: str):
+        if self.state.append(delta):
+            await self._flush(final=False)
+
+    async def finish(self) -> str:
+        await self._flush(final=True)
+        return self.state.final_text
+
+    async def _flush(self, final: bool):
+        for i, chunk in enumerate(self.state.render(final)):
+            if not chunk or (i < len(self.shown) and chunk == self.shown[i]):
+                continue
+            if i >= len(self.messages):
+                self.messages.append(self.outbox.send_message(self.chat_id, chunk))
+                self.shown.append(chunk)
+            elif final or not _busy(self.messages[i], self._edits.get(i)):
+                await self._edit(i, chunk)
+
+    async def _edit(self, i: int, chunk: str):
+        try:
+            message_id = (await asyncio.wrap_future(self.messages[i])).message_id
+        except Exception as e:
+            logger.warning(f"Сообщение потокового ответа в чат {self.chat_id} не отправлено ({e}), "
+                           f"текст уйдет новым сообщением.")
+            self.messages[i] = self.outbox.send_message(self.chat_id, chunk)
+        else:
+            self._edits[i] = self.outbox.edit_message_text(chunk, self.chat_id, message_id)
+        self.shown[i] = chunk
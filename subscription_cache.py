@@ -0,0 +1,81 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class SubscriptionCache:
+    """
+    Кэш статуса подписки в памяти процесса, ключ - telegram_id.
+
+    Для пользователя с подпиской хранится момент окончания (active_until, epoch-секунды)
+    и название тарифа, поэтому запись "протухает" ровно тогда, когда заканчивается подписка.
+    Отрицательный ответ (подписки нет) хранится коротко - negative_ttl секунд.
+    Размер ограничен max_size, при переполнении вытесняется давно не использованная запись (LRU).
+    """
+
+    def __init__(self, max_size: int = 10000, negative_ttl: float = 30.0, clock=time.time):
+        self.max_size = max_size
+        self.negative_ttl = negative_ttl
+        self._clock = clock
+        # telegram_id -> (is_active, expires_at, plan_name)
+        self._entries: OrderedDict[int, tuple[bool, float, str | None]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, telegram_id: int) -> tuple[bool, str | None] | None:
+        """
+        Возвращает (есть ли подписка, название тарифа) из кэша или None, если записи нет или она истекла
+        (тогда нужно сходить в БД и вызвать set_active_until / set_inactive).
+        """
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(telegram_id)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self._entries[telegram_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(telegram_id)
+            self.hits += 1
+            return entry[0], entry[2]
+
+    def set_active_until(self, telegram_id: int, active_until: float, plan_name: str | None = None):
+        """Запоминает, что подписка (тариф plan_name) активна до active_until (epoch-секунды)."""
+        if active_until <= self._clock():
+            self.set_inactive(telegram_id)
+            return
+        self._put(telegram_id, (True, active_until, plan_name))
+
+    def set_inactive(self, telegram_id: int):
+        """Запоминает отрицательный ответ на negative_ttl секунд."""
+        self._put(telegram_id, (False, self._clock() + self.negative_ttl, None))
+
+    def invalidate(self, telegram_id: int):
+        with self._lock:
+            self._entries.pop(telegram_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _put(self, telegram_id: int, entry: tuple[bool, float, str | None]):
+        with self._lock:
+            self._entries[telegram_id] = entry
+            self._entries.move_to_end(telegram_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        """Счетчики попаданий/промахов для мониторинга."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
@@ -0,0 +1,166 @@
+import datetime
+import logging
+import threading
+import time
+
+from database import (deactivate_expired_subscriptions, archive_subscriptions, iter_expiring_subscriptions,
+                      load_checkpoint, save_checkpoint, SECONDS_PER_DAY, EXTENDED_PLAN_SUFFIX)
+from outbox import TokenBucket
+
+try:
+    from config import (SUBSCRIPTION_SWEEPER, SWEEP_INTERVAL, SWEEP_BATCH_SIZE, SUBSCRIPTION_ARCHIVE_AFTER_DAYS,
+                        EXPIRY_NOTICE_BEFORE, EXPIRY_NOTIFY_RATE)
+except ImportError:
+    SUBSCRIPTION_SWEEPER = True  # Фоновое обслуживание подписок: снятие истекших, архив, предупреждения
+    SWEEP_INTERVAL = 300.0  # Как часто запускается обход, секунд
+    SWEEP_BATCH_SIZE = 500  # Строк в одной транзакции - блокировка на запись держится недолго
+    SUBSCRIPTION_ARCHIVE_AFTER_DAYS = 90  # Через сколько дней после окончания подписка переносится в архив (None - никогда)
+    EXPIRY_NOTICE_BEFORE = 6 * 60 * 60  # За сколько секунд до окончания предупреждать пользователя (0 - не предупреждать)
+    EXPIRY_NOTIFY_RATE = 5.0  # Предупреждений в секунду: остальной лимит Telegram остается ответам пользователям
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_JOB = "expiry_notices"
+EXPIRY_NOTICE_TEXT = ("Ваша подписка «{plan}» закончится {end}. ⏳\n"
+                      "Информация о продлении: /subscribe.")
+
+# Пауза между пачками: хэндлеры успевают взять блокировку на запись
+_BATCH_PAUSE = 0.05
+# Через сколько предупреждений сохранять позицию рассылки
+_CHECKPOINT_EVERY = 100
+
+
+class SubscriptionSweeper:
+    """
+    Фоновое обслуживание таблицы subscriptions, раз в interval секунд в отдельном потоке:
+
+      * снимает is_active с закончившихся подписок - пачками по batch_size строк, каждая пачка
+        в своей короткой транзакции;
+      * переносит неактивные подписки, закончившиеся больше archive_after_days дней назад,
+        в subscriptions_archive (так же пачками);
+      * предупреждает пользователей, чья последняя подписка закончится в ближайшие notice_before секунд.
+        Подписки читаются постранично в порядке (end_date, subscription_id), предупреждения уходят
+        через notify(telegram_id, text) не чаще notify_rate в секунду. Позиция сохраняется
+        в job_checkpoints, после перезапуска рассылка продолжается с нее. Продленная подписка
+        получает новый end_date и будет предупреждена еще раз - перед новым окончанием.
+
+    Задача не блокирует обработку сообщений: пауза между пачками отпускает блокировку на запись.
+    """
+
+    def __init__(self, notify, interval: float = SWEEP_INTERVAL, batch_size: int = SWEEP_BATCH_SIZE,
+                 archive_after_days: int = SUBSCRIPTION_ARCHIVE_AFTER_DAYS, notice_before: int = EXPIRY_NOTICE_BEFORE,
+                 notify_rate: float = EXPIRY_NOTIFY_RATE, clock=time.time):
+        self.notify = notify
+        self.interval = interval
+        self.batch_size = batch_size
+        self.archive_after_days = archive_after_days
+        self.notice_before = notice_before
+        self.notify_rate = notify_rate
+        self._clock = clock
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        # Статистика
+        self.runs = 0
+        self.deactivated = 0
+        self.archived = 0
+        self.notified = 0
+        self.failed_runs = 0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="subscription-sweeper", daemon=True)
+        self._thread.start()
+        logger.info(f"Обслуживание подписок запущено, интервал {self.interval} с.")
+
+    def stop(self, timeout: float = 10.0):
+        """Останавливает поток; текущая пачка дописывается, позиция рассылки сохраняется."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+            logger.info(f"Статистика обслуживания подписок: {self.stats()}")
+
+    def _loop(self):
+        while True:
+            self.run_once()
+            if self._stop.wait(self.interval):
+                return
+
+    def run_once(self):
+        """Один обход: снятие истекших, архив, предупреждения. Ошибка одного шага не мешает остальным."""
+        self.runs += 1
+        for step in (self._deactivate_expired, self._archive_old, self._notify_expiring):
+            if self._stop.is_set():
+                return
+            try:
+                step()
+            except Exception as e:
+                self.failed_runs += 1
+                logger.error(f"Ошибка обслуживания подписок ({step.__name__}): {e}", exc_info=True)
+
+    def _batches(self, func, *args) -> int:
+        """Вызывает func(*args, batch_size) до неполной пачки, возвращает сумму."""
+        total = 0
+        while True:
+            count = func(*args, self.batch_size)
+            total += count
+            if count < self.batch_size or self._stop.wait(_BATCH_PAUSE):
+                return total
+
+    def _deactivate_expired(self):
+        count = self._batches(deactivate_expired_subscriptions, int(self._clock()))
+        self.deactivated += count
+        if count:
+            logger.info(f"Снята отметка активности с {count} закончившихся подписок.")
+
+    def _archive_old(self):
+        if self.archive_after_days is None:
+            return
+        ended_before = int(self._clock()) - self.archive_after_days * SECONDS_PER_DAY
+        count = self._batches(archive_subscriptions, ended_before)
+        self.archived += count
+        if count:
+            logger.info(f"В архив перенесено {count} подписок, закончившихся до {_format_date(ended_before)}.")
+
+    def _notify_expiring(self):
+        if not self.notice_before:
+            return
+        now = int(self._clock())
+        # Уже закончившиеся подписки (бот был остановлен) не предупреждаем
+        position = max(load_checkpoint(NOTIFY_JOB) or (now, 0), (now, 0))
+        bucket = TokenBucket(self.notify_rate, 1, time.monotonic())
+        sent = 0
+        try:
+            for subscription_id, telegram_id, end_date, plan_name in iter_expiring_subscriptions(
+                    position, now + self.notice_before):
+                while (delay := bucket.delay(time.monotonic())) > 0:
+                    if self._stop.wait(delay):
+                        return
+                bucket.take()
+                plan = (plan_name or "").removesuffix(EXTENDED_PLAN_SUFFIX)
+                self.notify(telegram_id, EXPIRY_NOTICE_TEXT.format(plan=plan, end=_format_date(end_date)))
+                position = (end_date, subscription_id)
+                sent += 1
+                if sent % _CHECKPOINT_EVERY == 0:
+                    save_checkpoint(NOTIFY_JOB, position)
+        finally:
+            if sent:
+                # Сохраняем и при остановке посреди рассылки: после перезапуска продолжим со следующей подписки
+                save_checkpoint(NOTIFY_JOB, position)
+                self.notified += sent
+                logger.info(f"Отправлено предупреждений об окончании подписки: {sent}.")
+
+    def stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "deactivated": self.deactivated,
+            "archived": self.archived,
+            "notified": self.notified,
+            "failed_runs": self.failed_runs,
+        }
+
+
+def _format_date(epoch: int) -> str:
+    return datetime.datetime.fromtimestamp(epoch).strftime("%d.%m.%Y %H:%M")
@@ -0,0 +1,72 @@
+import asyncio
+
+import openai
+import pytest
+
+from benchmarks import fake_openai
+from benchmarks.fake_openai import FakeOpenAIServer
+from llm_router import LLMRouter, Endpoint
+
+MESSAGES = [{"role": "user", "content": "Привет"}]
+USAGE = {"include_usage": True}
+
+
+@pytest.fixture
+def server():
+    server = FakeOpenAIServer(reply_tokens=3).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def router(server):
+    router = LLMRouter([Endpoint("fake", server.base_url, "fake-model", timeout=5.0)])
+    yield router
+    router.close()
+
+
+def test_stream_without_stream_options_support_is_retried_once(server, router):
+    server.stream_options = False
+
+    chunks = list(router.stream(messages=MESSAGES, stream_options=USAGE))
+    assert any(chunk.choices and chunk.choices[0].delta.content for chunk in chunks)
+    assert server.requests == 2
+    assert router.endpoints[0].stream_options is False
+
+    # Дальше stream_options этому серверу не передаются - лишнего запроса нет
+    list(router.stream(messages=MESSAGES, stream_options=USAGE))
+    assert server.requests == 3
+    assert router.endpoints[0].outstanding == 0
+
+
+def test_async_stream_without_stream_options_support_is_retried_once(server, router):
+    server.stream_options = False
+
+    async def read():
+        return [chunk async for chunk in router.astream(messages=MESSAGES, stream_options=USAGE)]
+
+    chunks = asyncio.run(read())
+    assert any(chunk.choices and chunk.choices[0].delta.content for chunk in chunks)
+    assert server.requests == 2
+    assert router.endpoints[0].stream_options is False
+
+
+def test_usage_chunk_is_kept_when_supported(server, router):
+    chunks = list(router.stream(messages=MESSAGES, stream_options=USAGE))
+    assert chunks[-1].usage is not None
+    assert server.requests == 1
+    assert router.endpoints[0].stream_options is True
+
+
+def test_other_bad_requests_keep_stream_options(router, monkeypatch):
+    def reject(handler):
+        handler.rfile.read(int(handler.headers.get("Content-Length") or 0))
+        handler._send_json(400, {"error": {"message": "context length exceeded"}})
+
+    # 400 не из-за stream_options: повтор без них тоже получает 400, ошибка уходит вызывающему,
+    # а сервер не помечается как не поддерживающий stream_options
+    monkeypatch.setattr(fake_openai._Handler, "do_POST", reject)
+    with pytest.raises(openai.BadRequestError):
+        list(router.stream(messages=MESSAGES, stream_options=USAGE))
+    assert router.endpoints[0].stream_options is True
+    assert router.endpoints[0].outstanding == 0
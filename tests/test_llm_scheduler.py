@@ -0,0 +1,139 @@
+import asyncio
+import threading
+
+import pytest
+
+from generation_tracker import CancelEvent
+from llm_scheduler import LLMScheduler, QueueFullError
+
+PLANS = {"trial": 1, "pro": 4}
+
+
+def make_scheduler(**kwargs) -> LLMScheduler:
+    params = dict(max_concurrent=1, per_user_limit=1, max_queue=1000, per_user_queue=1000, plan_weights=PLANS)
+    params.update(kwargs)
+    return LLMScheduler(**params)
+
+
+async def grant_order(scheduler: LLMScheduler, requests: list[tuple[int, str]]) -> list[int]:
+    """Ставит все запросы в очередь, пока слот занят, и возвращает порядок, в котором они получили слот."""
+    order = []
+    release = asyncio.Event()
+
+    async def blocker():
+        async with scheduler.async_slot(0, "trial"):
+            await release.wait()
+
+    async def request(user_id, plan):
+        async with scheduler.async_slot(user_id, plan):
+            order.append(user_id)
+            await asyncio.sleep(0)
+
+    blocking = asyncio.create_task(blocker())
+    await asyncio.sleep(0)
+    tasks = [asyncio.create_task(request(user_id, plan)) for user_id, plan in requests]
+    await asyncio.sleep(0)
+    assert scheduler.stats()["queue_depth"] == len(requests)
+    release.set()
+    await asyncio.gather(blocking, *tasks)
+    return order
+
+
+def test_slots_are_shared_in_proportion_to_plan_weights():
+    requests = [(1, "pro")] * 40 + [(2, "trial")] * 40
+    order = asyncio.run(grant_order(make_scheduler(), requests))
+
+    # Пока ждут оба, на каждый слот пользователя с весом 1 приходится 4 слота пользователя с весом 4
+    first = order[:25]
+    assert first.count(1) == pytest.approx(20, abs=1)
+    assert first.count(2) == pytest.approx(5, abs=1)
+    # Ни один пользователь не ждет, пока другой получит все свои слоты
+    assert max(len(run) for run in "".join(map(str, first)).split("2")) <= 5
+    assert sorted(order) == sorted(user_id for user_id, _ in requests)
+
+
+def test_equal_weights_alternate():
+    requests = [(1, "trial")] * 10 + [(2, "trial")] * 10 + [(3, "trial")] * 10
+    order = asyncio.run(grant_order(make_scheduler(), requests))
+
+    for i in range(0, 30, 3):
+        assert sorted(order[i:i + 3]) == [1, 2, 3]
+
+
+def test_late_user_does_not_bank_priority():
+    scheduler = make_scheduler()
+    order = []
+    late = []
+
+    async def request(user_id):
+        async with scheduler.async_slot(user_id, "trial"):
+            order.append(user_id)
+            if len(order) == 10:
+                # Пользователь 2 приходит, когда пользователь 1 уже получил 10 слотов
+                late.extend(asyncio.create_task(request(2)) for _ in range(5))
+            await asyncio.sleep(0)
+
+    async def main():
+        async with scheduler.async_slot(0, "trial"):
+            tasks = [asyncio.create_task(request(1)) for _ in range(20)]
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        await asyncio.gather(*late)
+
+    asyncio.run(main())
+    # Виртуальное время пользователя 2 начинается с текущего, а не с нуля: он не забирает
+    # 10 слотов подряд, а чередуется с пользователем 1
+    assert order[10:20].count(2) == 5
+    assert max(len(run) for run in "".join(map(str, order[10:])).split("1")) == 1
+
+
+def test_queue_limits_reject_immediately():
+    scheduler = make_scheduler(max_queue=3, per_user_queue=2)
+    held = threading.Event()
+    done = threading.Event()
+
+    def hold():
+        with scheduler.slot(0, "trial"):
+            held.set()
+            done.wait()
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    held.wait()
+    try:
+        tickets = [scheduler._enqueue(1, "trial", lambda: None) for _ in range(2)]
+        with pytest.raises(QueueFullError):
+            scheduler._enqueue(1, "trial", lambda: None)  # Очередь пользователя
+        tickets.append(scheduler._enqueue(2, "trial", lambda: None))
+        with pytest.raises(QueueFullError):
+            scheduler._enqueue(3, "trial", lambda: None)  # Общая очередь
+        assert scheduler.stats()["rejected"] == 2
+        for ticket in tickets:
+            scheduler._release(ticket)
+    finally:
+        done.set()
+        holder.join()
+    assert scheduler.stats()["queue_depth"] == 0
+
+
+def test_cancelled_wait_leaves_the_queue():
+    scheduler = make_scheduler()
+    cancel = CancelEvent()
+    results = []
+
+    async def main():
+        async with scheduler.async_slot(0, "trial"):
+            async def waiter():
+                async with scheduler.async_slot(1, "trial", cancel) as granted:
+                    results.append(granted)
+
+            task = asyncio.create_task(waiter())
+            await asyncio.sleep(0)
+            assert scheduler.stats()["queue_depth"] == 1
+            cancel.set()
+            await task
+            assert scheduler.stats()["queue_depth"] == 0
+
+    asyncio.run(main())
+    assert results == [False]
+    assert scheduler.stats()["running"] == 0
@@ -0,0 +1,97 @@
+import datetime
+import sqlite3
+import time
+
+import pytest
+
+import database
+
+
+def local_epoch(value: datetime.datetime) -> int:
+    return int(value.timestamp())
+
+
+@pytest.fixture(params=["UTC0", "MSK-3"])
+def local_timezone(request, monkeypatch):
+    """Старые даты записаны в локальном времени: миграция должна учитывать часовой пояс процесса."""
+    monkeypatch.setenv("TZ", request.param)
+    time.tzset()
+    yield request.param
+    monkeypatch.undo()
+    time.tzset()
+
+
+@pytest.fixture
+def legacy_db(tmp_path):
+    """БД в схеме версии 1: даты подписок - текст, как их записывал sqlite3 из datetime.now()."""
+    original = database.DB_NAME
+    path = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    database._migration_001_initial_schema(cursor)
+    cursor.execute("CREATE TABLE schema_version (version INTEGER NOT NULL)")
+    cursor.execute("INSERT INTO schema_version (version) VALUES (1)")
+    conn.commit()
+    yield path, conn
+    conn.close()
+    database.use_database(original)
+
+
+def migrate(path: str):
+    database.use_database(path)
+    database.initialize_database()
+
+
+def test_migration_2_converts_legacy_text_dates(legacy_db, local_timezone):
+    path, conn = legacy_db
+    now = datetime.datetime.now().replace(microsecond=123456)
+    future = now + datetime.timedelta(days=30)
+    past = now - datetime.timedelta(days=2)
+    conn.executemany("INSERT INTO users (telegram_id, username, first_name) VALUES (?, ?, ?)",
+                     [(1, "active", "А"), (2, "expired", "Б")])
+    conn.executemany('''
+        INSERT INTO subscriptions (subscription_id, telegram_id, start_date, end_date, is_active, plan_name)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [
+        # Адаптер sqlite3 по умолчанию: "ГГГГ-ММ-ДД ЧЧ:ММ:СС.ffffff"
+        (10, 1, str(now), str(future), 1, "Месячный"),
+        (11, 2, str(past - datetime.timedelta(days=1)), str(past), 1, "Пробный доступ"),
+        # isoformat() с "T" и без долей секунды
+        (12, 3, now.replace(microsecond=0).isoformat(), future.replace(microsecond=0).isoformat(), 1,
+         "Пробный доступ"),
+        (13, 1, str(past - datetime.timedelta(days=30)), str(past), None, "Старый"),
+    ])
+    conn.commit()
+
+    migrate(path)
+
+    with database._pool.connection() as db:
+        assert db.execute("SELECT MAX(version) FROM schema_version").fetchone()[0] == database.MIGRATIONS[-1][0]
+        rows = {row[0]: row[1:] for row in db.execute(
+            "SELECT subscription_id, start_date, end_date, is_active FROM subscriptions")}
+        users = {row[0]: row[1:] for row in db.execute("SELECT telegram_id, active_until, active_plan FROM users")}
+
+    assert rows[10] == (local_epoch(now), local_epoch(future), 1)
+    assert rows[11][1] == local_epoch(past)
+    assert rows[12][:2] == (local_epoch(now.replace(microsecond=0)), local_epoch(future.replace(microsecond=0)))
+    assert rows[13][2] == 0  # NULL в is_active стал 0
+    assert all(isinstance(value, int) for row in rows.values() for value in row)
+
+    # active_until - самая поздняя активная подписка; пользователь 3 (триал без /start) добавлен в users
+    assert users[1] == (local_epoch(future), "Месячный")
+    assert users[2] == (local_epoch(past), "Пробный доступ")
+    assert users[3] == (local_epoch(future.replace(microsecond=0)), "Пробный доступ")
+
+    assert database.check_user_subscription(1) is True
+    assert database.check_user_subscription(2) is False
+    assert database.get_active_plan(3) == "Пробный доступ"
+
+
+def test_migrations_are_applied_once(legacy_db):
+    path, _ = legacy_db
+    migrate(path)
+    migrate(path)
+
+    with database._pool.connection() as db:
+        versions = [row[0] for row in db.execute("SELECT version FROM schema_version ORDER BY version")]
+    assert versions == [version for version, _ in database.MIGRATIONS]
@@ -0,0 +1,75 @@
+from html.parser import HTMLParser
+
+import pytest
+
+from outbox import split_html_text
+
+
+class _TagBalance(HTMLParser):
+    """Проверяет, что теги в части текста закрыты и закрываются в обратном порядке."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.stack = []
+
+    def handle_starttag(self, tag, attrs):
+        self.stack.append(tag)
+
+    def handle_endtag(self, tag):
+        assert self.stack and self.stack[-1] == tag, f"</{tag}> при открытых {self.stack}"
+        self.stack.pop()
+
+
+def assert_balanced(chunk: str):
+    parser = _TagBalance()
+    parser.feed(chunk)
+    parser.close()
+    assert parser.stack == [], f"не закрыты {parser.stack} в {chunk!r}"
+
+
+def test_short_text_is_one_chunk():
+    assert split_html_text("<b>привет</b>", limit=100) == ["<b>привет</b>"]
+
+
+def test_nested_tags_are_closed_and_reopened_at_the_limit():
+    text = "<b>жирный <i>" + "курсив " * 20 + "</i> снова жирный</b> обычный"
+    chunks = split_html_text(text, limit=60)
+
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert len(chunk) <= 60
+        assert_balanced(chunk)
+    # Граница внутри <b><i>: часть закрывает оба тега, следующая открывает их в том же порядке
+    assert chunks[0].endswith("</i></b>")
+    assert chunks[1].startswith("<b><i>")
+    assert chunks[-1].endswith("обычный")
+
+
+def test_tag_attributes_survive_reopening():
+    text = '<a href="https://example.com/?a=1&amp;b=2">' + "ссылка " * 30 + "</a>"
+    chunks = split_html_text(text, limit=80)
+
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert len(chunk) <= 80
+        assert chunk.startswith('<a href="https://example.com/?a=1&amp;b=2">')
+        assert_balanced(chunk)
+
+
+@pytest.mark.parametrize("limit", [17, 18, 19, 20, 21])
+def test_entities_and_tags_are_not_cut(limit):
+    text = "<b>" + "a&amp;b " * 10 + "</b>"
+    for chunk in split_html_text(text, limit=limit):
+        assert len(chunk) <= limit
+        assert_balanced(chunk)
+        # Сущность целиком или не задета: "&" всегда начинает "&amp;"
+        assert chunk.count("&") == chunk.count("&amp;")
+
+
+def test_sent_chunks_do_not_change_when_text_grows():
+    text = "<b>" + "слово " * 40 + "<i>" + "еще " * 40 + "</i></b>"
+    full = split_html_text(text, limit=70)
+    for end in range(len(text) // 2, len(text)):
+        partial = split_html_text(text[:end], limit=70)
+        # Все части, кроме последней (ее еще дописывают), совпадают с частями полного текста
+        assert partial[:-1] == full[:len(partial) - 1]
@@ -0,0 +1,139 @@
+import pytest
+
+from quota import QuotaEngine, QuotaExceededError
+
+WINDOW = 2400  # 24 интервала по 100 секунд
+PLANS = {"trial": {"requests": 3, "tokens": 1000}, "unlimited": {"requests": None, "tokens": None}}
+
+
+class Clock:
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class Storage:
+    """Таблица quota_usage в памяти: load_quota_usage и add_quota_usage."""
+
+    def __init__(self):
+        self.rows: dict[tuple[int, int], list[int]] = {}
+        self.fail_loads = 0
+
+    def load(self, user_id: int, since: int):
+        if self.fail_loads:
+            self.fail_loads -= 1
+            raise OSError("database is locked")
+        return [(bucket, *counters) for (uid, bucket), counters in sorted(self.rows.items())
+                if uid == user_id and bucket >= since]
+
+    def add(self, rows, purge_before=None):
+        for user_id, bucket, *delta in rows:
+            counters = self.rows.setdefault((user_id, bucket), [0, 0, 0])
+            for i in range(3):
+                counters[i] += delta[i]
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def storage():
+    return Storage()
+
+
+@pytest.fixture
+def make_engine(clock, storage):
+    engines = []
+
+    def make():
+        engine = QuotaEngine(plan_limits=PLANS, default_limits=PLANS["trial"], window=WINDOW,
+                             flush_interval=3600.0, load=storage.load, flush_rows=storage.add, clock=clock)
+        engines.append(engine)
+        return engine
+
+    yield make
+    for engine in engines:
+        engine.close()
+
+
+def test_request_limit_within_the_window(make_engine):
+    engine = make_engine()
+    for _ in range(3):
+        engine.check(1, "trial")
+        engine.record(1, prompt_tokens=10, completion_tokens=10)
+
+    with pytest.raises(QuotaExceededError) as error:
+        engine.check(1, "trial")
+    assert error.value.status.requests_used == 3
+    assert error.value.status.requests_left == 0
+    # Лимит одного пользователя не касается другого
+    engine.check(2, "trial")
+
+
+def test_token_limit_counts_prompt_and_completion(make_engine):
+    engine = make_engine()
+    engine.record(1, prompt_tokens=600, completion_tokens=400)
+
+    with pytest.raises(QuotaExceededError) as error:
+        engine.check(1, "trial")
+    assert error.value.status.tokens_used == 1000
+
+
+def test_usage_slides_out_of_the_window(make_engine, clock):
+    engine = make_engine()
+    engine.record(1, 10, 10)
+    clock.now += 1000
+    engine.record(1, 10, 10)
+    engine.record(1, 10, 10)
+    with pytest.raises(QuotaExceededError) as error:
+        engine.check(1, "trial")
+    # Квота освободится, когда из окна выпадет интервал первого запроса
+    assert 0 < error.value.status.resets_in <= WINDOW - 1000
+
+    clock.now += WINDOW - 1000
+    status = engine.check(1, "trial")
+    assert status.requests_used == 2
+
+    clock.now += 1000
+    assert engine.check(1, "trial").requests_used == 0
+
+
+def test_unlimited_plan_is_never_exhausted(make_engine):
+    engine = make_engine()
+    engine.record(1, 10**9, 10**9, requests=10**6)
+    status = engine.check(1, "unlimited")
+    assert status.requests_left is None and status.tokens_left is None
+
+
+def test_usage_survives_restart_through_the_database(make_engine, storage, clock):
+    engine = make_engine()
+    engine.check(1, "trial")
+    engine.record(1, 10, 10)
+    engine.record(1, 10, 10)
+    engine.flush()
+    assert storage.rows
+
+    # Другой процесс (или перезапуск) загружает расход из БД при первом обращении к пользователю
+    restarted = make_engine()
+    clock.now += 50
+    assert restarted.check(1, "trial").requests_used == 2
+    restarted.record(1, 10, 10)
+    with pytest.raises(QuotaExceededError):
+        restarted.check(1, "trial")
+
+
+def test_failed_load_lets_the_request_through_and_retries(make_engine, storage):
+    storage.add([(1, 999_900, 3, 0, 0)])
+    storage.fail_loads = 1
+    engine = make_engine()
+
+    # БД недоступна: квоту не проверить, запрос пропускается, результат не кэшируется
+    assert engine.check(1, "trial").requests_used == 0
+    assert engine.stats()["failed_loads"] == 1
+    with pytest.raises(QuotaExceededError):
+        engine.check(1, "trial")
+    assert engine.stats()["loads"] == 1
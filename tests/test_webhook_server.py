@@ -0,0 +1,83 @@
+import queue
+import threading
+import time
+
+from webhook_server import KeyedExecutor, WebhookServer, update_partition_key
+
+
+def test_partition_key_is_the_author():
+    assert update_partition_key({"update_id": 1, "message": {"from": {"id": 42}, "text": "привет"}}) == 42
+    assert update_partition_key({"update_id": 2, "callback_query": {"from": {"id": 42}}}) == 42
+    assert update_partition_key({"update_id": 3, "poll_answer": {"user": {"id": 42}}}) == 42
+    # Апдейт без автора раскладывается по update_id
+    assert update_partition_key({"update_id": 7, "poll": {"id": "p"}}) == 7
+
+
+def test_updates_of_one_user_go_to_one_queue():
+    server = WebhookServer(("127.0.0.1", 0), [queue.Queue() for _ in range(4)], secret=None)
+    try:
+        for update_id in range(40):
+            user_id = update_id % 5
+            assert server.dispatch({"update_id": update_id, "message": {"from": {"id": user_id}}}, str(update_id))
+    finally:
+        server.server_close()
+
+    for index, updates in enumerate(server.queues):
+        while not updates.empty():
+            key, raw_update = updates.get_nowait()
+            assert key % 4 == index
+            assert int(raw_update) % 5 == key
+    assert server.accepted == 40
+
+
+def test_full_queue_rejects_instead_of_blocking():
+    server = WebhookServer(("127.0.0.1", 0), [queue.Queue(maxsize=1)], secret=None)
+    try:
+        assert server.dispatch({"update_id": 1, "message": {"from": {"id": 1}}}, "1")
+        started = time.monotonic()
+        assert not server.dispatch({"update_id": 2, "message": {"from": {"id": 1}}}, "2")
+        assert time.monotonic() - started < 5
+    finally:
+        server.server_close()
+    assert server.rejected == 1
+
+
+def test_keyed_executor_keeps_order_within_a_key():
+    executor = KeyedExecutor(max_workers=4, max_pending=100)
+    results: dict[int, list[int]] = {key: [] for key in range(3)}
+    running: dict[int, int] = {key: 0 for key in range(3)}
+    overlaps = []
+    lock = threading.Lock()
+
+    def task(key, n):
+        def run():
+            with lock:
+                running[key] += 1
+                if running[key] > 1:
+                    overlaps.append(key)
+            time.sleep(0.001)
+            with lock:
+                running[key] -= 1
+                results[key].append(n)
+        return run
+
+    for n in range(20):
+        for key in range(3):
+            executor.submit(key, task(key, n))
+    assert executor.drain(timeout=10)
+
+    assert overlaps == []
+    assert all(results[key] == list(range(20)) for key in range(3))
+
+
+def test_keyed_executor_survives_a_failing_task():
+    executor = KeyedExecutor(max_workers=2, max_pending=10)
+    done = []
+
+    def fail():
+        raise RuntimeError("ошибка обработчика")
+
+    executor.submit(1, fail)
+    executor.submit(1, lambda: done.append(1))
+    assert executor.drain(timeout=10)
+    assert done == [1]
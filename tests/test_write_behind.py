@@ -0,0 +1,121 @@
+import sqlite3
+
+import pytest
+
+import write_behind
+from write_behind import WriteBehindBuffer
+
+
+class FlakyStore:
+    """flush_batch, который первые failures вызовов падает с "database is locked"."""
+
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.calls = 0
+        self.batches = []
+
+    def __call__(self, rows):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise sqlite3.OperationalError("database is locked")
+        self.batches.append(list(rows))
+
+
+class SameHash:
+    """Значение с одинаковым hash() у всех экземпляров: строки с ним различаются только сравнением."""
+
+    def __init__(self, value):
+        self.value = value
+
+    def __hash__(self):
+        return 0
+
+    def __eq__(self, other):
+        return isinstance(other, SameHash) and self.value == other.value
+
+
+@pytest.fixture
+def make_buffer():
+    buffers = []
+
+    def make(store, **kwargs):
+        # Большой flush_interval: фоновый поток не вмешивается, тест сбрасывает буфер сам
+        buffer = WriteBehindBuffer(store, **{"flush_interval": 3600.0, **kwargs})
+        buffers.append(buffer)
+        return buffer
+
+    yield make
+    for buffer in buffers:
+        buffer.close()
+
+
+def test_failed_batch_is_kept_and_retried(make_buffer):
+    store = FlakyStore(failures=1)
+    buffer = make_buffer(store)
+    buffer.submit(1, (1, "alice"))
+    buffer.submit(2, (2, "bob"))
+
+    assert buffer.flush() is False
+    stats = buffer.stats()
+    assert stats["failed"] == 1 and stats["pending"] == 2 and stats["written"] == 0
+
+    # Пока пачка ждала повтора, строка ключа 1 изменилась: записывается новая, по одной на ключ
+    buffer.submit(1, (1, "alice_new"))
+    assert buffer.flush() is True
+    assert store.batches == [[(1, "alice_new"), (2, "bob")]]
+    assert buffer.stats()["written"] == 2 and buffer.stats()["pending"] == 0
+
+
+def test_retry_delay_grows_and_resets(make_buffer):
+    store = FlakyStore(failures=3)
+    buffer = make_buffer(store)
+    buffer.submit(1, (1, "alice"))
+
+    delays = []
+    for _ in range(3):
+        assert buffer.flush() is False
+        delays.append(buffer._retry_delay)
+    assert delays == [write_behind._RETRY_DELAY, write_behind._RETRY_DELAY * 2, write_behind._RETRY_DELAY * 4]
+
+    assert buffer.flush() is True
+    assert buffer._retry_delay == 0.0
+
+
+def test_close_retries_the_remainder(make_buffer, monkeypatch):
+    monkeypatch.setattr(write_behind, "_RETRY_DELAY", 0.01)
+    store = FlakyStore(failures=2)
+    buffer = make_buffer(store)
+    buffer.submit(1, (1, "alice"))
+
+    buffer.close()
+    assert store.batches == [[(1, "alice")]]
+    # После остановки submit пишет сразу
+    buffer.submit(2, (2, "bob"))
+    assert store.batches[-1] == [(2, "bob")]
+
+
+def test_unchanged_rows_are_skipped_and_updates_coalesced(make_buffer):
+    store = FlakyStore()
+    buffer = make_buffer(store)
+    buffer.submit(1, (1, "alice"))
+    buffer.submit(1, (1, "alice"))
+    buffer.submit(1, (1, "alice2"))
+    buffer.flush()
+    buffer.submit(1, (1, "alice2"))
+
+    assert store.batches == [[(1, "alice2")]]
+    stats = buffer.stats()
+    assert stats["skipped"] == 2 and stats["coalesced"] == 1
+
+
+def test_rows_with_equal_hashes_are_not_mistaken_for_unchanged(make_buffer):
+    store = FlakyStore()
+    buffer = make_buffer(store)
+    old, new = (1, SameHash("alice")), (1, SameHash("alice_new"))
+    assert hash(old) == hash(new)
+
+    buffer.submit(1, old)
+    buffer.flush()
+    buffer.submit(1, new)
+    buffer.flush()
+    assert store.batches == [[old], [new]]
@@ -0,0 +1,284 @@
+import json
+import logging
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    from config import BOT_TOKEN
+except ImportError:
+    print("Токен BOT_TOKEN не найден в config.py!")
+    exit()
+
+try:
+    from config import (WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_URL, WEBHOOK_SECRET, WEBHOOK_WORKERS,
+                        WEBHOOK_QUEUE_SIZE, WEBHOOK_DRAIN_TIMEOUT)
+except ImportError:
+    WEBHOOK_HOST = "0.0.0.0"  # Адрес, на котором слушает встроенный HTTP-сервер
+    WEBHOOK_PORT = 8443
+    WEBHOOK_PATH = "/telegram/webhook"
+    WEBHOOK_URL = None  # Публичный URL (https://example.com/telegram/webhook); None - вебхук не регистрируется
+    WEBHOOK_SECRET = None  # Секрет для заголовка X-Telegram-Bot-Api-Secret-Token
+    WEBHOOK_WORKERS = 4  # Процессов-обработчиков
+    WEBHOOK_QUEUE_SIZE = 1000  # Апдейтов в очереди одного процесса; при переполнении Telegram получает 503 и повторит
+    WEBHOOK_DRAIN_TIMEOUT = 30.0  # Сколько секунд ждать обработки принятых апдейтов при остановке
+
+from log_pipeline import setup_logging, stop_logging
+
+logger = logging.getLogger(__name__)
+
+# Поля апдейта, в которых Telegram передает автора (from)
+_UPDATE_USER_FIELDS = (
+    "message", "edited_message", "callback_query", "inline_query", "chosen_inline_result", "shipping_query",
+    "pre_checkout_query", "poll_answer", "my_chat_member", "chat_member", "chat_join_request",
+)
+
+
+def update_partition_key(update: dict) -> int:
+    """
+    Ключ шардирования апдейта - id пользователя (для poll_answer - поле user).
+    Все апдейты одного пользователя попадают в один процесс и обрабатываются в порядке поступления.
+    """
+    for field in _UPDATE_USER_FIELDS:
+        payload = update.get(field)
+        if payload:
+            user = payload.get("from") or payload.get("user")
+            if user:
+                return user["id"]
+    return update.get("update_id", 0)
+
+
+class KeyedExecutor:
+    """
+    Пул потоков с порядком внутри ключа: задачи с одним ключом выполняются строго по очереди,
+    с разными - параллельно. Число принятых, но не завершенных задач ограничено max_pending.
+    """
+
+    def __init__(self, max_workers: int, max_pending: int):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="update")
+        self._pending: dict[int, deque] = {}
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, key: int, fn):
+        """Блокируется, если max_pending задач уже ждут выполнения."""
+        self._slots.acquire()
+        with self._lock:
+            user_queue = self._pending.get(key)
+            if user_queue is not None:
+                # Для этого ключа уже выполняется задача - встаем за ней
+                user_queue.append(fn)
+                return
+            self._pending[key] = deque()
+        self._pool.submit(self._run, key, fn)
+
+    def _run(self, key: int, fn):
+        while True:
+            try:
+                fn()
+            except Exception as e:
+                logger.error(f"Ошибка при обработке апдейта пользователя {key}: {e}", exc_info=True)
+            finally:
+                self._slots.release()
+            with self._lock:
+                user_queue = self._pending[key]
+                if not user_queue:
+                    del self._pending[key]
+                    if not self._pending:
+                        self._idle.notify_all()
+                    return
+                fn = user_queue.popleft()
+
+    def drain(self, timeout: float | None = None) -> bool:
+        """Дожидается выполнения всех принятых задач. False - не успели за timeout."""
+        with self._lock:
+            drained = self._idle.wait_for(lambda: not self._pending, timeout)
+        self._pool.shutdown(wait=drained)
+        return drained
+
+
+def _worker_main(index: int, updates: multiprocessing.Queue, drain_timeout: float, workers: int):
+    """Процесс-обработчик: забирает апдейты своего шарда и передает их хэндлерам dcorpbot."""
+    # Ctrl+C получает главный процесс и останавливает обработчики сам, через очередь
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    # Импорт dcorpbot бота не создает, поэтому и при запуске через dcorpbot.py (spawn уже выполнил его
+    # как __mp_main__) импортируем модуль обычным образом: бот создается один раз, в create_bot()
+    import dcorpbot
+    from telebot.types import Update
+
+    # Хэндлеры выполняются в потоках KeyedExecutor, а не во внутреннем пуле TeleBot; БД уже инициализирована в run()
+    bot = dcorpbot.create_bot(threaded=False)
+    # Общий лимит Telegram на бота делится между процессами; лимиты чатов - нет, чат живет в одном процессе
+    dcorpbot.outbox.set_global_rate(dcorpbot.outbox.global_rate / workers)
+    executor = KeyedExecutor(max_workers=dcorpbot.BOT_WORKER_THREADS, max_pending=dcorpbot.BOT_WORKER_THREADS * 4)
+    # Метрики у каждого процесса свои - и свой порт
+    from metrics import METRICS_PORT, start_metrics_server
+    start_metrics_server(None if METRICS_PORT is None else METRICS_PORT + index)
+    # Обслуживание подписок - в одном процессе, иначе предупреждения ушли бы несколько раз
+    if index == 0 and dcorpbot.SUBSCRIPTION_SWEEPER:
+        dcorpbot.subscription_sweeper.start()
+    logger.info(f"Обработчик апдейтов №{index} запущен.")
+
+    processed = 0
+    while True:
+        item = updates.get()
+        if item is None:
+            break
+        key, raw_update = item
+        update = Update.de_json(raw_update)
+        # Новое сообщение прерывает генерацию ответа на предыдущее, не дожидаясь своей очереди
+        dcorpbot.preempt_generation(update)
+        executor.submit(key, lambda update=update: bot.process_new_updates([update]))
+        processed += 1
+
+    if not executor.drain(drain_timeout):
+        logger.warning(f"Обработчик №{index}: не все апдейты обработаны за {drain_timeout} с.")
+    dcorpbot.shutdown()
+    logger.info(f"Обработчик апдейтов №{index} остановлен, принято апдейтов: {processed}.")
+    # atexit в дочернем процессе multiprocessing не вызывается - дописываем очередь логов сами
+    stop_logging()
+
+
+class WebhookServer(ThreadingHTTPServer):
+    """
+    HTTP-сервер вебхука: принимает апдейты от Telegram и раскладывает их по очередям
+    процессов-обработчиков по update_partition_key. Отвечает сразу, не дожидаясь обработки.
+    """
+
+    # server_close() дожидается потоков, которые еще кладут апдейты в очереди
+    daemon_threads = False
+    block_on_close = True
+
+    def __init__(self, address: tuple[str, int], queues: list, path: str = WEBHOOK_PATH,
+                 secret: str | None = WEBHOOK_SECRET):
+        super().__init__(address, _WebhookHandler)
+        self.queues = queues
+        self.webhook_path = path
+        self.secret = secret
+        self.accepted = 0
+        self.rejected = 0
+        self._counter_lock = threading.Lock()
+
+    def dispatch(self, update: dict, raw_update: str) -> bool:
+        key = update_partition_key(update)
+        try:
+            self.queues[key % len(self.queues)].put((key, raw_update), timeout=1.0)
+        except queue.Full:
+            with self._counter_lock:
+                self.rejected += 1
+            return False
+        with self._counter_lock:
+            self.accepted += 1
+        return True
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    server: WebhookServer
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} - {format % args}")
+
+    def _respond(self, status: int):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        if self.path != self.server.webhook_path:
+            self._respond(404)
+            return
+        if self.server.secret and self.headers.get("X-Telegram-Bot-Api-Secret-Token") != self.server.secret:
+            logger.warning(f"Запрос на вебхук с неверным секретом от {self.client_address[0]}.")
+            self._respond(403)
+            return
+
+        raw_update = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode("utf-8")
+        try:
+            update = json.loads(raw_update)
+        except ValueError:
+            self._respond(400)
+            return
+
+        # 503 - очередь обработчика переполнена, Telegram повторит доставку позже
+        self._respond(200 if self.server.dispatch(update, raw_update) else 503)
+
+
+def run(workers: int = WEBHOOK_WORKERS):
+    """Точка входа webhook-режима (BOT_RUNTIME = "webhook" в config.py)."""
+    from database import initialize_database, close_database
+
+    # Миграции - один раз в главном процессе, до запуска обработчиков
+    initialize_database()
+    close_database()
+
+    # spawn, а не fork: каждый обработчик сам открывает соединения с БД и HTTP-клиенты
+    context = multiprocessing.get_context("spawn")
+    queues = [context.Queue(maxsize=WEBHOOK_QUEUE_SIZE) for _ in range(workers)]
+
+    def start_worker(index: int):
+        process = context.Process(target=_worker_main, args=(index, queues[index], WEBHOOK_DRAIN_TIMEOUT, workers),
+                                  name=f"bot-worker-{index}")
+        process.start()
+        return process
+
+    processes = [start_worker(i) for i in range(workers)]
+    server = WebhookServer((WEBHOOK_HOST, WEBHOOK_PORT), queues)
+    stopping = threading.Event()
+
+    def supervise():
+        # Упавший обработчик перезапускается, его очередь апдейтов сохраняется
+        while not stopping.wait(1.0):
+            for i, process in enumerate(processes):
+                if not process.is_alive() and not stopping.is_set():
+                    logger.error(f"Обработчик №{i} завершился с кодом {process.exitcode}, перезапускаем.")
+                    processes[i] = start_worker(i)
+
+    def request_stop(signum, frame):
+        # shutdown() нельзя вызывать из потока serve_forever (обработчик сигнала выполняется в нем)
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    threading.Thread(target=supervise, name="worker-supervisor", daemon=True).start()
+
+    if WEBHOOK_URL:
+        import telebot
+        telebot.TeleBot(BOT_TOKEN).set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET)
+        logger.info(f"Вебхук зарегистрирован: {WEBHOOK_URL}")
+
+    logger.info(f"Бот запускается в режиме webhook на {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}, "
+                f"обработчиков: {workers}...")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Плавная остановка: перестаем принимать апдейты, обработчики дорабатывают принятые
+        stopping.set()
+        server.server_close()
+        logger.info(f"Прием апдейтов остановлен (принято {server.accepted}, отклонено {server.rejected}), "
+                    f"ожидаем обработчики...")
+        for updates in queues:
+            try:
+                updates.put(None, timeout=WEBHOOK_DRAIN_TIMEOUT)
+            except queue.Full:
+                pass  # Обработчик не разбирает очередь - будет остановлен принудительно ниже
+        deadline = time.monotonic() + WEBHOOK_DRAIN_TIMEOUT + 5.0
+        for process in processes:
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                logger.warning(f"Обработчик {process.name} не остановился вовремя, завершаем принудительно.")
+                process.kill()
+        logger.info("Бот остановлен.")
+
+
+if __name__ == '__main__':
+    setup_logging()
+    run()
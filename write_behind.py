@@ -0,0 +1,179 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Пауза перед повтором после ошибки записи (удваивается с каждой ошибкой подряд), секунды
+_RETRY_DELAY = 0.5
+_MAX_RETRY_DELAY = 30.0
+# Попыток записать остаток при остановке
+_CLOSE_ATTEMPTS = 5
+
+
+class WriteBehindBuffer:
+    """
+    Буфер отложенной записи: submit() кладет строку в память и сразу возвращается,
+    фоновый поток пишет накопленное пачками через flush_batch(rows) - одной транзакцией.
+
+      * запись, не меняющая данных, отбрасывается: для каждого ключа хранится последняя записанная
+        или ожидающая записи строка (до fingerprint_size ключей, LRU). Сравниваются сами строки,
+        а не hash(): при совпадении хэшей разных строк изменение было бы потеряно;
+      * несколько обновлений одного ключа до сброса схлопываются в одно, последнее;
+      * пачка сбрасывается, когда накопилось batch_size ключей или самой старой записи
+        исполнилось flush_interval секунд;
+      * пачка, которую не удалось записать (например, "database is locked"), возвращается
+        в буфер - более новая строка того же ключа остается - и повторяется после паузы.
+
+    flush_batch получает список строк (значений submit) и должен записать их атомарно.
+    """
+
+    def __init__(self, flush_batch, batch_size: int = 500, flush_interval: float = 1.0,
+                 fingerprint_size: int = 100000, name: str = "write-behind"):
+        self.flush_batch = flush_batch
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fingerprint_size = fingerprint_size
+        self.name = name
+        self._pending: dict = {}  # ключ -> строка, ожидающая записи
+        self._oldest = 0.0  # time.monotonic() самой старой строки в _pending
+        self._last_rows: OrderedDict = OrderedDict()  # ключ -> последняя строка, LRU
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()  # Пачки пишутся по одной и по порядку
+        self._thread: threading.Thread | None = None
+        self._closing = False
+        self._retry_delay = 0.0
+        self._not_before = 0.0  # До этого момента фоновый поток не пишет (после ошибки записи)
+        # Статистика
+        self.submitted = 0
+        self.skipped = 0
+        self.coalesced = 0
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+
+    def submit(self, key, row: tuple):
+        """Ставит строку row для ключа key на запись. Не ждет диска."""
+        with self._lock:
+            self.submitted += 1
+            if self._last_rows.get(key) == row:
+                self._last_rows.move_to_end(key)
+                self.skipped += 1
+                return
+            self._remember_locked(key, row)
+            if key in self._pending:
+                self.coalesced += 1
+            elif not self._pending:
+                self._oldest = time.monotonic()
+            self._pending[key] = row
+
+            if self._closing:
+                # Фоновый поток уже остановлен - пишем сразу
+                flush_now = True
+            else:
+                flush_now = False
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._flush_loop, name=self.name, daemon=True)
+                    self._thread.start()
+                # Первая строка запускает отсчет flush_interval, полная пачка - немедленный сброс
+                if len(self._pending) == 1 or len(self._pending) >= self.batch_size:
+                    self._cond.notify()
+        if flush_now:
+            self.flush()
+
+    def _remember_locked(self, key, row: tuple):
+        self._last_rows[key] = row
+        self._last_rows.move_to_end(key)
+        while len(self._last_rows) > self.fingerprint_size:
+            self._last_rows.popitem(last=False)
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                while not self._closing:
+                    backoff = self._not_before - time.monotonic()
+                    if self._pending and backoff > 0:
+                        wait = backoff
+                    elif len(self._pending) >= self.batch_size:
+                        break
+                    elif self._pending:
+                        wait = self._oldest + self.flush_interval - time.monotonic()
+                        if wait <= 0:
+                            break
+                    else:
+                        wait = None
+                    self._cond.wait(wait)
+                if self._closing:
+                    return
+            self.flush()
+
+    def flush(self) -> bool:
+        """
+        Синхронно записывает все ожидающие строки (пачками по batch_size).
+        False - пачку записать не удалось, она и остальные строки остались в буфере.
+        """
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    if not self._pending:
+                        return True
+                    keys = list(self._pending)[:self.batch_size]
+                    rows = [self._pending.pop(key) for key in keys]
+                    if self._pending:
+                        self._oldest = time.monotonic()
+                try:
+                    self.flush_batch(rows)
+                except Exception as e:
+                    with self._lock:
+                        self.failed += 1
+                        # Возвращаем пачку в начало буфера; строки, пришедшие за время записи, новее - они и остаются
+                        self._pending = {**dict(zip(keys, rows)), **self._pending}
+                        self._oldest = time.monotonic()
+                        self._retry_delay = min(max(self._retry_delay * 2, _RETRY_DELAY), _MAX_RETRY_DELAY)
+                        self._not_before = time.monotonic() + self._retry_delay
+                        delay = self._retry_delay
+                    logger.error(f"Не удалось записать пачку из {len(rows)} строк ({self.name}), "
+                                 f"повтор через {delay} с: {e}", exc_info=True)
+                    return False
+                with self._lock:
+                    self.written += len(rows)
+                    self.batches += 1
+                    self._retry_delay = 0.0
+
+    def forget(self, key=None):
+        """Забывает последнюю строку ключа (или все), например после изменения строки в обход буфера."""
+        with self._lock:
+            if key is None:
+                self._last_rows.clear()
+            else:
+                self._last_rows.pop(key, None)
+
+    def close(self):
+        """Останавливает фоновый поток и записывает остаток. Последующие submit() пишут сразу."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        for _ in range(_CLOSE_ATTEMPTS):
+            if self.flush():
+                return
+            time.sleep(self._retry_delay)
+        with self._lock:
+            lost = len(self._pending)
+        logger.error(f"При остановке не записано {lost} строк ({self.name}).")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "submitted": self.submitted,
+                "skipped": self.skipped,
+                "coalesced": self.coalesced,
+                "written": self.written,
+                "batches": self.batches,
+                "failed": self.failed,
+            }